@@ -0,0 +1,326 @@
+"""
+進行中の注文の索引
+
+店舗の注文ボード（厨房）が参照するのは、ほとんどが進行中（受付・確認済み・調理中・受取準備完了）の
+注文だけで、注文全体のごく一部。進行中の注文をプロセス内に店舗・ステータスごとに保持し、
+GET /store/orders?active=true をDBを読まずに返す
+
+- 起動時に進行中の注文を1回のクエリで読み込む
+- 注文の作成・キャンセル・ステータス更新のコミット後に apply() で反映する
+  （完了・キャンセルになった注文は索引から外す）
+- 他のワーカープロセスでの変更や反映漏れは、ACTIVE_ORDERS_RECONCILE_SECONDS ごとに
+  進行中の注文を読み直して補正する（補正した件数は /metrics で確認できる）
+- 読み直し中に反映された変更は、読み直した値より updated_at が新しければ（同じ場合も）残す
+- 索引から外した注文は updated_at を読み直し間隔の2倍の間だけ覚えておき、
+  遅れて届いたそれより古い変更で注文ボードに戻さない（同じ場合は索引に載っている注文と同じく後から届いた方を使う）
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, time
+from time import monotonic
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+import metrics
+from database import SessionLocal
+from models import Order, User
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+ACTIVE_ORDERS_RECONCILE_SECONDS = float(os.getenv("ACTIVE_ORDERS_RECONCILE_SECONDS", "30"))
+
+# 進行中のステータス（これ以外になった注文は索引から外す）
+ACTIVE_STATUSES = ("pending", "confirmed", "preparing", "ready")
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveOrder(NamedTuple):
+    """進行中の注文（OrderResponse の menu・user 以外の項目）"""
+    id: int
+    store_id: int
+    user_id: int
+    menu_id: int
+    quantity: int
+    total_price: int
+    status: str
+    delivery_time: Optional[time]
+    notes: Optional[str]
+    ordered_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_order(cls, order) -> "ActiveOrder":
+        """Order（または同じ列を持つ行のマッピング）から作る"""
+        if isinstance(order, dict):
+            return cls(*(order[name] for name in cls._fields))
+        return cls(*(getattr(order, name) for name in cls._fields))
+
+
+class UserRecord(NamedTuple):
+    """注文したお客様（UserResponse の項目）"""
+    id: int
+    username: str
+    email: str
+    full_name: str
+    role: str
+    store_id: Optional[int]
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserRecord":
+        return cls(*(getattr(user, name) for name in cls._fields))
+
+
+def _local_time(value: datetime) -> datetime:
+    """
+    タイムゾーン付きの日時（PostgreSQLの ordered_at）をローカル時刻のタイムゾーンなしにそろえる
+
+    検索条件の日時はタイムゾーンなしのため、そのままでは比較できない
+    """
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def _is_newer(local: ActiveOrder, loaded: Optional[ActiveOrder]) -> bool:
+    return loaded is None or local.updated_at >= loaded.updated_at
+
+
+class ActiveOrderIndex:
+    """店舗 → ステータス → 注文ID → 注文 の索引"""
+
+    def __init__(self, reconcile_seconds: float = ACTIVE_ORDERS_RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._orders: Dict[int, ActiveOrder] = {}
+        self._by_store: Dict[int, Dict[str, Dict[int, ActiveOrder]]] = {}
+        self._users: Dict[int, UserRecord] = {}
+        # 索引から外した注文（注文ID → (外した変更の updated_at, 忘れる時刻)）
+        self._removed: Dict[int, Tuple[datetime, float]] = {}
+        # 読み直し中に反映された変更（注文ID → 変更後の注文、完了・キャンセルを含む）
+        self._recent: Optional[Dict[int, ActiveOrder]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+        self.reconciles = 0
+        self.corrections = 0
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    # ===== 変更の反映 =====
+
+    def _put(self, order: ActiveOrder):
+        previous = self._orders.pop(order.id, None)
+        if previous is not None:
+            self._by_store[previous.store_id][previous.status].pop(order.id, None)
+        if order.status in ACTIVE_STATUSES:
+            self._orders[order.id] = order
+            self._by_store.setdefault(order.store_id, {}).setdefault(order.status, {})[order.id] = order
+
+    def _is_removed(self, order: ActiveOrder) -> bool:
+        # 外した後に届いた、外した変更より古い変更か
+        removed = self._removed.get(order.id)
+        return removed is not None and removed[1] > monotonic() and order.updated_at < removed[0]
+
+    def _forget_removed(self):
+        now = monotonic()
+        self._removed = {order_id: removed for order_id, removed in self._removed.items() if removed[1] > now}
+
+    def apply(self, order, user: Optional[User] = None):
+        """
+        コミット済みの注文の変更を反映
+
+        Args:
+            order: 注文（Order、または insert().returning() の行のマッピング）
+            user: 注文したお客様（分かっていれば）
+        """
+        entry = ActiveOrder.from_order(order)
+        with self._lock:
+            current = self._orders.get(entry.id)
+            if current is not None and current.updated_at > entry.updated_at:
+                return
+            if current is None and self._is_removed(entry):
+                return
+            self._put(entry)
+            if entry.status in ACTIVE_STATUSES:
+                self._removed.pop(entry.id, None)
+            else:
+                self._removed[entry.id] = (entry.updated_at, monotonic() + self.reconcile_seconds * 2)
+            if self._recent is not None:
+                self._recent[entry.id] = entry
+            if user is not None:
+                self._users[user.id] = UserRecord.from_user(user)
+
+    def apply_many(self, orders: Iterable):
+        """コミット済みの複数の注文の変更を反映（グループコミット用）"""
+        for order in orders:
+            self.apply(order)
+
+    # ===== 読み込み・補正 =====
+
+    def reconcile(self, db: Session):
+        """
+        進行中の注文を読み直して索引を作り直す（起動時の読み込みを兼ねる）
+
+        Args:
+            db: データベースセッション（プライマリ）
+        """
+        with self._load_lock:
+            with self._lock:
+                self._recent = {}
+            try:
+                rows = db.query(Order, User).join(User, User.id == Order.user_id).filter(
+                    Order.status.in_(ACTIVE_STATUSES)
+                ).all()
+            except Exception:
+                with self._lock:
+                    self._recent = None
+                raise
+            loaded = {order.id: ActiveOrder.from_order(order) for order, _ in rows}
+            users = {user.id: UserRecord.from_user(user) for _, user in rows}
+
+            with self._lock:
+                # 読み直し中に反映された変更のうち、読み直した値以降のものを残す
+                for order_id, entry in self._recent.items():
+                    if _is_newer(entry, loaded.get(order_id)):
+                        if entry.status in ACTIVE_STATUSES:
+                            loaded[order_id] = entry
+                        else:
+                            loaded.pop(order_id, None)
+                self._recent = None
+                self._forget_removed()
+
+                drift = sum(1 for order_id, entry in loaded.items() if self._orders.get(order_id) != entry)
+                drift += sum(1 for order_id in self._orders if order_id not in loaded)
+                if self.loaded:
+                    self.corrections += drift
+
+                self._orders = {}
+                self._by_store = {}
+                for entry in loaded.values():
+                    self._put(entry)
+                self._users = {
+                    user_id: users.get(user_id) or self._users[user_id]
+                    for user_id in {entry.user_id for entry in loaded.values()}
+                    if user_id in users or user_id in self._users
+                }
+                self.loaded = True
+                self.reconciles += 1
+
+    def _reconcile_with_session(self):
+        db = SessionLocal()
+        try:
+            self.reconcile(db)
+        finally:
+            db.close()
+
+    def ensure(self):
+        """
+        まだ読み込まれていなければ読み込む（起動時の読み込みに失敗した場合など）
+
+        プロセス全体の索引になるため、リクエストのセッション（レプリカの場合がある）ではなく
+        プライマリのセッションで読む
+        """
+        if not self.loaded:
+            self._reconcile_with_session()
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await run_in_threadpool(self._reconcile_with_session)
+            except Exception:
+                logger.exception("Failed to reconcile active order index")
+            await asyncio.sleep(self.reconcile_seconds)
+
+    # ===== 参照 =====
+
+    def select(self, store_id: int, status: Optional[str] = None,
+               slot_start: Optional[time] = None, slot_end: Optional[time] = None,
+               start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[ActiveOrder]:
+        """
+        店舗の進行中の注文を取得（注文日時の新しい順）
+
+        Args:
+            store_id: 店舗ID
+            status: ステータス（省略時は進行中の全て）
+            slot_start: 受取時間の下限（この時刻を含む）
+            slot_end: 受取時間の上限（この時刻を含まない）
+            start: 注文日時の下限（タイムゾーンなしはローカル時刻）
+            end: 注文日時の上限（タイムゾーンなしはローカル時刻）
+
+        Returns:
+            List[ActiveOrder]: 該当する注文
+        """
+        with self._lock:
+            by_status = self._by_store.get(store_id, {})
+            if status is not None:
+                orders = list(by_status.get(status, {}).values())
+            else:
+                orders = [order for group in by_status.values() for order in group.values()]
+
+        if slot_start is not None or slot_end is not None:
+            orders = [
+                order for order in orders
+                if order.delivery_time is not None
+                and (slot_start is None or order.delivery_time >= slot_start)
+                and (slot_end is None or order.delivery_time < slot_end)
+            ]
+        if start is not None:
+            start = _local_time(start)
+            orders = [order for order in orders if _local_time(order.ordered_at) >= start]
+        if end is not None:
+            end = _local_time(end)
+            orders = [order for order in orders if _local_time(order.ordered_at) <= end]
+        orders.sort(key=lambda order: (order.ordered_at, order.id), reverse=True)
+        return orders
+
+    def users(self, db: Session, user_ids: Iterable[int]) -> Dict[int, UserRecord]:
+        """
+        注文したお客様を取得（索引に無いお客様だけを1回のクエリで読む）
+
+        Args:
+            db: データベースセッション（レプリカ可）
+            user_ids: ユーザーID
+        """
+        user_ids = set(user_ids)
+        with self._lock:
+            found = {user_id: self._users[user_id] for user_id in user_ids if user_id in self._users}
+        missing = user_ids - found.keys()
+        if missing:
+            loaded = [UserRecord.from_user(user) for user in db.query(User).filter(User.id.in_(missing))]
+            with self._lock:
+                for record in loaded:
+                    self._users[record.id] = record
+            found.update((record.id, record) for record in loaded)
+        return found
+
+
+# プロセス全体で共有する索引
+index = ActiveOrderIndex()
+
+metrics.registry.register("active_orders", "gauge",
+                          "Active orders held in the process index.", lambda: len(index))
+metrics.registry.register("active_orders_reconcile_corrections_total", "counter",
+                          "Active order index entries corrected by reconciliation.", lambda: index.corrections)
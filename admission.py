@@ -0,0 +1,258 @@
+"""
+流入制御（アドミッションコントロール）
+
+DBが遅くなるとリクエストがスレッドプールと接続プールの待ちに溜まり、全てのリクエストが
+タイムアウトするまで待たされる。ルートの種類（認証・注文の書き込み・レポート・参照）ごとに
+同時に処理するリクエスト数を制限し、超えた分は待ち行列で待たせる
+
+- 待ち行列が一杯の場合と、待ち時間の上限を過ぎた場合は、すぐに 503 と Retry-After を返す
+- 全体の同時処理数（ADMISSION_MAX_IN_FLIGHT）にも上限があり、空いた枠は優先度の高い
+  種類の待ちから割り当てる（注文 > 認証 > 参照 > レポート）
+- レポートは優先度の高い種類の待ちがある間は開始しない（注文の待ちを先に処理する）
+
+状態の更新はイベントループのスレッド（ミドルウェア）だけが行うため、ロックを使わない
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+from collections import deque
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import metrics
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# 全体の同時処理数（スレッドプール40スレッドより少なくする）
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+
+
+def parse_limit(value: str) -> Optional[Tuple[int, int, float]]:
+    """
+    "同時処理数/待ち行列の長さ/待ち時間の上限（秒）" 形式の制限値を解析
+
+    Args:
+        value: 例 "4/50/3"（同時に4件、50件まで待ち、3秒待っても始まらなければ503）。
+               空文字または "0" は制限なし
+
+    Returns:
+        Optional[Tuple[int, int, float]]: (同時処理数, 待ち行列の長さ, 待ち時間)。制限なしの場合None
+    """
+    value = value.strip()
+    if not value or value == "0":
+        return None
+    concurrency, queue_size, timeout = (value.split("/") + ["0", "0"])[:3]
+    return int(concurrency), int(queue_size or "0"), float(timeout or "0")
+
+
+class RouteClass:
+    """同時処理数を制限するルートの種類"""
+
+    def __init__(self, name: str, priority: int, routes: List[Tuple[str, str]], limit: str,
+                 yields: bool = False):
+        """
+        Args:
+            name: 種類の名前（メトリクス名に使用）
+            priority: 優先度（小さいほど優先）
+            routes: (HTTPメソッドの正規表現, パスの正規表現) のリスト
+            limit: "同時処理数/待ち行列の長さ/待ち時間（秒）" 形式の制限値（待ち時間0は無制限）
+            yields: 優先度の高い種類に待ちがある間は開始しない
+        """
+        self.name = name
+        self.priority = priority
+        self.yields = yields
+        self.routes = [(re.compile(method), re.compile(path)) for method, path in routes]
+        parsed = parse_limit(limit)
+        self.enabled = parsed is not None
+        self.concurrency, self.queue_size, self.timeout = parsed or (0, 0, 0.0)
+        self.in_flight = 0
+        self.waiters: "deque[asyncio.Future]" = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def matches(self, method: str, path: str) -> bool:
+        return self.enabled and any(
+            method_pattern.fullmatch(method) and path_pattern.fullmatch(path)
+            for method_pattern, path_pattern in self.routes
+        )
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < self.concurrency
+
+
+# ルートの種類（上から順に判定、環境変数で制限値を指定、"0" で無効）
+ROUTE_CLASSES = [
+    RouteClass("order", 0, [
+        ("POST", r"/api/customer/orders"),
+        ("PUT", r"/api/customer/orders/[^/]+/cancel"),
+        ("PUT", r"/api/store/orders/[^/]+/status"),
+    ], os.getenv("ADMISSION_ORDER", "24/200/5")),
+    # パスワードのハッシュ計算（CPU）を伴う
+    RouteClass("auth", 1, [
+        ("POST", r"/api/auth/(login|register)"),
+    ], os.getenv("ADMISSION_AUTH", "4/50/3")),
+    RouteClass("report", 3, [
+        ("GET", r"/api/store/reports/.*"),
+        ("GET", r"/api/store/forecast"),
+    ], os.getenv("ADMISSION_REPORT", "2/10/15"), yields=True),
+    RouteClass("read", 2, [
+        ("GET|HEAD", r"/api/.*"),
+    ], os.getenv("ADMISSION_READ", "24/200/3")),
+]
+
+
+class AdmissionController:
+    """ルートの種類ごとの同時処理数と待ち行列"""
+
+    def __init__(self, classes: List[RouteClass] = ROUTE_CLASSES,
+                 max_in_flight: int = ADMISSION_MAX_IN_FLIGHT):
+        self.classes = classes
+        self.by_priority = sorted(classes, key=lambda route_class: route_class.priority)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    def match(self, method: str, path: str) -> Optional[RouteClass]:
+        for route_class in self.classes:
+            if route_class.matches(method, path):
+                return route_class
+        return None
+
+    def _higher_waiting(self, route_class: RouteClass) -> bool:
+        return any(other.waiters for other in self.by_priority if other.priority < route_class.priority)
+
+    def _can_start(self, route_class: RouteClass) -> bool:
+        if route_class.yields and self._higher_waiting(route_class):
+            return False
+        return route_class.has_capacity() and self.in_flight < self.max_in_flight
+
+    def _start(self, route_class: RouteClass):
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        self.in_flight += 1
+
+    async def acquire(self, route_class: RouteClass) -> bool:
+        """
+        処理の開始を待つ
+
+        Args:
+            route_class: リクエストのルートの種類
+
+        Returns:
+            bool: 開始できたか（待ち行列が一杯・待ち時間切れの場合はFalse）
+        """
+        # 同じ種類の待ちがあれば追い越さない
+        if not route_class.waiters and self._can_start(route_class):
+            self._start(route_class)
+            return True
+        if len(route_class.waiters) >= route_class.queue_size:
+            route_class.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.timeout or None)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # 切断などで待ちを中断した場合、割り当て済みの枠は返す
+            if self._withdraw(route_class, waiter):
+                self.release(route_class)
+            raise
+        if self._withdraw(route_class, waiter):
+            return True
+        route_class.timed_out += 1
+        return False
+
+    def _withdraw(self, route_class: RouteClass, waiter: asyncio.Future) -> bool:
+        # 待ちをやめる。既に枠が割り当てられていた場合はTrue
+        if waiter.done() and not waiter.cancelled():
+            return True
+        waiter.cancel()
+        try:
+            route_class.waiters.remove(waiter)
+        except ValueError:
+            pass
+        # 先頭の待ちが抜けたことで開始できる待ちがあれば割り当てる
+        self._dispatch()
+        return False
+
+    def release(self, route_class: RouteClass):
+        """処理の終了を記録し、空いた枠を優先度の高い待ちから割り当てる"""
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for route_class in self.by_priority:
+            while route_class.waiters and self._can_start(route_class):
+                waiter = route_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._start(route_class)
+                waiter.set_result(True)
+            if self.in_flight >= self.max_in_flight:
+                return
+
+
+class AdmissionMiddleware:
+    """ルートの種類ごとに同時処理数を制限するASGIミドルウェア"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None):
+        self.app = app
+        self.controller = controller or admission
+
+    async def __call__(self, scope, receive, send):
+        route_class = (
+            self.controller.match(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        )
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(route_class):
+            body = json.dumps({"detail": "Server is busy"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(route_class.timeout))).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+
+# プロセス全体で共有する流入制御
+admission = AdmissionController()
+
+for _route_class in ROUTE_CLASSES:
+    if not _route_class.enabled:
+        continue
+    metrics.registry.register(f"admission_{_route_class.name}_in_flight", "gauge",
+                              f"Admitted {_route_class.name} requests in progress.",
+                              lambda route_class=_route_class: route_class.in_flight)
+    metrics.registry.register(f"admission_{_route_class.name}_queued", "gauge",
+                              f"{_route_class.name.capitalize()} requests waiting for admission.",
+                              lambda route_class=_route_class: len(route_class.waiters))
+    metrics.registry.register(f"admission_{_route_class.name}_rejected_total", "counter",
+                              f"{_route_class.name.capitalize()} requests rejected because the queue was full.",
+                              lambda route_class=_route_class: route_class.rejected)
+    metrics.registry.register(f"admission_{_route_class.name}_timed_out_total", "counter",
+                              f"{_route_class.name.capitalize()} requests rejected after waiting too long.",
+                              lambda route_class=_route_class: route_class.timed_out)
@@ -0,0 +1,295 @@
+"""
+注文分析（列指向スナップショット）
+
+注文を列ごとの NumPy 配列としてメモリに保持し、曜日×時間帯のヒートマップや
+客単価・受取時間の分布をベクトル演算（bincount / percentile）で集計する
+
+- 初回はアーカイブを含む全注文を読み込み、以降は updated_at が直近の注文だけを
+  読み直して追加・更新する（ステータス変更も反映される）
+- updated_at はトランザクション開始時刻のため、ANALYTICS_LOOKBACK_SECONDS だけ
+  遡って読み直し、遅れてコミットされた変更を取りこぼさない
+- 読み込みは ANALYTICS_REFRESH_SECONDS ごとに、参照したリクエストのスレッドが1つだけ行う
+- 集計はスナップショットだけで行い、リクエストごとのSQLは発行しない（更新時を除く）
+
+日時はDBの日時をそのまま（タイムゾーン変換せずに）日と分に分解して持つ
+"""
+
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from archive import AllOrders
+from models import Order
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+ANALYTICS_REFRESH_SECONDS = float(os.getenv("ANALYTICS_REFRESH_SECONDS", "10"))
+ANALYTICS_LOOKBACK_SECONDS = float(os.getenv("ANALYTICS_LOOKBACK_SECONDS", "120"))
+
+# ステータスコード（配列には位置を格納）
+STATUSES = ["pending", "confirmed", "preparing", "ready", "completed", "cancelled"]
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+CANCELLED = STATUS_CODES["cancelled"]
+UNKNOWN_STATUS = len(STATUSES)
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+# 列名 → dtype
+COLUMNS = {
+    "id": np.int64,
+    "store_id": np.int32,
+    "day": np.int32,          # date.toordinal()
+    "minute": np.int16,       # 注文時刻（0時からの分）
+    "menu_id": np.int32,
+    "user_id": np.int32,
+    "quantity": np.int16,
+    "total_price": np.int32,
+    "status": np.uint8,       # STATUSES の位置
+    "delivery": np.int16,     # 受取時間（0時からの分、未指定は-1）
+}
+
+
+def _select(entity):
+    return select(
+        entity.id, entity.store_id, entity.ordered_at, entity.menu_id, entity.user_id, entity.quantity,
+        entity.total_price, entity.status, entity.delivery_time, entity.updated_at
+    )
+
+
+def _to_columns(rows) -> Dict[str, np.ndarray]:
+    n = len(rows)
+    columns = {name: np.empty(n, dtype=dtype) for name, dtype in COLUMNS.items()}
+    for i, (order_id, store_id, ordered_at, menu_id, user_id, quantity, total_price,
+            status, delivery_time, _) in enumerate(rows):
+        columns["id"][i] = order_id
+        columns["store_id"][i] = store_id
+        columns["day"][i] = ordered_at.toordinal()
+        columns["minute"][i] = ordered_at.hour * 60 + ordered_at.minute
+        columns["menu_id"][i] = menu_id
+        columns["user_id"][i] = user_id
+        columns["quantity"][i] = quantity
+        columns["total_price"][i] = total_price
+        columns["status"][i] = STATUS_CODES.get(status, UNKNOWN_STATUS)
+        columns["delivery"][i] = (
+            delivery_time.hour * 60 + delivery_time.minute if delivery_time is not None else -1
+        )
+    return columns
+
+
+class OrderSnapshot:
+    """
+    注文の列指向スナップショット
+
+    各列は容量を倍々に確保した配列で、先頭 size 件が有効。行は id の昇順に並ぶ
+    列と件数は1つのタプルとして差し替えるため、読み込み中でも参照側は
+    同じ長さの列の組を受け取る
+    """
+
+    def __init__(self, refresh_seconds: float = ANALYTICS_REFRESH_SECONDS,
+                 lookback_seconds: float = ANALYTICS_LOOKBACK_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self._lock = threading.Lock()
+        self._state = ({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}, 0)
+        self._watermark: Optional[datetime] = None
+        self._refreshed_at: Optional[float] = None
+
+    @property
+    def size(self) -> int:
+        return self._state[1]
+
+    def reset(self):
+        """次の参照時に全件を読み込み直す"""
+        with self._lock:
+            self._state = ({name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}, 0)
+            self._watermark = None
+            self._refreshed_at = None
+
+    def _fresh(self) -> bool:
+        return self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_seconds
+
+    def refresh(self, db: Session, force: bool = False):
+        """
+        前回から ANALYTICS_REFRESH_SECONDS 以上経っていれば変更分を読み込む
+
+        Args:
+            db: データベースセッション（レプリカ可）
+            force: 経過時間に関わらず読み込む
+        """
+        if not force and self._fresh():
+            return
+        with self._lock:
+            if not force and self._fresh():
+                return
+            if self._watermark is None:
+                # 初回（または空だった場合）はアーカイブを含めて全件
+                rows = db.execute(_select(AllOrders)).all()
+            else:
+                rows = db.execute(
+                    _select(Order).where(Order.updated_at >= self._watermark - self.lookback)
+                ).all()
+            self._merge(rows)
+            self._refreshed_at = time.monotonic()
+
+    def _merge(self, rows):
+        if not rows:
+            return
+        stamps = [row[-1] for row in rows if row[-1] is not None]
+        if stamps and (self._watermark is None or max(stamps) > self._watermark):
+            self._watermark = max(stamps)
+
+        incoming = _to_columns(rows)
+        order = np.argsort(incoming["id"], kind="stable")
+        incoming = {name: values[order] for name, values in incoming.items()}
+
+        columns, size = self._state
+
+        # 既存の行は上書き
+        ids = columns["id"][:size]
+        positions = np.searchsorted(ids, incoming["id"])
+        found = positions < size
+        found[found] = ids[positions[found]] == incoming["id"][found]
+        if found.any():
+            for name in COLUMNS:
+                columns[name][positions[found]] = incoming[name][found]
+
+        # 新しい行は有効範囲の後ろに書いてから件数を公開する
+        new = ~found
+        count = int(new.sum())
+        if not count:
+            return
+        needed = size + count
+        if needed > len(columns["id"]):
+            capacity = max(needed, 2 * len(columns["id"]), 1024)
+            grown = {}
+            for name, dtype in COLUMNS.items():
+                grown[name] = np.empty(capacity, dtype=dtype)
+                grown[name][:size] = columns[name][:size]
+            columns = grown
+        for name in COLUMNS:
+            columns[name][size:needed] = incoming[name][new]
+
+        # 遅れてコミットされた小さいIDがあれば並べ直す
+        if size and incoming["id"][new][0] < columns["id"][size - 1]:
+            order = np.argsort(columns["id"][:needed], kind="stable")
+            columns = {name: columns[name][:needed][order] for name in COLUMNS}
+
+        self._state = (columns, needed)
+
+    def select(self, start: date, end: date, store_id: Optional[int] = None,
+               include_cancelled: bool = False) -> Dict[str, np.ndarray]:
+        """
+        期間内の注文の列を取得
+
+        Args:
+            start: 開始日
+            end: 終了日（この日を含む）
+            store_id: 店舗ID（省略時は全店舗）
+            include_cancelled: キャンセル済みの注文も含める
+
+        Returns:
+            Dict[str, np.ndarray]: 列名 → 該当する行の値
+        """
+        columns, size = self._state
+        day = columns["day"][:size]
+        selected = (day >= start.toordinal()) & (day <= end.toordinal())
+        if store_id is not None:
+            selected &= columns["store_id"][:size] == store_id
+        if not include_cancelled:
+            selected &= columns["status"][:size] != CANCELLED
+        return {name: values[:size][selected] for name, values in columns.items()}
+
+
+def heatmap(rows: Dict[str, np.ndarray], metric: str = "orders") -> np.ndarray:
+    """
+    曜日×時間帯（注文時刻）のヒートマップを集計
+
+    Args:
+        rows: OrderSnapshot.select() の結果
+        metric: "orders"（注文数）/ "quantity"（個数）/ "sales"（売上）
+
+    Returns:
+        np.ndarray: 7×24（月曜始まり×0〜23時）の集計値
+    """
+    # date.toordinal() は 0001-01-01（月曜）が1なので、(日 - 1) % 7 が月曜始まりの曜日
+    weekday = (rows["day"].astype(np.int64) - 1) % 7
+    hour = rows["minute"].astype(np.int64) // 60
+    weights = None
+    if metric == "quantity":
+        weights = rows["quantity"]
+    elif metric == "sales":
+        weights = rows["total_price"]
+    cells = np.bincount(weekday * 24 + hour, weights=weights, minlength=7 * 24)
+    return cells.astype(np.int64).reshape(7, 24)
+
+
+def distribution(rows: Dict[str, np.ndarray], bucket_minutes: int = 15) -> dict:
+    """
+    客単価と受取時間の分布を集計
+
+    1人のお客様が同じ日に行った注文を1回の買い物（バスケット）として数える
+
+    Args:
+        rows: OrderSnapshot.select() の結果
+        bucket_minutes: 受取時間の集計単位（分）
+
+    Returns:
+        dict: 注文数・客単価・受取時間の分布・注文から受取までの時間
+    """
+    prices = rows["total_price"].astype(np.int64)
+    quantities = rows["quantity"].astype(np.int64)
+    order_count = int(prices.size)
+
+    # バスケット（お客様×日）ごとの合計
+    basket_keys = (rows["user_id"].astype(np.int64) << 32) | rows["day"].astype(np.int64)
+    _, basket_index = np.unique(basket_keys, return_inverse=True)
+    basket_sales = np.bincount(basket_index, weights=prices)
+    basket_quantity = np.bincount(basket_index, weights=quantities)
+
+    # 受取時間の分布
+    delivery = rows["delivery"].astype(np.int64)
+    has_delivery = delivery >= 0
+    buckets = delivery[has_delivery] // bucket_minutes
+    bucket_count = -(-24 * 60 // bucket_minutes)
+    orders_by_bucket = np.bincount(buckets, minlength=bucket_count)
+    quantity_by_bucket = np.bincount(buckets, weights=quantities[has_delivery], minlength=bucket_count)
+    delivery_times = [
+        {
+            "time": f"{bucket * bucket_minutes // 60:02d}:{bucket * bucket_minutes % 60:02d}",
+            "orders": int(orders_by_bucket[bucket]),
+            "quantity": int(quantity_by_bucket[bucket]),
+        }
+        for bucket in np.flatnonzero(orders_by_bucket)
+    ]
+
+    # 注文から受取までの時間（受取時間が注文時刻より後の注文）
+    lead = delivery[has_delivery] - rows["minute"].astype(np.int64)[has_delivery]
+    lead = lead[lead >= 0]
+    lead_p50 = lead_p90 = None
+    if lead.size:
+        lead_p50, lead_p90 = (round(float(value), 1) for value in np.percentile(lead, [50, 90]))
+
+    return {
+        "order_count": order_count,
+        "basket_count": int(basket_sales.size),
+        "average_order_value": round(float(prices.mean()), 1) if order_count else 0.0,
+        "average_basket_value": round(float(basket_sales.mean()), 1) if basket_sales.size else 0.0,
+        "average_basket_quantity": round(float(basket_quantity.mean()), 2) if basket_quantity.size else 0.0,
+        "bucket_minutes": bucket_minutes,
+        "delivery_times": delivery_times,
+        "lead_time_p50_minutes": lead_p50,
+        "lead_time_p90_minutes": lead_p90,
+    }
+
+
+# プロセス全体で共有するスナップショット
+snapshot = OrderSnapshot()
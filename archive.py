@@ -0,0 +1,187 @@
+"""
+注文アーカイブ
+
+一定期間（ORDER_ARCHIVE_AFTER_DAYS）を過ぎた完了・キャンセル済みの注文を
+orders から orders_archive へ移動し、注文テーブルを小さく保つ
+
+履歴系のエンドポイントは order_source() を使うことで、
+要求された期間・ステータスがアーカイブに及ぶ場合だけ両テーブルを横断して読む
+
+使い方:
+    python archive.py                  # 既定の期間でアーカイブ
+    python archive.py --days 180       # 180日より前の注文をアーカイブ
+    python archive.py --dry-run        # 対象件数のみ表示
+"""
+
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, select, text, union_all
+from sqlalchemy.orm import aliased
+from dotenv import load_dotenv
+
+from database import engine
+from models import Order, ArchivedOrder
+
+# 環境変数を読み込み
+load_dotenv()
+
+# アーカイブ対象とする経過日数
+ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+
+# アーカイブ対象のステータス（これ以外はアーカイブされない）
+ARCHIVABLE_STATUSES = ("completed", "cancelled")
+
+ORDER_COLUMNS = [column.name for column in Order.__table__.columns]
+
+# 注文テーブルとアーカイブを横断するエンティティ
+_all_orders = union_all(
+    select(*Order.__table__.c),
+    select(*[ArchivedOrder.__table__.c[name] for name in ORDER_COLUMNS]),
+).subquery("orders_all")
+AllOrders = aliased(Order, _all_orders, name="orders_all")
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """
+    アーカイブ済みの可能性がある注文の境界日時
+
+    Args:
+        now: 基準日時（省略時は現在）
+
+    Returns:
+        datetime: この日時より前の注文はアーカイブされている可能性がある
+    """
+    return (now or datetime.now()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def needs_archive(start_dt: Optional[datetime] = None, status_filter: Optional[str] = None) -> bool:
+    """
+    指定条件の検索でアーカイブを読む必要があるか判定
+
+    Args:
+        start_dt: 検索期間の開始日時（Noneは期間指定なし）
+        status_filter: ステータスフィルタ
+
+    Returns:
+        bool: アーカイブを含める必要がある場合True
+    """
+    if status_filter and status_filter not in ARCHIVABLE_STATUSES:
+        return False
+    if start_dt is not None and start_dt >= archive_cutoff():
+        return False
+    return True
+
+
+def order_source(start_dt: Optional[datetime] = None, status_filter: Optional[str] = None):
+    """
+    検索条件に応じた注文エンティティを取得
+
+    アーカイブが不要な場合は Order、必要な場合は両テーブルを
+    UNION ALL した AllOrders を返す（どちらも Order と同じ属性で検索できる）
+
+    Args:
+        start_dt: 検索期間の開始日時
+        status_filter: ステータスフィルタ
+    """
+    return AllOrders if needs_archive(start_dt, status_filter) else Order
+
+
+def _month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + 1, 1, 1) if value.month == 12 else date(value.year, value.month + 1, 1)
+
+
+def ensure_partitions(conn, first: datetime, last: datetime):
+    """
+    PostgreSQLで指定範囲の月次パーティションを作成
+
+    Args:
+        conn: DB接続
+        first: 最も古い注文日時
+        last: 最も新しい注文日時
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    month = _month_start(first.date())
+    while month <= last.date():
+        following = _next_month(month)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS orders_archive_y{month.year}m{month.month:02d} "
+            f"PARTITION OF orders_archive FOR VALUES FROM ('{month.isoformat()}') "
+            f"TO ('{following.isoformat()}')"
+        ))
+        month = following
+
+
+def archive_orders(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = 5000,
+                   dry_run: bool = False) -> int:
+    """
+    古い完了・キャンセル済みの注文をアーカイブへ移動
+
+    バッチごとに1トランザクションで INSERT ... SELECT と DELETE を行う
+
+    Args:
+        older_than_days: この日数より前の注文を対象にする
+        batch_size: 1トランザクションで移動する件数
+        dry_run: Trueの場合は対象件数を数えるだけ
+
+    Returns:
+        int: 移動した（dry_runの場合は対象の）件数
+    """
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    condition = (Order.status.in_(ARCHIVABLE_STATUSES), Order.ordered_at < cutoff)
+
+    if dry_run:
+        with engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(Order).where(*condition)).scalar()
+
+    orders = Order.__table__
+    archive = ArchivedOrder.__table__
+    moved = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(Order.id, Order.ordered_at)
+                .where(*condition)
+                .order_by(Order.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            ensure_partitions(conn, min(row.ordered_at for row in rows),
+                              max(row.ordered_at for row in rows))
+            conn.execute(insert(archive).from_select(
+                ORDER_COLUMNS,
+                select(*orders.c).where(orders.c.id.in_(ids)),
+            ))
+            conn.execute(delete(orders).where(orders.c.id.in_(ids)))
+        moved += len(ids)
+        print(f"    ... {moved} orders archived")
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="古い完了・キャンセル済み注文のアーカイブ")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"この日数より前の注文を対象にする（既定: {ARCHIVE_AFTER_DAYS}）")
+    parser.add_argument("--batch-size", type=int, default=5000, help="1トランザクションで移動する件数")
+    parser.add_argument("--dry-run", action="store_true", help="対象件数のみ表示する")
+    args = parser.parse_args()
+
+    if args.days < ARCHIVE_AFTER_DAYS:
+        # 期間が短いと履歴検索がアーカイブを読まずに取りこぼす
+        parser.error(f"--days must be at least ORDER_ARCHIVE_AFTER_DAYS ({ARCHIVE_AFTER_DAYS})")
+
+    count = archive_orders(args.days, args.batch_size, args.dry_run)
+    if args.dry_run:
+        print(f"{count} orders would be archived")
+    else:
+        print(f"✓ {count} orders archived")
@@ -0,0 +1,41 @@
+"""
+ベンチマーク用データセット
+
+init_data.py の初期データと負荷試験用データ生成を使ってDBを準備する
+"""
+
+from datetime import date, time
+
+from init_data import insert_initial_data, generate_bulk_data
+from models import Store, User, Menu
+import slots
+
+# ベンチマーク中に受取時間枠が埋まって注文が409にならないようにする容量
+BENCH_SLOT_CAPACITY = 1_000_000
+
+
+def seed(db, customers: int, orders: int, days: int, seed: int = 42) -> dict:
+    """
+    ベンチマーク用データを投入
+
+    Args:
+        db: データベースセッション
+        customers: 生成するお客様ユーザー数
+        orders: 生成する注文数
+        days: 注文を分布させる日数
+        seed: 乱数シード
+
+    Returns:
+        dict: ベンチマークで使うユーザー名とメニューIDの一覧
+    """
+    insert_initial_data()
+    generate_bulk_data(customers, orders, days, seed=seed)
+    for (store_id,) in db.query(Store.id).all():
+        slots.set_capacity(db, store_id, date.today(), BENCH_SLOT_CAPACITY, time.min, time.max)
+    db.commit()
+
+    return {
+        "customers": [u.username for u in db.query(User.username).filter(User.role == "customer").all()],
+        "store_users": [u.username for u in db.query(User.username).filter(User.role == "store").all()],
+        "menu_ids": [m.id for m in db.query(Menu.id).all()],
+    }
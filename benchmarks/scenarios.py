@@ -0,0 +1,131 @@
+"""
+ベンチマークシナリオ
+
+各シナリオは仮想ユーザーごとのループを並行実行し、
+終了時刻までリクエストを送り続ける
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+
+class Recorder:
+    """エンドポイント別のレイテンシとエラーを記録"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+    async def call(self, client, method: str, template: str, url: str, **kwargs):
+        """
+        リクエストを送信して計測
+
+        Args:
+            client: httpx.AsyncClient
+            method: HTTPメソッド
+            template: 集計に使うルートテンプレート
+            url: 実際のURL
+        """
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[f"{method} {template}"].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[f"{method} {template}"] += 1
+        return response
+
+
+class Context:
+    """シナリオ実行に必要な情報"""
+
+    def __init__(self, client, customer_headers, store_headers, menu_ids, seed):
+        self.client = client
+        self.customer_headers = customer_headers
+        self.store_headers = store_headers
+        self.menu_ids = menu_ids
+        self.rng = random.Random(seed)
+
+
+async def _lunch_customer(ctx: Context, rec: Recorder, headers: dict, stop_at: float):
+    rng = random.Random(ctx.rng.random())
+    while time.perf_counter() < stop_at:
+        await rec.call(ctx.client, "GET", "/api/customer/menus", "/api/customer/menus",
+                       params={"per_page": 100}, headers=headers)
+        hour, minute = rng.choice([(11, 45), (12, 0), (12, 0), (12, 15), (12, 30), (13, 0)])
+        response = await rec.call(ctx.client, "POST", "/api/customer/orders", "/api/customer/orders",
+                                  json={"menu_id": rng.choice(ctx.menu_ids),
+                                        "quantity": rng.randint(1, 3),
+                                        "delivery_time": f"{hour:02d}:{minute:02d}:00"},
+                                  headers=headers)
+        if rng.random() < 0.25:
+            await rec.call(ctx.client, "GET", "/api/customer/orders", "/api/customer/orders",
+                           headers=headers)
+        if response.status_code < 400 and rng.random() < 0.25:
+            order_id = response.json()["id"]
+            await rec.call(ctx.client, "GET", "/api/customer/orders/{order_id}",
+                           f"/api/customer/orders/{order_id}", headers=headers)
+
+
+async def lunch_rush(ctx: Context, rec: Recorder, stop_at: float, users: int = 50):
+    """昼のピーク: 多数のお客様がメニューを見て注文する"""
+    headers = [ctx.customer_headers[i % len(ctx.customer_headers)] for i in range(users)]
+    await asyncio.gather(*(_lunch_customer(ctx, rec, h, stop_at) for h in headers))
+
+
+async def _kitchen_tablet(ctx: Context, rec: Recorder, headers: dict, stop_at: float):
+    while time.perf_counter() < stop_at:
+        await rec.call(ctx.client, "GET", "/api/store/orders", "/api/store/orders",
+                       params={"status_filter": "pending"}, headers=headers)
+        await rec.call(ctx.client, "GET", "/api/store/orders", "/api/store/orders",
+                       headers=headers)
+        await rec.call(ctx.client, "GET", "/api/store/dashboard", "/api/store/dashboard",
+                       headers=headers)
+        await rec.call(ctx.client, "GET", "/api/store/production-plan", "/api/store/production-plan",
+                       headers=headers)
+
+
+async def kitchen_polling(ctx: Context, rec: Recorder, stop_at: float, tablets: int = 12):
+    """厨房タブレット: 注文一覧・ダッシュボード・製造計画をポーリングする"""
+    headers = [ctx.store_headers[i % len(ctx.store_headers)] for i in range(tablets)]
+    await asyncio.gather(*(_kitchen_tablet(ctx, rec, h, stop_at) for h in headers))
+
+
+async def _report_viewer(ctx: Context, rec: Recorder, headers: dict, stop_at: float):
+    today = date.today()
+    requests = [
+        {"period": "daily"},
+        {"period": "weekly"},
+        {"period": "monthly"},
+        {"period": "daily", "start_date": (today - timedelta(days=30)).isoformat(),
+         "end_date": today.isoformat()},
+    ]
+    index = 0
+    while time.perf_counter() < stop_at:
+        await rec.call(ctx.client, "GET", "/api/store/reports/sales", "/api/store/reports/sales",
+                       params=requests[index % len(requests)], headers=headers)
+        index += 1
+
+
+async def reports(ctx: Context, rec: Recorder, stop_at: float, viewers: int = 2):
+    """売上レポート: 店舗スタッフが期間別レポートを生成する"""
+    headers = [ctx.store_headers[i % len(ctx.store_headers)] for i in range(viewers)]
+    await asyncio.gather(*(_report_viewer(ctx, rec, h, stop_at) for h in headers))
+
+
+async def mixed(ctx: Context, rec: Recorder, stop_at: float):
+    """昼のピーク・厨房ポーリング・レポート生成を同時に実行する"""
+    await asyncio.gather(
+        lunch_rush(ctx, rec, stop_at, users=30),
+        kitchen_polling(ctx, rec, stop_at, tablets=8),
+        reports(ctx, rec, stop_at, viewers=1),
+    )
+
+
+SCENARIOS = {
+    "lunch_rush": lunch_rush,
+    "kitchen_polling": kitchen_polling,
+    "reports": reports,
+    "mixed": mixed,
+}
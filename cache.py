@@ -0,0 +1,133 @@
+"""
+プロセス内キャッシュ
+
+短時間のTTLで計算結果を共有するためのキャッシュ
+期限切れ時はキーごとに1スレッドだけが再計算し、同じキーの他のスレッドはその結果を待つ
+（別のキーの読み込み・破棄は待たない）
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from dotenv import load_dotenv
+
+# 環境変数を読み込み
+load_dotenv()
+
+
+class _Load:
+    """キーごとの計算中の値（同じキーを要求したスレッドが結果を待つ）"""
+    __slots__ = ("generation", "done", "value", "error", "discarded")
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.discarded = False
+
+
+class TTLCache:
+    """有効期限付きのキー・値キャッシュ"""
+
+    def __init__(self, ttl: float, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._loading: Dict[Hashable, _Load] = {}
+        # invalidate() で全て破棄するたびに増やす（計算中の値を保存しない）
+        self._generation = 0
+        # 辞書の操作だけを保護する（loader の実行中は保持しない）
+        self._lock = threading.Lock()
+
+    def get_or_set(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        キャッシュから取得し、無いか期限切れの場合は loader で計算して保存
+
+        計算中に同じキーが破棄された場合、計算した値は呼び出し元に返すが保存しない
+
+        Args:
+            key: キャッシュキー
+            loader: 値を計算する関数
+
+        Returns:
+            Any: キャッシュされた値
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            load = self._loading.get(key)
+            leader = load is None
+            if leader:
+                load = self._loading[key] = _Load(self._generation)
+
+        if not leader:
+            # 他のスレッドが計算中の場合はその結果を使う
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            return load.value
+
+        try:
+            load.value = loader()
+        except BaseException as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is load:
+                    del self._loading[key]
+                if load.error is None and not load.discarded and load.generation == self._generation:
+                    self._store(key, load.value)
+            load.done.set()
+        return load.value
+
+    def _store(self, key: Hashable, value: Any):
+        # 挿入順に並ぶため、上限に達したら期限切れ、次に最も古いエントリから捨てる（ロック内で呼ぶ）
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key: Hashable = None):
+        """
+        キャッシュを破棄（計算中の値も保存されなくなる）
+
+        Args:
+            key: 破棄するキー（省略時は全て）
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._loading.clear()
+                self._generation += 1
+            else:
+                self._entries.pop(key, None)
+                load = self._loading.pop(key, None)
+                if load is not None:
+                    load.discarded = True
+
+
+# ===== キャッシュインスタンス =====
+
+# 製造計画（厨房の多数の画面で共有）
+PRODUCTION_PLAN_CACHE_SECONDS = float(os.getenv("PRODUCTION_PLAN_CACHE_SECONDS", "2"))
+production_plan_cache = TTLCache(PRODUCTION_PLAN_CACHE_SECONDS)
+
+# 受取時間枠の空き状況（注文画面ごとに取得される）
+SLOT_AVAILABILITY_CACHE_SECONDS = float(os.getenv("SLOT_AVAILABILITY_CACHE_SECONDS", "3"))
+slot_availability_cache = TTLCache(SLOT_AVAILABILITY_CACHE_SECONDS)
+
+# メニューの残数・売り切れ状態（メニュー一覧ごとに参照される）
+MENU_STOCK_CACHE_SECONDS = float(os.getenv("MENU_STOCK_CACHE_SECONDS", "5"))
+menu_stock_cache = TTLCache(MENU_STOCK_CACHE_SECONDS)
@@ -5,17 +5,33 @@ FastAPIの依存関数（Dependency Injection）を定義
 認証が必要なエンドポイントで使用
 """
 
+import os
 from typing import Optional
+from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import bindparam, select
 from sqlalchemy.orm import Session
 
 from database import get_db
 from auth import verify_token
 from models import User
 
+# 環境変数を読み込み
+load_dotenv()
+
+# 全店舗にまたがる運用・調査用API（/debug）を使えるユーザー名（カンマ区切り、空の場合は誰も使えない）
+ADMIN_USERNAMES = frozenset(
+    name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()
+)
+
 # HTTPBearer認証スキーム
 security = HTTPBearer()
+# 認証が任意のエンドポイント用（トークンが無くてもエラーにしない）
+optional_security = HTTPBearer(auto_error=False)
+
+# 認証済みユーザーの取得（全リクエストで実行するため、組み立て済みのステートメントを使い回す）
+_user_by_username = select(User).where(User.username == bindparam("username")).limit(1)
 
 
 def get_current_user(
@@ -35,6 +51,34 @@ def get_current_user(
     Raises:
         HTTPException: 認証に失敗した場合
     """
+    return _user_from_token(credentials.credentials, db)
+
+
+def get_optional_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    db: Session = Depends(get_db)
+) -> Optional[User]:
+    """
+    ログインしていれば現在のユーザーを取得
+    
+    期限切れのトークンが残っていても、ログインしていない場合と同じに扱う
+    
+    Args:
+        credentials: 認証情報（無い場合はNone）
+        db: データベースセッション
+        
+    Returns:
+        Optional[User]: 現在のユーザー（トークンが無い・無効な場合はNone）
+    """
+    if credentials is None:
+        return None
+    try:
+        return _user_from_token(credentials.credentials, db)
+    except HTTPException:
+        return None
+
+
+def _user_from_token(token: str, db: Session) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -43,14 +87,14 @@ def get_current_user(
     
     try:
         # トークンからユーザー名を取得
-        username = verify_token(credentials.credentials)
+        username = verify_token(token)
         if username is None:
             raise credentials_exception
     except Exception:
         raise credentials_exception
     
     # データベースからユーザーを取得
-    user = db.query(User).filter(User.username == username).first()
+    user = db.execute(_user_by_username, {"username": username}).scalars().first()
     if user is None:
         raise credentials_exception
     
@@ -107,11 +151,41 @@ def get_current_store_user(current_user: User = Depends(get_current_active_user)
         User: 店舗ユーザー
         
     Raises:
-        HTTPException: 店舗権限がない場合
+        HTTPException: 店舗権限がない・所属店舗が無い場合
     """
     if current_user.role != "store":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Store access required"
         )
-    return current_user
\ No newline at end of file
+    # 店舗向けの全てのクエリは所属店舗で絞り込むため、店舗に属さないスタッフは利用できない
+    if current_user.store_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Store user is not assigned to a store"
+        )
+    return current_user
+
+
+def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+    """
+    現在の管理者ユーザーを取得
+
+    /debug のクエリタイムライン（全店舗のバインドパラメータを含む）とプロファイラは
+    プロセス全体に作用するため、店舗スタッフではなく ADMIN_USERNAMES のユーザーに限る
+
+    Args:
+        current_user: 現在のユーザー
+
+    Returns:
+        User: 管理者ユーザー
+
+    Raises:
+        HTTPException: 管理者権限がない場合
+    """
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator access required"
+        )
+    return current_user
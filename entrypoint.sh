@@ -28,6 +28,9 @@ print('Database connection failed after 30 attempts')
 sys.exit(1)
 "
 
+echo "Upgrading database..."
+python upgrade_db.py
+
 echo "Initializing database..."
 python init_data.py
 
@@ -0,0 +1,391 @@
+"""
+メニューの日別需要予測
+
+メニューごとの日別販売個数に、曜日の季節性つき指数平滑法（加法型 Holt-Winters、
+トレンドなし）を当てはめ、当日以降の販売個数を予測して menu_forecasts に保存する
+
+- 学習データは売上レポートの日別キャッシュ（report_cache）から読むため、
+  過去 FORECAST_HISTORY_DAYS 日分でも集計はほぼ発生しない
+- 全メニューを行列（メニュー×日）として扱い、日ごとの更新を全メニューまとめて計算する
+- 予測はCPUを使うため、アプリケーションでは毎日 FORECAST_HOUR 時以降に
+  別プロセス（spawn）で1回だけ実行する（複数ワーカーでも forecast_runs で1プロセスに絞る）
+- GET /store/forecast は保存済みの予測を読むだけ
+
+使い方:
+    python forecast.py                         # 今すぐ予測して保存
+    python forecast.py --backtest              # 過去データで予測誤差を評価
+    python forecast.py --backtest --weeks 12   # 直近12週を評価
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+import report_cache
+from database import SessionLocal, insert_or_ignore
+from models import ForecastRun, Menu, MenuForecast, Store
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+# 予測を実行する時刻（この時以降、その日の最初の1回）
+FORECAST_HOUR = int(os.getenv("FORECAST_HOUR", "3"))
+# 学習に使う日数
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "112"))
+# 予測する日数
+FORECAST_HORIZON_DAYS = int(os.getenv("FORECAST_HORIZON_DAYS", "14"))
+# 水準・曜日成分の平滑化係数
+FORECAST_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.3"))
+FORECAST_GAMMA = float(os.getenv("FORECAST_GAMMA", "0.1"))
+
+# 初期値の推定に使う日数
+INIT_DAYS = 28
+# 予測誤差の推定に使う直近の日数
+ERROR_WINDOW_DAYS = 28
+# 片側90%点（正規分布）
+UPPER_Z = 1.2816
+# 実行中のまま残った実行記録（プロセス停止など）を取り直すまでの時間
+RUN_LOCK_TIMEOUT = timedelta(hours=1)
+# 予測に失敗した場合に再実行するまでの秒数
+RETRY_SECONDS = 600
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+# ===== モデル =====
+
+def weekdays(start: date, days: int) -> np.ndarray:
+    """start から days 日分の曜日（月曜=0）"""
+    return (start.toordinal() - 1 + np.arange(days)) % 7
+
+
+def fit(history: np.ndarray, start: date, alpha: float = FORECAST_ALPHA,
+        gamma: float = FORECAST_GAMMA) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    日別販売個数に曜日の季節性つき指数平滑法を当てはめる
+
+    Args:
+        history: メニュー×日の販売個数（日は start から連続）
+        start: history の最初の日
+        alpha: 水準の平滑化係数
+        gamma: 曜日成分の平滑化係数
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            (水準（メニュー）, 曜日成分（メニュー×7）, 1日先予測の誤差の標準偏差（メニュー）)
+    """
+    menus, days = history.shape
+    if not days:
+        return np.zeros(menus), np.zeros((menus, 7)), np.zeros(menus)
+    dow = weekdays(start, days)
+
+    # 期間の途中で販売を始めたメニューは最初の販売日から当てはめる
+    sold = history > 0
+    first = np.where(sold.any(axis=1), sold.argmax(axis=1), days)
+
+    # 最初の販売日から INIT_DAYS 日の平均を水準、曜日ごとの平均との差を曜日成分の初期値にする
+    window = first[:, None] + np.arange(INIT_DAYS)
+    valid = window < days
+    window = np.minimum(window, days - 1)
+    init = np.where(valid, history[np.arange(menus)[:, None], window], 0.0)
+    level = init.sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+    season = np.zeros((menus, 7))
+    for d in range(7):
+        same_day = valid & (dow[window] == d)
+        count = same_day.sum(axis=1)
+        season[:, d] = np.where(count > 0, (init * same_day).sum(axis=1) / np.maximum(count, 1) - level, 0.0)
+
+    errors = np.zeros((menus, days))
+    for t in range(days):
+        d = dow[t]
+        active = first <= t
+        actual = history[:, t]
+        errors[:, t] = np.where(active, actual - (level + season[:, d]), 0.0)
+        level = np.where(active, level + alpha * (actual - season[:, d] - level), level)
+        season[:, d] = np.where(active, season[:, d] + gamma * (actual - level - season[:, d]), season[:, d])
+
+    # 販売開始後の直近 ERROR_WINDOW_DAYS 日の誤差
+    recent_start = np.maximum(first, days - ERROR_WINDOW_DAYS)
+    in_recent = np.arange(days) >= recent_start[:, None]
+    sigma = np.sqrt((errors ** 2 * in_recent).sum(axis=1) / np.maximum(in_recent.sum(axis=1), 1))
+    return level, season, sigma
+
+
+def predict(level: np.ndarray, season: np.ndarray, start: date, days: int) -> np.ndarray:
+    """
+    fit() の結果から start 以降 days 日分の販売個数を予測
+
+    Returns:
+        np.ndarray: メニュー×日の予測個数（0以上）
+    """
+    return np.maximum(level[:, None] + season[:, weekdays(start, days)], 0.0)
+
+
+def load_history(db: Session, start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    全店舗のメニュー×日の販売個数の行列を作る（キャンセル除く）
+
+    メニューはいずれか1つの店舗に属するため、店舗ごとの日別売上をまとめて1つの行列にする
+
+    Args:
+        db: データベースセッション
+        start: 開始日
+        end: 終了日（この日を含む）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (メニューID, メニュー×日の販売個数)
+    """
+    entries = [
+        ((day - start).days, menu_id, quantity)
+        for (store_id,) in db.query(Store.id).order_by(Store.id)
+        for day, summary in report_cache.daily_sales(db, store_id, start, end).items()
+        for menu_id, _, quantity, _ in summary["menus"]
+    ]
+    if not entries:
+        return np.empty(0, np.int64), np.zeros((0, (end - start).days + 1))
+    columns, menu_ids, quantities = (np.array(values) for values in zip(*entries))
+    menus, rows = np.unique(menu_ids, return_inverse=True)
+    history = np.zeros((menus.size, (end - start).days + 1))
+    np.add.at(history, (rows, columns), quantities)
+    return menus, history
+
+
+# ===== 予測の保存 =====
+
+def generate(db: Session, today: date) -> int:
+    """
+    today 以降の予測を作り直して保存（呼び出し側でコミットする）
+
+    学習は前日までの FORECAST_HISTORY_DAYS 日分で、販売中のメニューのうち
+    期間内に販売実績のあるものが対象
+
+    Returns:
+        int: 予測したメニュー数
+    """
+    end = today - timedelta(days=1)
+    start = today - timedelta(days=FORECAST_HISTORY_DAYS)
+    menu_ids, history = load_history(db, start, end)
+
+    available = {menu_id for (menu_id,) in db.query(Menu.id).filter(Menu.is_available == True)}
+    selected = np.array([int(menu_id) in available for menu_id in menu_ids], dtype=bool)
+    menu_ids, history = menu_ids[selected], history[selected]
+
+    level, season, sigma = fit(history, start)
+    quantities = predict(level, season, today, FORECAST_HORIZON_DAYS)
+    uppers = np.ceil(quantities + UPPER_Z * sigma[:, None])
+
+    now = datetime.now(timezone.utc)
+    db.query(MenuForecast).filter(MenuForecast.forecast_date >= today).delete(synchronize_session=False)
+    db.bulk_insert_mappings(MenuForecast, [
+        {
+            "forecast_date": today + timedelta(days=offset),
+            "menu_id": int(menu_id),
+            "quantity": round(float(quantities[row, offset]), 2),
+            "upper": int(uppers[row, offset]),
+            "generated_at": now,
+        }
+        for row, menu_id in enumerate(menu_ids)
+        for offset in range(FORECAST_HORIZON_DAYS)
+    ])
+    return int(menu_ids.size)
+
+
+def _claim(db: Session, run_date: date) -> bool:
+    """その日の実行を取得（他のプロセスが実行済み・実行中ならFalse）"""
+    insert_or_ignore(db, ForecastRun, {"run_date": run_date}, ["run_date"])
+    now = datetime.now(timezone.utc)
+    result = db.execute(
+        update(ForecastRun).where(
+            ForecastRun.run_date == run_date,
+            or_(
+                ForecastRun.started_at.is_(None),
+                (ForecastRun.finished_at.is_(None)) & (ForecastRun.started_at < now - RUN_LOCK_TIMEOUT)
+            )
+        ).values(started_at=now, finished_at=None).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def run(today_iso: str, force: bool = False) -> Optional[int]:
+    """
+    予測を実行して保存（予測プロセスから呼ばれる）
+
+    Args:
+        today_iso: 実行日（YYYY-MM-DD）
+        force: 実行済みでも実行する
+
+    Returns:
+        Optional[int]: 予測したメニュー数（他のプロセスが実行済み・実行中ならNone）
+    """
+    today = date.fromisoformat(today_iso)
+    db = SessionLocal()
+    try:
+        if not _claim(db, today) and not force:
+            return None
+        count = generate(db, today)
+        db.query(ForecastRun).filter(ForecastRun.run_date == today).update(
+            {"finished_at": datetime.now(timezone.utc), "menu_count": count},
+            synchronize_session=False
+        )
+        db.commit()
+        return count
+    except Exception:
+        db.rollback()
+        # 次の確認で再実行できるよう実行記録を戻す
+        db.query(ForecastRun).filter(ForecastRun.run_date == today).update(
+            {"started_at": None}, synchronize_session=False
+        )
+        db.commit()
+        raise
+    finally:
+        db.close()
+
+
+# ===== 夜間実行 =====
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # スレッドやDB接続を持つプロセスを fork しないよう spawn で起動する
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _seconds_until_next_run(now: datetime) -> float:
+    next_run = now.replace(hour=FORECAST_HOUR, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+class ForecastScheduler:
+    """毎日 FORECAST_HOUR 時以降に予測プロセスで予測を実行する"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = datetime.now()
+            delay = None
+            # 起動が実行時刻より後なら、その日の分をすぐに実行する（実行済みなら何もしない）
+            if now.hour >= FORECAST_HOUR:
+                try:
+                    count = await loop.run_in_executor(_get_executor(), run, now.date().isoformat())
+                    if count is not None:
+                        self.runs += 1
+                        logger.info("Forecast generated for %d menus", count)
+                except Exception:
+                    logger.exception("Failed to generate forecast")
+                    delay = RETRY_SECONDS
+            next_run = _seconds_until_next_run(datetime.now())
+            await asyncio.sleep(min(delay, next_run) if delay else next_run)
+
+
+def shutdown():
+    """予測プロセスを停止"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+# プロセス全体で共有するスケジューラ
+scheduler = ForecastScheduler()
+
+
+# ===== バックテスト =====
+
+def backtest(db: Session, weeks: int, horizon: int) -> Dict[str, float]:
+    """
+    直近 weeks 週の各週初めを起点に、それより前のデータだけで horizon 日先まで予測し、
+    実績との誤差を集計する（比較用に前週同曜日の値をそのまま使う予測も評価）
+
+    Returns:
+        Dict[str, float]: 誤差の指標
+    """
+    today = date.today()
+    first_origin = today - timedelta(days=7 * weeks)
+    start = first_origin - timedelta(days=FORECAST_HISTORY_DAYS)
+    menu_ids, history = load_history(db, start, today - timedelta(days=1))
+
+    cells = 0
+    actual_total = model_error = naive_error = model_bias = 0.0
+    for week in range(weeks):
+        origin = first_origin + timedelta(days=7 * week)
+        split = (origin - start).days
+        days = min(horizon, history.shape[1] - split)
+        if days <= 0:
+            continue
+        train, actual = history[:, :split], history[:, split:split + days]
+        level, season, _ = fit(train, start)
+        forecast = predict(level, season, origin, days)
+        naive = train[:, np.arange(days) % 7 + split - 7]
+        cells += actual.size
+        actual_total += actual.sum()
+        model_error += np.abs(forecast - actual).sum()
+        naive_error += np.abs(naive - actual).sum()
+        model_bias += (forecast - actual).sum()
+
+    return {
+        "menus": len(menu_ids),
+        "actual_quantity": actual_total,
+        "mae": model_error / cells if cells else 0.0,
+        "wape": model_error / actual_total if actual_total else math.nan,
+        "bias": model_bias / actual_total if actual_total else math.nan,
+        "naive_wape": naive_error / actual_total if actual_total else math.nan,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="メニューの日別需要予測")
+    parser.add_argument("--backtest", action="store_true", help="過去データで予測誤差を評価する")
+    parser.add_argument("--weeks", type=int, default=8, help="バックテストで評価する週数")
+    parser.add_argument("--horizon", type=int, default=7, help="バックテストで評価する予測日数")
+    args = parser.parse_args()
+
+    if args.backtest:
+        session = SessionLocal()
+        try:
+            result = backtest(session, args.weeks, args.horizon)
+        finally:
+            session.close()
+        print(f"menus:            {result['menus']}")
+        print(f"actual quantity:  {result['actual_quantity']:.0f}")
+        print(f"MAE (per day):    {result['mae']:.2f}")
+        print(f"WAPE:             {result['wape']:.1%}")
+        print(f"bias:             {result['bias']:+.1%}")
+        print(f"WAPE (last week): {result['naive_wape']:.1%}")
+    else:
+        count = run(date.today().isoformat(), force=True)
+        print(f"✓ forecast generated for {count} menus")
@@ -1,12 +1,34 @@
 """
 初期データ投入スクリプト
+
+使い方:
+    python init_data.py                                          # 初期データのみ投入
+    python init_data.py --users 10000 --orders 1000000 --days 365  # 負荷試験用データを追加生成
+    python init_data.py --create-store 渋谷店 --staff-username shibuya --staff-email shibuya@bento.com
+                                                                 # 店舗と最初の店舗スタッフを追加（パスワードは入力）
 """
+import argparse
+import getpass
+import sys
+import csv
+import io
+import random
+import time as timer
+from functools import lru_cache
+from sqlalchemy import func, insert, text
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine
-from models import Base, User, Menu, Order
+from models import Base, Store, User, Menu, Order
 from auth import get_password_hash
+import report_cache
 from datetime import datetime, timedelta, time
 
+
+@lru_cache(maxsize=None)
+def hashed_password_for(password: str) -> str:
+    """パスワードごとに一度だけbcryptハッシュを計算して使い回す"""
+    return get_password_hash(password)
+
 def init_database():
     """データベースとテーブルの初期化"""
     print("Creating database tables...")
@@ -24,7 +46,14 @@ def insert_initial_data():
         
         print("Inserting initial data...")
         
-        # 1. メニューデータ
+        # 1. 店舗データ
+        print("  - Inserting stores...")
+        main_store = Store(name="本店")
+        db.add(main_store)
+        db.commit()
+        print("    ✓ 1 store inserted")
+        
+        # 2. メニューデータ
         print("  - Inserting menus...")
         menus = [
             Menu(name="から揚げ弁当", price=500, description="ジューシーなから揚げがたっぷり。", image_url="https://via.placeholder.com/300x200?text=Karaage"),
@@ -34,34 +63,38 @@ def insert_initial_data():
             Menu(name="ベジタリアン弁当", price=550, description="野菜たっぷりヘルシー弁当。", image_url="https://via.placeholder.com/300x200?text=Vegetarian"),
             Menu(name="特上寿司弁当", price=1200, description="厳選ネタの特上寿司。", image_url="https://via.placeholder.com/300x200?text=Sushi")
         ]
+        for menu in menus:
+            menu.store_id = main_store.id
         db.add_all(menus)
         db.commit()
         print(f"    ✓ {len(menus)} menus inserted")
         
-        # 2. ユーザーデータ
+        # 3. ユーザーデータ
         print("  - Inserting store staff...")
         store_users = [
-            User(username="admin", email="admin@bento.com", hashed_password=get_password_hash("admin@123"), role="store", full_name="管理者"),
-            User(username="store1", email="store1@bento.com", hashed_password=get_password_hash("password123"), role="store", full_name="佐藤花子"),
-            User(username="store2", email="store2@bento.com", hashed_password=get_password_hash("password123"), role="store", full_name="鈴木一郎")
+            User(username="admin", email="admin@bento.com", hashed_password=hashed_password_for("admin@123"), role="store", full_name="管理者"),
+            User(username="store1", email="store1@bento.com", hashed_password=hashed_password_for("password123"), role="store", full_name="佐藤花子"),
+            User(username="store2", email="store2@bento.com", hashed_password=hashed_password_for("password123"), role="store", full_name="鈴木一郎")
         ]
+        for store_user in store_users:
+            store_user.store_id = main_store.id
         db.add_all(store_users)
         db.commit()
         print(f"    ✓ {len(store_users)} store staff inserted")
         
         print("  - Inserting customers...")
         customers = [
-            User(username="customer1", email="customer1@example.com", hashed_password=get_password_hash("password123"), role="customer", full_name="山田太郎"),
-            User(username="customer2", email="customer2@example.com", hashed_password=get_password_hash("password123"), role="customer", full_name="田中美咲"),
-            User(username="customer3", email="customer3@example.com", hashed_password=get_password_hash("password123"), role="customer", full_name="伊藤健太"),
-            User(username="customer4", email="customer4@example.com", hashed_password=get_password_hash("password123"), role="customer", full_name="高橋さくら"),
-            User(username="customer5", email="customer5@example.com", hashed_password=get_password_hash("password123"), role="customer", full_name="渡辺健二")
+            User(username="customer1", email="customer1@example.com", hashed_password=hashed_password_for("password123"), role="customer", full_name="山田太郎"),
+            User(username="customer2", email="customer2@example.com", hashed_password=hashed_password_for("password123"), role="customer", full_name="田中美咲"),
+            User(username="customer3", email="customer3@example.com", hashed_password=hashed_password_for("password123"), role="customer", full_name="伊藤健太"),
+            User(username="customer4", email="customer4@example.com", hashed_password=hashed_password_for("password123"), role="customer", full_name="高橋さくら"),
+            User(username="customer5", email="customer5@example.com", hashed_password=hashed_password_for("password123"), role="customer", full_name="渡辺健二")
         ]
         db.add_all(customers)
         db.commit()
         print(f"    ✓ {len(customers)} customers inserted")
         
-        # 3. 販売データ
+        # 4. 販売データ
         print("  - Inserting orders...")
         customer_users = db.query(User).filter(User.role == "customer").all()
         menu_items = db.query(Menu).all()
@@ -102,9 +135,10 @@ def insert_initial_data():
                 delivery_time_obj = time(hour, minute, second)
             
             order = Order(
-                user_id=order_data["user"].id, menu_id=order_data["menu"].id, quantity=order_data["quantity"],
+                user_id=order_data["user"].id, menu_id=order_data["menu"].id, store_id=order_data["menu"].store_id,
+                quantity=order_data["quantity"],
                 total_price=total_price, status=order_data["status"], delivery_time=delivery_time_obj,
-                notes=order_data["notes"], ordered_at=ordered_at
+                pickup_date=ordered_at.date(), notes=order_data["notes"], ordered_at=ordered_at
             )
             orders.append(order)
         
@@ -121,7 +155,255 @@ def insert_initial_data():
     finally:
         db.close()
 
+# ===== 負荷試験用データ生成 =====
+
+# 生成ユーザー共通のパスワード
+GENERATED_PASSWORD = "password123"
+
+# 受取時間帯（15分刻み）と人気の重み（12:00〜12:30がピーク）
+DELIVERY_SLOTS = [(11, 0), (11, 15), (11, 30), (11, 45), (12, 0), (12, 15), (12, 30),
+                  (12, 45), (13, 0), (13, 15), (13, 30), (13, 45), (14, 0)]
+DELIVERY_SLOT_WEIGHTS = [2, 3, 6, 10, 18, 16, 13, 9, 7, 5, 4, 3, 2]
+
+# 曜日ごとの注文量の重み（月〜日）
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.1, 0.45, 0.3]
+
+# 数量の分布
+QUANTITIES = [1, 2, 3, 4, 5]
+QUANTITY_WEIGHTS = [70, 20, 7, 2, 1]
+
+# 本日分の未完了注文のステータス分布
+ACTIVE_STATUSES = ["pending", "confirmed", "preparing", "ready"]
+ACTIVE_STATUS_WEIGHTS = [35, 25, 25, 15]
+
+ORDER_COLUMNS = ["user_id", "menu_id", "store_id", "quantity", "total_price", "status",
+                 "delivery_time", "pickup_date", "notes", "ordered_at", "updated_at"]
+USER_COLUMNS = ["username", "email", "hashed_password", "role", "full_name", "is_active"]
+
+
+def _cumulative(weights):
+    total = 0
+    result = []
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+
+def _order_minute(rng: random.Random) -> int:
+    """注文時刻（0時からの分）を生成。昼前にピークを持つ"""
+    r = rng.random()
+    if r < 0.7:
+        minute = rng.gauss(11 * 60 + 20, 45)
+    elif r < 0.9:
+        minute = rng.uniform(7 * 60, 10 * 60)
+    else:
+        minute = rng.uniform(13 * 60, 18 * 60)
+    return int(min(max(minute, 6 * 60), 20 * 60))
+
+
+def _copy_rows(conn, table: str, columns, rows):
+    """PostgreSQLのCOPYで一括投入"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+
+def _write_batch(conn, table, columns, rows, use_copy: bool):
+    if use_copy:
+        _copy_rows(conn, table.name, columns, rows)
+    else:
+        conn.execute(insert(table), [dict(zip(columns, row)) for row in rows])
+
+
+def generate_bulk_data(users: int, orders: int, days: int, batch_size: int = 50000, seed: int = 42):
+    """
+    負荷試験用のユーザー・注文を一括生成
+
+    - 注文時刻は昼前、受取時間は12:00台にピークを持つ
+    - メニューの人気はZipf分布、ユーザーの注文頻度にも偏りを持たせる
+    - 過去の注文は完了/キャンセル、本日分は受取時間に応じたステータス
+    - PostgreSQL(psycopg2)ではCOPY、それ以外はexecutemanyでバッチ投入
+    - パスワードハッシュは1回だけ計算して全ユーザーで共有
+
+    Args:
+        users: 生成するお客様ユーザー数
+        orders: 生成する注文数
+        days: 注文を分布させる日数（本日を含む）
+        batch_size: 1回の投入件数
+        seed: 乱数シード
+    """
+    rng = random.Random(seed)
+    days = max(days, 1)
+    use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+    print(f"Generating {users} users and {orders} orders over {days} days "
+          f"({'COPY' if use_copy else 'executemany'}, batch {batch_size})...")
+    started = timer.perf_counter()
+
+    db = SessionLocal()
+    try:
+        menus = db.query(Menu.id, Menu.price, Menu.store_id).order_by(Menu.id).all()
+        offset = db.query(func.max(User.id)).scalar() or 0
+    finally:
+        db.close()
+    if not menus:
+        raise RuntimeError("No menus found. Run without generator options first.")
+
+    hashed_password = hashed_password_for(GENERATED_PASSWORD)
+    users_table = User.__table__
+    orders_table = Order.__table__
+
+    # 1. ユーザー
+    with engine.begin() as conn:
+        for start in range(0, users, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, users)):
+                n = offset + i + 1
+                rows.append((f"gen_customer{n}", f"gen_customer{n}@example.com", hashed_password,
+                             "customer", f"生成ユーザー{n}", True))
+            _write_batch(conn, users_table, USER_COLUMNS, rows, use_copy)
+    print(f"    ✓ {users} users inserted")
+
+    with engine.connect() as conn:
+        customer_ids = [row[0] for row in conn.execute(
+            text("SELECT id FROM users WHERE role = 'customer' ORDER BY id")
+        )]
+    if not customer_ids:
+        raise RuntimeError("No customers to attach orders to.")
+
+    # 2. 分布の準備
+    menu_cum = _cumulative([1 / (rank + 1) ** 1.1 for rank in range(len(menus))])
+    user_cum = _cumulative([1 / (rank + 1) ** 0.6 for rank in range(len(customer_ids))])
+    rng.shuffle(customer_ids)
+    now = datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    now_minute = now.hour * 60 + now.minute
+    day_offsets = list(range(days))
+    day_cum = _cumulative([WEEKDAY_WEIGHTS[(today - timedelta(days=d)).weekday()] for d in day_offsets])
+    slot_cum = _cumulative(DELIVERY_SLOT_WEIGHTS)
+    quantity_cum = _cumulative(QUANTITY_WEIGHTS)
+    active_cum = _cumulative(ACTIVE_STATUS_WEIGHTS)
+
+    # 3. 注文
+    inserted = 0
+    with engine.begin() as conn:
+        while inserted < orders:
+            size = min(batch_size, orders - inserted)
+            menu_picks = rng.choices(menus, cum_weights=menu_cum, k=size)
+            user_picks = rng.choices(customer_ids, cum_weights=user_cum, k=size)
+            day_picks = rng.choices(day_offsets, cum_weights=day_cum, k=size)
+            slot_picks = rng.choices(DELIVERY_SLOTS, cum_weights=slot_cum, k=size)
+            quantity_picks = rng.choices(QUANTITIES, cum_weights=quantity_cum, k=size)
+            rows = []
+            for (menu_id, price, store_id), user_id, days_ago, (hour, minute), quantity in zip(
+                    menu_picks, user_picks, day_picks, slot_picks, quantity_picks):
+                order_minute = _order_minute(rng)
+                if days_ago == 0 and order_minute > now_minute:
+                    order_minute = rng.randint(min(6 * 60, now_minute), now_minute)
+                # 受取は注文から15分以上後の枠にする
+                slot_minute = max(hour * 60 + minute, (order_minute + 29) // 15 * 15)
+                slot_minute = min(slot_minute, 23 * 60 + 45)
+                ordered_at = (today - timedelta(days=days_ago)
+                              + timedelta(minutes=order_minute, seconds=rng.randrange(60)))
+
+                if days_ago > 0 or slot_minute + 30 < now_minute:
+                    status = "cancelled" if rng.random() < 0.07 else "completed"
+                    updated_at = ordered_at + timedelta(minutes=slot_minute - order_minute + 10)
+                else:
+                    status = rng.choices(ACTIVE_STATUSES, cum_weights=active_cum)[0]
+                    updated_at = ordered_at
+                rows.append((user_id, menu_id, store_id, quantity, price * quantity, status,
+                             time(slot_minute // 60, slot_minute % 60), ordered_at.date(), None,
+                             ordered_at, updated_at))
+            _write_batch(conn, orders_table, ORDER_COLUMNS, rows, use_copy)
+            inserted += size
+            print(f"    ... {inserted}/{orders} orders")
+        # 過去日の注文を直接投入したため、売上レポートのキャッシュを無効化
+        for store_id in {menu.store_id for menu in menus}:
+            report_cache.invalidate(conn, store_id, [(today - timedelta(days=d)).date() for d in day_offsets])
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("ANALYZE users"))
+            conn.execute(text("ANALYZE orders"))
+
+    print(f"    ✓ {orders} orders inserted in {timer.perf_counter() - started:.1f}s")
+
+
+def create_store(name: str, username: str, email: str, password: str, full_name: str = None):
+    """
+    店舗と最初の店舗スタッフを作成
+
+    店舗スタッフの登録には同じ店舗のスタッフのログインが必要なため、
+    新しい店舗の最初のスタッフはこのコマンドで作成する（以降のスタッフはそのスタッフが登録する）
+
+    Args:
+        name: 店舗名
+        username: スタッフのユーザー名
+        email: スタッフのメールアドレス
+        password: スタッフのパスワード
+        full_name: スタッフの氏名（省略時はユーザー名）
+
+    Returns:
+        int: 作成した店舗のID
+    """
+    db = SessionLocal()
+    try:
+        if db.query(User).filter((User.username == username) | (User.email == email)).first():
+            sys.exit(f"Username or email already registered: {username} / {email}")
+        if db.query(Store).filter(Store.name == name).first():
+            sys.exit(f"Store already exists: {name}")
+
+        print(f"Creating store {name}...")
+        store = Store(name=name)
+        db.add(store)
+        db.flush()
+        db.add(User(
+            username=username,
+            email=email,
+            hashed_password=get_password_hash(password),
+            role="store",
+            full_name=full_name or username,
+            store_id=store.id
+        ))
+        db.commit()
+        print(f"    ✓ store {store.id} and staff {username} created")
+        return store.id
+    finally:
+        db.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="初期データ投入・負荷試験用データ生成")
+    parser.add_argument("--users", type=int, default=0, help="生成するお客様ユーザー数")
+    parser.add_argument("--orders", type=int, default=0, help="生成する注文数")
+    parser.add_argument("--days", type=int, default=30, help="注文を分布させる日数")
+    parser.add_argument("--batch-size", type=int, default=50000, help="1回の投入件数")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    parser.add_argument("--create-store", metavar="NAME", help="店舗と最初の店舗スタッフを作成（初期データは投入しない）")
+    parser.add_argument("--staff-username", help="作成する店舗スタッフのユーザー名")
+    parser.add_argument("--staff-email", help="作成する店舗スタッフのメールアドレス")
+    parser.add_argument("--staff-full-name", help="作成する店舗スタッフの氏名（省略時はユーザー名）")
+    parser.add_argument("--staff-password", help="作成する店舗スタッフのパスワード（省略時は入力を求める）")
+    args = parser.parse_args(argv)
+    if args.create_store and not (args.staff_username and args.staff_email):
+        parser.error("--create-store requires --staff-username and --staff-email")
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
     init_database()
+    if args.create_store:
+        password = args.staff_password or getpass.getpass(f"Password for {args.staff_username}: ")
+        if len(password) < 6:
+            sys.exit("Password must be at least 6 characters")
+        create_store(args.create_store, args.staff_username, args.staff_email, password, args.staff_full_name)
+        sys.exit(0)
     insert_initial_data()
-    print("\nDatabase initialization completed!")
\ No newline at end of file
+    if args.users or args.orders:
+        generate_bulk_data(args.users, args.orders, args.days, args.batch_size, args.seed)
+    print("\nDatabase initialization completed!")
@@ -0,0 +1,322 @@
+"""
+バックグラウンドジョブ
+
+注文の書き込みに付随する処理（集計・通知・監査ログなど）をレスポンスの後に実行する
+
+- enqueue() は業務データと同じセッションにアウトボックス行（job_outbox）を追加するだけで、
+  コミットされたジョブのみがワーカーに渡される（ロールバックされたジョブは存在しない）
+- コミット後にジョブIDをイベントループ上の有限キューへ渡し、asyncioワーカーが
+  スレッドプールでハンドラを実行する
+- 失敗したジョブは指数バックオフでリトライし、上限に達したら failed にする
+- キューが満杯の場合やプロセス再起動時は、ポーラーがアウトボックスから拾い直す
+- 実行前に status を条件にした UPDATE で取得するため、複数ワーカープロセスでも
+  同じジョブが同時に実行されることはない
+"""
+
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models import JobOutbox
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+# 実行中のまま残ったジョブ（プロセス停止など）を再実行するまでの秒数
+JOB_LOCK_TIMEOUT_SECONDS = float(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "300"))
+# 完了したジョブを残す時間
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+
+# ポーラーが1回に拾うジョブ数
+POLL_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+# ジョブ種別 → ハンドラ
+_handlers: Dict[str, Callable[[Session, dict], None]] = {}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def job(kind: str):
+    """
+    ジョブハンドラを登録するデコレータ
+
+    ハンドラはスレッドプールで handler(db, payload) として呼ばれ、
+    正常終了するとジョブと同じトランザクションでコミットされる
+
+    Args:
+        kind: ジョブ種別
+    """
+    def decorator(func: Callable[[Session, dict], None]):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(db: Session, kind: str, **payload):
+    """
+    ジョブを登録（呼び出し側のトランザクションと一緒にコミットされる）
+
+    Args:
+        db: データベースセッション
+        kind: ジョブ種別
+        **payload: ハンドラに渡す値（JSONに変換できるもの）
+    """
+    db.add(JobOutbox(kind=kind, payload=json.dumps(payload, default=str), run_after=_utcnow()))
+
+
+def backoff_seconds(attempts: int) -> float:
+    """
+    リトライまでの待ち時間
+
+    Args:
+        attempts: これまでの実行回数
+
+    Returns:
+        float: JOB_RETRY_BASE_SECONDS × 2^(attempts-1)（JOB_RETRY_MAX_SECONDS まで）
+    """
+    return min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+
+
+def _claim(db: Session, job_id: int) -> Optional[JobOutbox]:
+    """待機中で実行可能なジョブを実行中にして取得（他のワーカーが取得済みならNone）"""
+    now = _utcnow()
+    result = db.execute(
+        update(JobOutbox).where(
+            JobOutbox.id == job_id,
+            JobOutbox.status == "pending",
+            JobOutbox.run_after <= now
+        ).values(
+            status="running", attempts=JobOutbox.attempts + 1, locked_at=now
+        ).execution_options(synchronize_session=False)
+    )
+    db.commit()
+    if result.rowcount != 1:
+        return None
+    return db.get(JobOutbox, job_id)
+
+
+def run_job(job_id: int) -> bool:
+    """
+    ジョブを1件実行（スレッドプールから呼ばれる）
+
+    Args:
+        job_id: ジョブID
+
+    Returns:
+        bool: 実行した場合True（他のワーカーが実行済み・実行中の場合False）
+    """
+    db = SessionLocal()
+    try:
+        outbox = _claim(db, job_id)
+        if outbox is None:
+            return False
+        try:
+            handler = _handlers.get(outbox.kind)
+            if handler is None:
+                raise LookupError(f"No handler for job kind '{outbox.kind}'")
+            handler(db, json.loads(outbox.payload))
+            outbox.status = "done"
+            outbox.last_error = None
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            outbox = db.get(JobOutbox, job_id)
+            outbox.last_error = f"{type(exc).__name__}: {exc}"
+            if outbox.attempts >= JOB_MAX_ATTEMPTS:
+                outbox.status = "failed"
+                logger.error("Job %s (%s) failed after %d attempts: %s",
+                             job_id, outbox.kind, outbox.attempts, outbox.last_error)
+            else:
+                outbox.status = "pending"
+                outbox.run_after = _utcnow() + timedelta(seconds=backoff_seconds(outbox.attempts))
+                logger.warning("Job %s (%s) attempt %d failed, retrying: %s",
+                               job_id, outbox.kind, outbox.attempts, outbox.last_error)
+            db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def due_job_ids(limit: int = POLL_BATCH_SIZE) -> List[int]:
+    """
+    実行可能なジョブのIDを取得（実行中のまま残ったジョブは待機中に戻す）
+
+    Args:
+        limit: 取得件数
+
+    Returns:
+        List[int]: 古い順のジョブID
+    """
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        db.execute(
+            update(JobOutbox).where(
+                JobOutbox.status == "running",
+                JobOutbox.locked_at < now - timedelta(seconds=JOB_LOCK_TIMEOUT_SECONDS)
+            ).values(status="pending", run_after=now).execution_options(synchronize_session=False)
+        )
+        db.query(JobOutbox).filter(
+            JobOutbox.status == "done",
+            JobOutbox.updated_at < now - timedelta(hours=JOB_RETENTION_HOURS)
+        ).delete(synchronize_session=False)
+        db.commit()
+        rows = db.query(JobOutbox.id).filter(
+            JobOutbox.status == "pending",
+            JobOutbox.run_after <= now
+        ).order_by(JobOutbox.id).limit(limit).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+class JobQueue:
+    """イベントループ上のジョブキューとワーカー"""
+
+    def __init__(self, workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_SIZE,
+                 poll_seconds: float = JOB_POLL_SECONDS):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.poll_seconds = poll_seconds
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: set = set()
+        self._tasks: List[asyncio.Task] = []
+        self.processed = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    async def start(self):
+        """ワーカーとポーラーを起動（アプリケーション起動時）"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poller()))
+
+    async def stop(self):
+        """ワーカーとポーラーを停止（未実行のジョブはアウトボックスに残る）"""
+        self._loop = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queued.clear()
+
+    def _offer(self, job_ids: List[int]):
+        # イベントループのスレッドでのみ呼ばれる
+        for job_id in job_ids:
+            if job_id in self._queued:
+                continue
+            try:
+                self._queue.put_nowait(job_id)
+                self._queued.add(job_id)
+            except asyncio.QueueFull:
+                # 溢れた分はポーラーがアウトボックスから拾う
+                self.dropped += 1
+
+    def submit(self, job_ids: List[int]):
+        """
+        コミット済みのジョブIDをキューに渡す（どのスレッドからでも呼べる）
+
+        Args:
+            job_ids: ジョブID
+        """
+        loop = self._loop
+        if loop is None or not job_ids:
+            return
+        loop.call_soon_threadsafe(self._offer, job_ids)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                if await run_in_threadpool(run_job, job_id):
+                    self.processed += 1
+            except Exception:
+                logger.exception("Job worker error on job %s", job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _poller(self):
+        while True:
+            try:
+                self._offer(await run_in_threadpool(due_job_ids))
+            except Exception:
+                logger.exception("Job poller error")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def drain(self):
+        """キュー内のジョブが全て処理されるまで待つ"""
+        await self._queue.join()
+
+
+# プロセス全体で共有するキュー
+queue = JobQueue()
+
+
+# ===== セッションイベント =====
+
+_PENDING_KEY = "job_outbox_ids"
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_job_ids(session, flush_context):
+    ids = [obj.id for obj in session.new if isinstance(obj, JobOutbox)]
+    if ids:
+        session.info.setdefault(_PENDING_KEY, []).extend(ids)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _submit_committed_jobs(session):
+    ids = session.info.pop(_PENDING_KEY, None)
+    if ids:
+        queue.submit(ids)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_rolled_back_jobs(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ===== ジョブ定義 =====
+
+audit_logger = logging.getLogger("audit")
+
+
+@job("order.created")
+def record_order_created(db: Session, payload: dict):
+    """注文作成の監査ログ"""
+    audit_logger.info("order created: id=%s user=%s menu=%s quantity=%s",
+                      payload["order_id"], payload["user_id"], payload["menu_id"], payload["quantity"])
+
+
+@job("order.status_changed")
+def record_order_status_changed(db: Session, payload: dict):
+    """注文ステータス変更の監査ログ"""
+    audit_logger.info("order status changed: id=%s %s -> %s by user=%s",
+                      payload["order_id"], payload["old_status"], payload["new_status"],
+                      payload["changed_by"])
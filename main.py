@@ -4,25 +4,64 @@ FastAPI メインアプリケーション
 弁当注文管理システムのメインアプリケーション
 """
 
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from routers import auth, customer, store
-from database import engine, Base
+import active_orders
+import admission
+import forecast
+import jobs
+import media
+import metrics
+import query_profiler
+import rate_limit
+import recommendations
+import sampling_profiler
+from routers import auth, customer, store, debug
+from database import engine, engines, Base
 
 # データベーステーブルを作成
 Base.metadata.create_all(bind=engine)
 
+# クエリ計測フックを登録（レプリカを含む全エンジン）
+for db_engine in engines:
+    metrics.instrument_engine(db_engine)
+    if query_profiler.QUERY_DEBUG:
+        query_profiler.instrument_engine(db_engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にバックグラウンドジョブのワーカー・進行中の注文の索引・おすすめの索引の更新・需要予測の夜間実行を開始し、終了時に停止"""
+    await jobs.queue.start()
+    await active_orders.index.start()
+    await recommendations.index.start()
+    await forecast.scheduler.start()
+    try:
+        yield
+    finally:
+        await forecast.scheduler.stop()
+        await recommendations.index.stop()
+        await active_orders.index.stop()
+        await jobs.queue.stop()
+        forecast.shutdown()
+        media.shutdown()
+
+
 # FastAPIアプリケーション作成
 app = FastAPI(
     title="弁当注文管理システム",
     description="お客様と店舗向けの弁当注文管理システム",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS設定
@@ -34,14 +73,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# クエリプロファイラ（デバッグモードのみ）
+if query_profiler.QUERY_DEBUG:
+    app.add_middleware(query_profiler.QueryProfilerMiddleware)
+
+# サンプリングプロファイラの対象リクエスト選択
+app.add_middleware(sampling_profiler.SamplingProfilerMiddleware)
+
+# ルートの種類ごとの同時処理数の制限（過負荷時は待たせずに503を返す）
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware)
+
+# ログイン・注文などのレート制限（DBやパスワード検証の前で弾く）
+if rate_limit.RATE_LIMIT_ENABLED:
+    app.add_middleware(rate_limit.RateLimitMiddleware)
+
+# ルート別メトリクス（最も外側で計測する）
+app.add_middleware(metrics.MetricsMiddleware)
+
 # 静的ファイルとテンプレート設定
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# アップロードされたメニュー画像（内容アドレスのため長期キャッシュ）
+os.makedirs(media.MEDIA_ROOT, exist_ok=True)
+app.mount(media.MEDIA_URL, media.ImmutableStaticFiles(directory=media.MEDIA_ROOT), name="media")
 templates = Jinja2Templates(directory="templates")
 
 # ルーター登録
 app.include_router(auth.router, prefix="/api")
 app.include_router(customer.router, prefix="/api")
 app.include_router(store.router, prefix="/api")
+app.include_router(debug.router)
 
 
 # ===== フロントエンド画面ルーティング =====
@@ -108,6 +169,14 @@ async def health_check():
     return {"status": "healthy", "message": "Bento Order System is running"}
 
 
+# ===== メトリクス =====
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus形式のメトリクス"""
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,205 @@
+"""
+メニュー画像の保存とサムネイル生成
+
+アップロードされた画像は内容の SHA-256 をキーとしてローカルディスクに保存し、
+複数幅の WebP サムネイルをプロセスプールで生成する
+
+- ファイル名は内容から決まるため、同じ画像の再アップロードは生成済みのファイルを再利用する
+- 内容が変わればURLも変わるので、配信時は immutable で長期キャッシュさせる
+- デコード・リサイズはCPU負荷が高いため、GILの影響を受けない別プロセスで実行する
+
+保存先:
+    MEDIA_ROOT/originals/ab/<key>     アップロードされた元画像
+    MEDIA_ROOT/ab/<key>-<幅>w.webp     サムネイル（URLは MEDIA_URL/ab/<key>-<幅>w.webp）
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from starlette.staticfiles import StaticFiles
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+MEDIA_URL = "/media"
+# アップロードの最大サイズ（MB）
+MEDIA_MAX_UPLOAD_MB = float(os.getenv("MEDIA_MAX_UPLOAD_MB", "8"))
+# 生成するサムネイルの幅（元画像より大きい幅は元画像の幅に揃える）
+MEDIA_IMAGE_WIDTHS = sorted({int(w) for w in os.getenv("MEDIA_IMAGE_WIDTHS", "160,320,640,960").split(",") if w.strip()})
+MEDIA_WEBP_QUALITY = int(os.getenv("MEDIA_WEBP_QUALITY", "80"))
+# サムネイル生成のプロセス数
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+# 展開後の最大ピクセル数（圧縮爆弾対策）
+MEDIA_MAX_PIXELS = 40_000_000
+
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_VARIANT_RE = re.compile(r"-(\d+)w\.webp$")
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def render_variants(data: bytes, widths: List[int], quality: int) -> Dict[int, bytes]:
+    """
+    画像をデコードして各幅の WebP を生成（プロセスプール内で実行）
+
+    Args:
+        data: 元画像のバイト列
+        widths: 生成する幅
+        quality: WebP の品質
+
+    Returns:
+        Dict[int, bytes]: 幅 → WebP のバイト列
+
+    Raises:
+        ValueError: 画像として読めない・対応していない形式・大きすぎる場合
+    """
+    Image.MAX_IMAGE_PIXELS = MEDIA_MAX_PIXELS
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format not in ALLOWED_FORMATS:
+            raise ValueError(f"Unsupported image format: {image.format}")
+        image.load()
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ValueError("Invalid image") from exc
+
+    # スマートフォンの写真の向きを反映
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+
+    source_width, source_height = image.size
+    targets = sorted({min(w, source_width) for w in widths}, reverse=True)
+
+    # 大きい幅から順に縮小し、直前の結果を次の縮小元にする
+    variants: Dict[int, bytes] = {}
+    current = image
+    for width in targets:
+        height = max(1, round(source_height * width / source_width))
+        if current.width != width:
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        current.save(buffer, format="WEBP", quality=quality, method=4)
+        variants[width] = buffer.getvalue()
+    return variants
+
+
+def image_key(data: bytes) -> str:
+    """画像の内容から保存キー（SHA-256）を計算"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def variant_path(key: str, width: int) -> str:
+    return os.path.join(MEDIA_ROOT, key[:2], f"{key}-{width}w.webp")
+
+
+def variant_url(key: str, width: int) -> str:
+    return f"{MEDIA_URL}/{key[:2]}/{key}-{width}w.webp"
+
+
+def srcset(key: str, widths: List[int]) -> str:
+    """
+    img 要素の srcset 属性値を作成
+
+    Returns:
+        str: 例 "/media/ab/<key>-160w.webp 160w, /media/ab/<key>-320w.webp 320w"
+    """
+    return ", ".join(f"{variant_url(key, w)} {w}w" for w in widths)
+
+
+def parse_widths(value: Optional[str]) -> List[int]:
+    """カンマ区切りで保存した幅の一覧を解析"""
+    return [int(w) for w in value.split(",")] if value else []
+
+
+def _existing_widths(key: str) -> List[int]:
+    directory = os.path.join(MEDIA_ROOT, key[:2])
+    if not os.path.isdir(directory):
+        return []
+    widths = []
+    for name in os.listdir(directory):
+        if name.startswith(key):
+            match = _VARIANT_RE.search(name)
+            if match:
+                widths.append(int(match.group(1)))
+    return sorted(widths)
+
+
+def _write_atomic(path: str, data: bytes):
+    # 配信中のファイルが途中まで書かれた状態で見えないよう、一時ファイルから置き換える
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # スレッドやDB接続を持つプロセスを fork しないよう spawn で起動する
+        _executor = ProcessPoolExecutor(
+            max_workers=MEDIA_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def store_image(data: bytes) -> Tuple[str, List[int]]:
+    """
+    画像を保存してサムネイルを生成（生成が終わるまでブロックする）
+
+    Args:
+        data: アップロードされた画像のバイト列
+
+    Returns:
+        Tuple[str, List[int]]: (保存キー, 生成された幅の一覧)
+
+    Raises:
+        ValueError: 画像として読めない・対応していない形式・大きすぎる場合
+    """
+    if len(data) > MEDIA_MAX_UPLOAD_MB * 1024 * 1024:
+        raise ValueError("Image is too large")
+
+    key = image_key(data)
+    widths = _existing_widths(key)
+    if widths:
+        return key, widths
+
+    variants = _get_executor().submit(render_variants, data, MEDIA_IMAGE_WIDTHS, MEDIA_WEBP_QUALITY).result()
+    _write_atomic(os.path.join(MEDIA_ROOT, "originals", key[:2], key), data)
+    for width, content in variants.items():
+        _write_atomic(variant_path(key, width), content)
+    return key, sorted(variants)
+
+
+def shutdown():
+    """プロセスプールを停止"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """内容アドレスのファイルを長期キャッシュ可能として配信する StaticFiles"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = CACHE_CONTROL
+        return response
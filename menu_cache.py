@@ -0,0 +1,183 @@
+"""
+メニューの参照キャッシュ
+
+注文のレスポンスに含めるメニュー（名前・価格・画像など）をIDごとにプロセス内で共有し、
+注文ごとのメニュー検索をなくす
+
+- 値は変更できないタプル（MenuRecord）で、ORMのインスタンスやセッションを持たない
+- 件数は MENU_CACHE_MAX_ENTRIES 件まで（超えた分は最も古く参照されたものから捨てる）
+- 同じプロセスでのメニューの作成・更新・削除では invalidate() で即座に破棄する
+- 他のワーカープロセスでの変更は、MENU_CACHE_SECONDS 秒で期限切れになるか、
+  注文履歴の ETag を作る際に読むメニューの最終更新時刻が変わった時点で反映される
+- 読み込み中に破棄された場合は、読み込んだ値を保存しない（バージョンで判定）
+
+注文の金額計算や販売可否の判定にはこのキャッシュを使わず、DBのメニューを読むこと
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from dotenv import load_dotenv
+
+import metrics
+from models import Menu
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+MENU_CACHE_SECONDS = float(os.getenv("MENU_CACHE_SECONDS", "30"))
+MENU_CACHE_MAX_ENTRIES = int(os.getenv("MENU_CACHE_MAX_ENTRIES", "2048"))
+
+
+class MenuRecord(NamedTuple):
+    """注文のレスポンスに含めるメニュー（MenuResponse の項目）"""
+    id: int
+    store_id: int
+    name: str
+    price: int
+    description: Optional[str]
+    image_url: Optional[str]
+    image_srcset: Optional[str]
+    is_available: bool
+    daily_stock: Optional[int]
+    created_at: datetime
+    updated_at: datetime
+
+    @classmethod
+    def from_menu(cls, menu: Menu) -> "MenuRecord":
+        return cls(
+            menu.id, menu.store_id, menu.name, menu.price, menu.description, menu.image_url, menu.image_srcset,
+            menu.is_available, menu.daily_stock, menu.created_at, menu.updated_at
+        )
+
+
+class MenuLookupCache:
+    """メニューID → MenuRecord のキャッシュ"""
+
+    def __init__(self, ttl: float = MENU_CACHE_SECONDS, max_entries: int = MENU_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # メニューID → (期限, MenuRecord)、参照順
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._updated_stamp = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_many(self, db: Session, menu_ids: Iterable[int]) -> Dict[int, MenuRecord]:
+        """
+        メニューを取得（キャッシュに無いものだけを1回のクエリで読む）
+
+        Args:
+            db: データベースセッション（レプリカ可）
+            menu_ids: メニューID
+
+        Returns:
+            Dict[int, MenuRecord]: メニューID → メニュー（存在しないIDは含まない）
+        """
+        now = time.monotonic()
+        found: Dict[int, MenuRecord] = {}
+        missing = []
+        with self._lock:
+            for menu_id in set(menu_ids):
+                entry = self._entries.get(menu_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(menu_id)
+                    found[menu_id] = entry[1]
+                else:
+                    missing.append(menu_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+            version = self.version
+        if not missing:
+            return found
+
+        loaded = [MenuRecord.from_menu(menu) for menu in db.query(Menu).filter(Menu.id.in_(missing))]
+        with self._lock:
+            # 読み込み中に破棄された場合は古い値の可能性があるため保存しない
+            if version == self.version:
+                expires = time.monotonic() + self.ttl
+                for record in loaded:
+                    self._entries[record.id] = (expires, record)
+                    self._entries.move_to_end(record.id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        found.update((record.id, record) for record in loaded)
+        return found
+
+    def attach(self, db: Session, orders: Iterable):
+        """
+        注文に menu を設定（OrderResponse の menu）
+
+        注文の menu リレーションにはキャッシュの値を読み込み済みの値として設定するため、
+        変更として扱われずセッションにも追加されない
+
+        Args:
+            db: データベースセッション（レプリカ可）
+            orders: 注文（Order / ArchivedOrder）
+        """
+        orders = list(orders)
+        menus = self.get_many(db, (order.menu_id for order in orders))
+        for order in orders:
+            menu = menus.get(order.menu_id)
+            if hasattr(type(order), "menu"):
+                set_committed_value(order, "menu", menu)
+            else:
+                order.menu = menu
+
+    def observe(self, updated_stamp):
+        """
+        メニューの最終更新時刻（全メニューの max(updated_at)）を通知
+
+        前回より新しければ、他のプロセスでメニューが変更されたとみなして全て破棄する
+        （遅延のあるレプリカから読んだ古い時刻では破棄しない）
+
+        Args:
+            updated_stamp: DBから読んだメニューの最終更新時刻
+        """
+        if updated_stamp is None or not self._is_newer(updated_stamp):
+            return
+        with self._lock:
+            if self._is_newer(updated_stamp):
+                self._updated_stamp = updated_stamp
+                self._entries.clear()
+                self.version += 1
+
+    def _is_newer(self, updated_stamp) -> bool:
+        return self._updated_stamp is None or updated_stamp > self._updated_stamp
+
+    def invalidate(self, menu_id: Optional[int] = None):
+        """
+        キャッシュを破棄
+
+        Args:
+            menu_id: 破棄するメニューID（省略時は全て）
+        """
+        with self._lock:
+            if menu_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(menu_id, None)
+            self.version += 1
+
+
+# プロセス全体で共有するキャッシュ
+menus = MenuLookupCache()
+
+metrics.registry.register("menu_cache_hits_total", "counter",
+                          "Menu lookups served from the process cache.", lambda: menus.hits)
+metrics.registry.register("menu_cache_misses_total", "counter",
+                          "Menu lookups loaded from the database.", lambda: menus.misses)
+metrics.registry.register("menu_cache_entries", "gauge",
+                          "Menus held in the process cache.", lambda: len(menus))
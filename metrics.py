@@ -0,0 +1,258 @@
+"""
+メトリクス収集
+
+ルート別のレイテンシ・DBクエリ数・DB時間・ステータスコードを集計し、
+Prometheusテキスト形式で出力する
+
+集計値の更新はイベントループのスレッド（ミドルウェア）だけが行うため、
+ロックを使わずにカウンタを更新できる。スレッドプールで実行される
+DBフックはリクエスト単位の RequestStats のみを更新する。
+"""
+
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# Prometheusのテキスト形式
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ヒストグラムのバケット境界
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# ルートに一致しなかったリクエストのラベル（生のパスは使わない）
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RequestStats:
+    """リクエスト単位のDB統計"""
+    __slots__ = ("query_count", "db_time")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+
+
+# 現在処理中のリクエストの統計（スレッドプールにもコンテキストごと引き継がれる）
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("metrics_request", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    """
+    現在のリクエストのDB統計を取得
+
+    Returns:
+        Optional[RequestStats]: リクエスト外で呼ばれた場合はNone
+    """
+    return _current_request.get()
+
+
+class Histogram:
+    """固定バケットのヒストグラム"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 末尾は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    """ラベル値をエスケープ"""
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_le(bound: float) -> str:
+    return repr(float(bound))
+
+
+class MetricsRegistry:
+    """
+    ルート別メトリクスの集計
+
+    ラベルはルートテンプレート（例: /api/customer/orders/{order_id}）で
+    集約するため、系列数はルート数 × メソッド × ステータスに抑えられる
+    """
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, str], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.queries: Dict[Tuple[str, str], Histogram] = {}
+        self.db_time: Dict[Tuple[str, str], Histogram] = {}
+        self.in_flight = 0
+        # 他のモジュールのカウンタ・ゲージ（名前, 種類, 説明, 値を返す関数）
+        self.collectors: List[Tuple[str, str, str, Callable[[], float]]] = []
+
+    def register(self, name: str, kind: str, help_text: str, value: Callable[[], float]):
+        """
+        出力時に値を読むカウンタ・ゲージを登録
+
+        Args:
+            name: メトリクス名
+            kind: "counter" または "gauge"
+            help_text: 説明
+            value: 現在の値を返す関数
+        """
+        self.collectors.append((name, kind, help_text, value))
+
+    def record_request(self, method: str, route: str, status_code: int,
+                       duration: float, stats: RequestStats):
+        """
+        1リクエスト分の計測値を記録
+
+        Args:
+            method: HTTPメソッド
+            route: ルートテンプレート
+            status_code: レスポンスのステータスコード
+            duration: 処理時間（秒）
+            stats: リクエスト中のDB統計
+        """
+        key = (method, route)
+        status_key = (method, route, str(status_code))
+        self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+        latency = self.latency.get(key)
+        if latency is None:
+            latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+            self.db_time[key] = Histogram(DB_TIME_BUCKETS)
+        latency.observe(duration)
+        self.queries[key].observe(stats.query_count)
+        self.db_time[key].observe(stats.db_time)
+
+    def _render_histogram(self, lines: list, name: str, help_text: str,
+                          series: Dict[Tuple[str, str], Histogram]):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for (method, route), hist in sorted(series.items()):
+            labels = f'method="{_escape(method)}",route="{_escape(route)}"'
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{_format_le(bound)}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"{name}_sum{{{labels}}} {hist.sum!r}")
+            lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+    def render(self) -> str:
+        """
+        Prometheusテキスト形式で出力
+
+        Returns:
+            str: エクスポジション形式のテキスト
+        """
+        lines = [
+            "# HELP http_requests_total Total HTTP requests by route template and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.requests.items()):
+            lines.append(
+                f'http_requests_total{{method="{_escape(method)}",route="{_escape(route)}",'
+                f'status="{status_code}"}} {count}'
+            )
+        lines.append("# HELP http_requests_in_flight HTTP requests currently being processed.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(f"http_requests_in_flight {self.in_flight}")
+
+        self._render_histogram(lines, "http_request_duration_seconds",
+                               "HTTP request latency in seconds.", self.latency)
+        self._render_histogram(lines, "http_request_db_queries",
+                               "Database queries executed per HTTP request.", self.queries)
+        self._render_histogram(lines, "http_request_db_duration_seconds",
+                               "Database time per HTTP request in seconds.", self.db_time)
+        for name, kind, help_text, value in self.collectors:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value()}")
+        return "\n".join(lines) + "\n"
+
+
+# プロセス全体で共有するレジストリ
+registry = MetricsRegistry()
+
+
+def route_template(scope: dict) -> str:
+    """
+    ルーティング後のスコープからルートテンプレートを取得
+
+    Args:
+        scope: ASGIスコープ
+
+    Returns:
+        str: ルートテンプレート（一致しない場合は UNMATCHED_ROUTE）
+    """
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", UNMATCHED_ROUTE)
+    # Mount（静的ファイルなど）はマウントパスで集約する
+    if "endpoint" in scope and scope.get("root_path"):
+        return scope["root_path"]
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """リクエストごとのレイテンシ・DB統計を記録するASGIミドルウェア"""
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.registry.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            self.registry.in_flight -= 1
+            _current_request.reset(token)
+            self.registry.record_request(
+                scope["method"], route_template(scope), status_code, duration, stats
+            )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_request.get()
+    if stats is None:
+        return
+    stats.query_count += 1
+    stats.db_time += time.perf_counter() - context._metrics_start
+
+
+def instrument_engine(engine):
+    """
+    エンジンにクエリ計測用のイベントフックを登録
+
+    Args:
+        engine: SQLAlchemyエンジン
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -4,10 +4,27 @@
 SQLAlchemyを使用したデータベーステーブルの定義
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Time, Text, ForeignKey
+from sqlalchemy import (
+    Column, Integer, Float, String, Boolean, Date, DateTime, Time, Text, ForeignKey, Index, UniqueConstraint
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+import media
+
+
+class Store(Base):
+    """
+    店舗テーブル
+
+    メニュー・注文・受取時間枠・店舗スタッフは店舗に属する
+    """
+    __tablename__ = "stores"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), unique=True, nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
 class User(Base):
@@ -19,8 +36,10 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     role = Column(String(50), nullable=False)  # 'customer' or 'store'
+    store_id = Column(Integer, ForeignKey("stores.id"))  # 店舗スタッフの所属店舗（お客様はNone）
     full_name = Column(String(255))
     is_active = Column(Boolean, default=True)
+    order_version = Column(Integer, nullable=False, default=0, server_default="0")  # 注文の書き込みごとに増加（注文履歴のETag）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # リレーションシップ
@@ -32,33 +51,208 @@ class Menu(Base):
     __tablename__ = "menus"
 
     id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
     name = Column(String(255), nullable=False)
     price = Column(Integer, nullable=False)
     description = Column(Text)
     image_url = Column(String(512))
+    image_key = Column(String(64))  # アップロード画像の保存キー（外部URLの場合はNone）
+    image_widths = Column(String(64))  # 生成済みサムネイルの幅（カンマ区切り）
     is_available = Column(Boolean, default=True)
+    daily_stock = Column(Integer)  # 1日の販売数（Noneは無制限）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     # リレーションシップ
     orders = relationship("Order", back_populates="menu")
 
+    __table_args__ = (
+        Index("ix_menus_store_id_is_available", "store_id", "is_available"),
+        # 注文履歴の ETag 用（メニューの最終更新時刻をインデックスの末尾1件で読む）
+        Index("ix_menus_updated_at", "updated_at"),
+    )
+
+    @property
+    def image_srcset(self):
+        """アップロード画像のサムネイルの srcset（外部URLの場合はNone）"""
+        if not self.image_key:
+            return None
+        return media.srcset(self.image_key, media.parse_widths(self.image_widths))
+
 
 class Order(Base):
     """注文テーブル"""
     __tablename__ = "orders"
 
     id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)  # メニューの店舗
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     menu_id = Column(Integer, ForeignKey("menus.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
     total_price = Column(Integer, nullable=False)
     status = Column(String(50), default="pending")  # pending, confirmed, preparing, ready, completed, cancelled
     delivery_time = Column(Time)
+    pickup_date = Column(Date)  # 在庫・受取時間枠を引き当てた日（アプリの日付。キャンセル時はこの日の分を戻す）
     notes = Column(Text)
-    ordered_at = Column(DateTime(timezone=True), server_default=func.now())
+    ordered_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     # リレーションシップ
     user = relationship("User", back_populates="orders")
-    menu = relationship("Menu", back_populates="orders")
\ No newline at end of file
+    menu = relationship("Menu", back_populates="orders")
+
+    __table_args__ = (
+        Index("ix_orders_user_id_ordered_at", "user_id", "ordered_at"),
+        # 店舗ごとの注文一覧・集計用（店舗の注文だけを範囲検索する）
+        Index("ix_orders_store_id_ordered_at", "store_id", "ordered_at"),
+        Index("ix_orders_store_id_status_ordered_at", "store_id", "status", "ordered_at"),
+        # 分析スナップショットの差分読み込み用
+        Index("ix_orders_updated_at", "updated_at"),
+    )
+
+
+class ArchivedOrder(Base):
+    """
+    アーカイブ済み注文テーブル
+
+    一定期間を過ぎた完了・キャンセル済みの注文を移動する
+    PostgreSQLでは ordered_at による月単位のレンジパーティションになる
+    （パーティションはアーカイブジョブが必要に応じて作成）
+    """
+    __tablename__ = "orders_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    menu_id = Column(Integer, ForeignKey("menus.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    total_price = Column(Integer, nullable=False)
+    status = Column(String(50), nullable=False)
+    delivery_time = Column(Time)
+    pickup_date = Column(Date)
+    notes = Column(Text)
+    ordered_at = Column(DateTime(timezone=True), primary_key=True)
+    updated_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_orders_archive_user_id_ordered_at", "user_id", "ordered_at"),
+        Index("ix_orders_archive_ordered_at", "ordered_at"),
+        Index("ix_orders_archive_store_id_ordered_at", "store_id", "ordered_at"),
+        {"postgresql_partition_by": "RANGE (ordered_at)"},
+    )
+
+
+class PickupSlot(Base):
+    """
+    受取時間枠テーブル
+
+    店舗・日付・時間枠ごとの受取可能数（capacity）と予約済み数（used）を保持する
+    予約は used + 数量 <= capacity を条件にした UPDATE で行う
+    """
+    __tablename__ = "pickup_slots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    store_id = Column(Integer, ForeignKey("stores.id"), nullable=False)
+    slot_date = Column(Date, nullable=False)
+    slot_time = Column(Time, nullable=False)  # 枠の開始時刻
+    capacity = Column(Integer, nullable=False)
+    used = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("store_id", "slot_date", "slot_time", name="uq_pickup_slots_store_date_time"),
+    )
+
+
+class MenuDailyStock(Base):
+    """
+    メニューの日別在庫テーブル
+
+    その日の販売数（stock）と販売済み数（sold）を保持する
+    販売は sold + 数量 <= stock を条件にした UPDATE で行う
+    """
+    __tablename__ = "menu_daily_stock"
+
+    id = Column(Integer, primary_key=True, index=True)
+    menu_id = Column(Integer, ForeignKey("menus.id"), nullable=False)
+    stock_date = Column(Date, nullable=False)
+    stock = Column(Integer, nullable=False)
+    sold = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("menu_id", "stock_date", name="uq_menu_daily_stock_menu_date"),
+    )
+
+
+class JobOutbox(Base):
+    """
+    バックグラウンドジョブのアウトボックステーブル
+
+    ジョブは業務データと同じトランザクションで登録され、コミット後にワーカーが実行する
+    status: pending（待機）/ running（実行中）/ done（完了）/ failed（リトライ上限到達）
+    """
+    __tablename__ = "job_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    # 実行可能になる日時・実行開始日時（ワーカーがUTCで比較する）
+    run_after = Column(DateTime(timezone=True), nullable=False)
+    locked_at = Column(DateTime(timezone=True))
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_job_outbox_status_run_after", "status", "run_after"),
+    )
+
+
+class SalesReportDay(Base):
+    """
+    日別売上レポートのキャッシュテーブル
+
+    店舗ごとに前日以前の日ごとの集計値（メニュー別の内訳はJSON）を保持する
+    その日の注文が後から変更されると generation が増え、
+    cached_generation と一致しなくなった集計値は次の参照時に作り直される
+    """
+    __tablename__ = "sales_report_days"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    report_date = Column(Date, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+    cached_generation = Column(Integer)  # 集計値が対応する generation（Noneは未集計）
+    total_orders = Column(Integer, nullable=False, default=0)
+    total_sales = Column(Integer, nullable=False, default=0)
+    menu_sales = Column(Text)  # JSON [[メニューID, 注文数, 数量, 売上], ...]
+    cached_at = Column(DateTime(timezone=True))
+
+
+class MenuForecast(Base):
+    """
+    メニューの日別需要予測テーブル
+
+    夜間の予測ジョブが、当日以降 FORECAST_HORIZON_DAYS 日分の予測個数を書き込む
+    """
+    __tablename__ = "menu_forecasts"
+
+    forecast_date = Column(Date, primary_key=True)
+    menu_id = Column(Integer, ForeignKey("menus.id"), primary_key=True)
+    quantity = Column(Float, nullable=False)  # 予測個数（期待値）
+    upper = Column(Integer, nullable=False)  # この数を用意すれば約9割の日で足りる個数
+    generated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class ForecastRun(Base):
+    """
+    需要予測ジョブの実行記録テーブル
+
+    実行日ごとに1行。started_at を条件にした UPDATE で取得した1プロセスだけが予測する
+    """
+    __tablename__ = "forecast_runs"
+
+    run_date = Column(Date, primary_key=True)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    menu_count = Column(Integer)
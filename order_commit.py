@@ -0,0 +1,340 @@
+"""
+注文の確定処理
+
+在庫・受取時間枠の引き当てと、グループコミットモード（ORDER_GROUP_COMMIT）を提供する
+
+グループコミットモードでは、同時に届いた注文を数ミリ秒だけ集め、
+1トランザクション・1回の複数行 INSERT ... RETURNING でまとめて登録する。
+最初に待ち始めたリクエストのスレッドがリーダーとしてまとめて処理し、
+他のリクエストは自分の結果（登録された行またはエラー）を受け取るまで待つ
+
+- 引き当て失敗などの注文ごとのエラーはその注文だけが受け取り、他の注文は登録される
+- まとめた登録自体が失敗した場合は、1件ずつのトランザクションでやり直す
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+import active_orders
+import jobs
+import order_etag
+import report_cache
+import slots
+import stock
+from database import SessionLocal
+from models import Menu, Order
+from schemas import OrderCreate
+
+# 環境変数を読み込み
+load_dotenv()
+
+# グループコミットモード（呼び出しごとに参照するため実行中に切り替えられる）
+ORDER_GROUP_COMMIT = os.getenv("ORDER_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+# 注文を集める最大時間（ミリ秒）
+ORDER_GROUP_COMMIT_WINDOW_MS = float(os.getenv("ORDER_GROUP_COMMIT_WINDOW_MS", "5"))
+# 1回にまとめる最大件数
+ORDER_GROUP_COMMIT_MAX_BATCH = int(os.getenv("ORDER_GROUP_COMMIT_MAX_BATCH", "100"))
+
+logger = logging.getLogger(__name__)
+
+
+def reserve(db: Session, menu: Menu, order: OrderCreate, order_date: date) -> Optional[int]:
+    """
+    注文の在庫と受取時間枠を引き当て（呼び出し側のトランザクション内で実行）
+
+    受取時間枠が満枠の場合は引き当て済みの在庫を戻してから例外を送出するため、
+    同じトランザクションの他の注文に影響しない
+
+    Args:
+        db: データベースセッション
+        menu: 注文するメニュー
+        order: 注文内容
+        order_date: 注文日
+
+    Returns:
+        Optional[int]: 引き当て後の在庫の残数（在庫管理しないメニューはNone）
+
+    Raises:
+        HTTPException: 売り切れ・満枠の場合 409
+    """
+    remaining = None
+    if menu.daily_stock is not None:
+        remaining = stock.reserve(db, menu, order_date, order.quantity)
+        if remaining is None:
+            stock.invalidate(menu.store_id, order_date)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Menu is sold out"
+            )
+
+    if order.delivery_time is not None:
+        if not slots.reserve(db, menu.store_id, order_date, order.delivery_time, order.quantity):
+            if remaining is not None:
+                stock.release(db, menu.id, order_date, order.quantity)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Pickup slot is full"
+            )
+    return remaining
+
+
+def reserved_date(order) -> date:
+    """
+    注文が在庫・受取時間枠を引き当てた日（キャンセル・キャンセル取り消しで戻す・引き当て直す日）
+
+    引き当てはアプリの日付で行うため、DB側の時刻である ordered_at の日付とは
+    タイムゾーンの違いで異なることがある。pickup_date の無い古い注文は ordered_at の日付を使う
+    """
+    return order.pickup_date or order.ordered_at.date()
+
+
+def change_status(db: Session, order: Order, new_status: str) -> str:
+    """
+    注文のステータスを読み込んだ時点のステータスからだけ変更（呼び出し側のトランザクション内で実行）
+
+    UPDATE ... WHERE id = :id AND status = :expected で変更するため、同じ注文を同時に
+    変更したリクエストのうち1つだけが成功する。在庫・受取時間枠の戻し・引き当て直しは
+    成功した後に同じトランザクションで行う（二重に戻されない）
+
+    Args:
+        db: データベースセッション
+        order: 変更する注文（読み込んだ時点のステータスを持つ）
+        new_status: 変更後のステータス
+
+    Returns:
+        str: 変更前のステータス
+
+    Raises:
+        HTTPException: 他のリクエストが先にステータスを変更していた場合 409
+    """
+    old_status = order.status
+    result = db.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == old_status)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order status was changed by another request"
+        )
+    # Core の UPDATE はマッパーイベントを通らないため注文バージョンを直接増やす
+    order_etag.bump(db, [order.user_id])
+    return old_status
+
+
+def release_reservation(db: Session, order: Order) -> date:
+    """
+    キャンセルした注文の在庫と受取時間枠を戻す（呼び出し側のトランザクション内で実行）
+
+    change_status でキャンセルに変更できた場合だけ呼ぶ（同時のキャンセルで二重に戻さない）
+
+    Returns:
+        date: 戻した日（在庫のキャッシュの破棄用）
+    """
+    order_date = reserved_date(order)
+    stock.release(db, order.menu_id, order_date, order.quantity)
+    if order.delivery_time is not None:
+        slots.release(db, order.store_id, order_date, order.delivery_time, order.quantity)
+    return order_date
+
+
+def restore_reservation(db: Session, order: Order) -> date:
+    """
+    キャンセルを取り消した注文の在庫と受取時間枠を引き当て直す（呼び出し側のトランザクション内で実行）
+
+    受付済みの注文を戻すため在庫・容量は超えても引き当てる。
+    change_status でキャンセルから変更できた場合だけ呼ぶ
+
+    Returns:
+        date: 引き当てた日（在庫のキャッシュの破棄用）
+    """
+    order_date = reserved_date(order)
+    menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+    if menu.daily_stock is not None:
+        stock.reserve(db, menu, order_date, order.quantity, check_stock=False)
+    if order.delivery_time is not None:
+        slots.reserve(db, order.store_id, order_date, order.delivery_time, order.quantity,
+                      check_capacity=False)
+    return order_date
+
+
+class PendingOrder:
+    """グループコミット待ちの注文"""
+    __slots__ = ("user_id", "order", "result", "error", "done")
+
+    def __init__(self, user_id: int, order: OrderCreate):
+        self.user_id = user_id
+        self.order = order
+        self.result: Optional[dict] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class OrderGroupCommitter:
+    """同時に届いた注文をまとめて登録する"""
+
+    def __init__(self, window_ms: float = ORDER_GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = ORDER_GROUP_COMMIT_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending: List[PendingOrder] = []
+        self._leader_waiting = False
+        self.batches = 0
+        self.orders = 0
+
+    def submit(self, user_id: int, order: OrderCreate) -> dict:
+        """
+        注文を登録（登録されるまでブロックする）
+
+        Args:
+            user_id: 注文するユーザーのID
+            order: 注文内容
+
+        Returns:
+            dict: OrderResponse 形式の登録された注文
+
+        Raises:
+            HTTPException: メニューが無い・売り切れ・満枠の場合
+        """
+        item = PendingOrder(user_id, order)
+        with self._cond:
+            self._pending.append(item)
+            leader = not self._leader_waiting
+            if leader:
+                self._leader_waiting = True
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+        if leader:
+            self._lead()
+
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self.window
+        while True:
+            with self._cond:
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                # 上限を超えて溜まっている分は引き続きこのスレッドが処理する
+                leftover = bool(self._pending)
+                if not leftover:
+                    self._leader_waiting = False
+            self._process(batch)
+            if not leftover:
+                return
+            deadline = time.monotonic()
+
+    def _process(self, batch: List[PendingOrder]):
+        try:
+            self._commit(batch)
+        except Exception as exc:
+            if len(batch) == 1:
+                logger.exception("Failed to create order for user %s", batch[0].user_id)
+                batch[0].error = HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Failed to create order"
+                )
+                batch[0].error.__cause__ = exc
+            else:
+                # まとめた登録が失敗した場合は1件ずつやり直して失敗を切り分ける
+                for item in batch:
+                    item.error = None
+                    item.result = None
+                    self._process([item])
+        finally:
+            for item in batch:
+                item.done.set()
+
+    def _commit(self, batch: List[PendingOrder]):
+        today = date.today()
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            menu_ids = {item.order.menu_id for item in batch}
+            menus: Dict[int, Menu] = {
+                menu.id: menu for menu in db.query(Menu).filter(
+                    Menu.id.in_(menu_ids),
+                    Menu.is_available == True
+                )
+            }
+
+            accepted: List[PendingOrder] = []
+            sold_out = set()
+            for item in batch:
+                menu = menus.get(item.order.menu_id)
+                if menu is None:
+                    item.error = HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="Menu not found or not available"
+                    )
+                    continue
+                try:
+                    remaining = reserve(db, menu, item.order, today)
+                except HTTPException as exc:
+                    item.error = exc
+                    continue
+                if remaining == 0:
+                    sold_out.add(menu.store_id)
+                accepted.append(item)
+
+            if accepted:
+                rows = db.execute(
+                    insert(Order).returning(*Order.__table__.c, sort_by_parameter_order=True),
+                    [
+                        {
+                            "store_id": menus[item.order.menu_id].store_id,
+                            "user_id": item.user_id,
+                            "menu_id": item.order.menu_id,
+                            "quantity": item.order.quantity,
+                            "total_price": menus[item.order.menu_id].price * item.order.quantity,
+                            "delivery_time": item.order.delivery_time,
+                            "pickup_date": today,
+                            "notes": item.order.notes,
+                        }
+                        for item in accepted
+                    ]
+                ).all()
+                for item, row in zip(accepted, rows):
+                    item.result = {**row._mapping, "menu": menus[row.menu_id]}
+                    jobs.enqueue(db, "order.created", order_id=row.id, user_id=row.user_id,
+                                 menu_id=row.menu_id, quantity=row.quantity)
+                # バルク INSERT はマッパーイベントを通らないため注文バージョンと売上レポートのキャッシュを直接更新
+                order_etag.bump(db, [item.user_id for item in accepted])
+                report_cache.invalidate_orders(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        active_orders.index.apply_many(item.result for item in accepted)
+        self.batches += 1
+        self.orders += len(accepted)
+        for store_id in sold_out:
+            stock.invalidate(store_id, today)
+
+
+# プロセス全体で共有するグループコミット
+committer = OrderGroupCommitter()
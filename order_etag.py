@@ -0,0 +1,115 @@
+"""
+注文履歴の条件付きGET
+
+お客様ごとの注文バージョン（users.order_version）を、そのお客様の注文が
+INSERT・UPDATE・DELETE されるたびに同じトランザクションで1増やす。
+注文履歴・注文詳細はバージョンとメニューの最終更新時刻から ETag を作り、
+If-None-Match が一致すれば注文を読まずに 304 を返す
+
+- バージョンは注文より先に読むため、ETag が返すデータより新しくなることはない
+  （レプリカの遅延中に読んだ場合も、次のリクエストで改めて全件を返す）
+- ORM のフラッシュで書き込まれる注文はマッパーイベントで自動的に反映される。
+  Core / バルク INSERT で注文を書き込む場合は bump() を呼ぶ
+- アーカイブへの移動は注文の内容を変えないためバージョンを変えない
+"""
+
+import zlib
+from typing import Iterable, Optional
+
+from fastapi import Request, Response, status
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+import menu_cache
+from models import Menu, Order, User
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def bump(db, user_ids: Iterable[int]):
+    """
+    お客様の注文バージョンを1増やす（呼び出し側のトランザクション内で実行）
+
+    Args:
+        db: データベースセッションまたはコネクション
+        user_ids: 注文が変わったユーザーのID
+    """
+    ids = sorted(set(user_ids))
+    if not ids:
+        return
+    users = User.__table__
+    db.execute(
+        update(users).where(users.c.id.in_(ids)).values(order_version=users.c.order_version + 1)
+    )
+
+
+def _has_column_changes(target) -> bool:
+    state = inspect(target)
+    return any(state.attrs[attr.key].history.has_changes() for attr in state.mapper.column_attrs)
+
+
+@event.listens_for(Order, "after_insert")
+@event.listens_for(Order, "after_delete")
+def _bump_on_write(mapper, connection, target):
+    bump(connection, [target.user_id])
+
+
+@event.listens_for(Order, "after_update")
+def _bump_on_update(mapper, connection, target):
+    # メニューの付け替えなど、列の値が変わらないフラッシュでは増やさない
+    if _has_column_changes(target):
+        bump(connection, [target.user_id])
+
+
+def history_etag(db: Session, user_id: int) -> str:
+    """
+    お客様の注文履歴の ETag を取得（1回のクエリ）
+
+    メニューの名前・価格・画像は注文のレスポンスに含まれるため、
+    メニューの最終更新時刻も ETag に含める（変わっていればメニューのキャッシュも破棄する）。
+    クエリは users の主キー検索と、ix_menus_updated_at の末尾1件の読み取り（メニューの件数によらない）
+
+    Args:
+        db: 注文を読むのと同じデータベースセッション
+        user_id: ユーザーID
+
+    Returns:
+        str: 弱い ETag（例 W/"12.34.5f3a9c1e"）
+    """
+    version, menu_updated_at = db.query(
+        User.order_version,
+        select(func.max(Menu.updated_at)).scalar_subquery()
+    ).filter(User.id == user_id).one()
+    menu_cache.menus.observe(menu_updated_at)
+    menu_stamp = zlib.crc32(str(menu_updated_at).encode())
+    return f'W/"{user_id}.{version}.{menu_stamp:08x}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    # 弱い比較（W/ の有無を区別しない）
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    If-None-Match を評価
+
+    一致しない場合はレスポンスに ETag を設定して None を返す
+
+    Args:
+        request: リクエスト
+        response: エンドポイントのレスポンス（ヘッダー設定用）
+        etag: 現在の ETag
+
+    Returns:
+        Optional[Response]: 一致した場合は 304 レスポンス
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
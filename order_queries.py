@@ -0,0 +1,71 @@
+"""
+注文一覧のクエリ
+
+注文履歴（お客様）と注文一覧（店舗）のページ取得に使うステートメントを、
+検索条件の組み合わせごとに1回だけ作って使い回す
+
+ORM の Query をリクエストごとに組み立てると、式の生成とキャッシュキーの計算が毎回発生する。
+値をすべてバインドパラメータにしたステートメントはキャッシュキーが記憶されるため、
+2回目以降はコンパイル済みのSQLをそのまま使える（SQLが同じなのでサーバー側のプリペアドステートメントも再利用される）
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import Integer, bindparam, desc, func, select
+from sqlalchemy.orm import Session
+
+# 検索条件の名前（バインドパラメータ名）→ 条件式
+_CONDITIONS = {
+    "user_id": lambda source: source.user_id == bindparam("user_id"),
+    "store_id": lambda source: source.store_id == bindparam("store_id"),
+    "status": lambda source: source.status == bindparam("status"),
+    "start": lambda source: source.ordered_at >= bindparam("start"),
+    "end": lambda source: source.ordered_at <= bindparam("end"),
+    "slot_start": lambda source: source.delivery_time >= bindparam("slot_start"),
+    "slot_end": lambda source: source.delivery_time < bindparam("slot_end"),
+}
+
+
+@lru_cache(maxsize=None)
+def page_statements(source, names: Tuple[str, ...]):
+    """
+    件数とページの行を取得するステートメント（検索条件の組み合わせごとにキャッシュ）
+
+    Args:
+        source: 注文エンティティ（Order または AllOrders）
+        names: 使う検索条件の名前
+
+    Returns:
+        Tuple[Select, Select]: (件数, 注文日時の新しい順のページ)
+    """
+    conditions = [_CONDITIONS[name](source) for name in names]
+    count = select(func.count()).select_from(source).where(*conditions)
+    rows = (
+        select(source).where(*conditions)
+        .order_by(desc(source.ordered_at))
+        .offset(bindparam("offset", type_=Integer))
+        .limit(bindparam("limit", type_=Integer))
+    )
+    return count, rows
+
+
+def fetch_page(db: Session, source, criteria: Dict[str, Any], page: int, per_page: int) -> Tuple[List, int]:
+    """
+    注文を注文日時の新しい順に1ページ取得
+
+    Args:
+        db: データベースセッション
+        source: 注文エンティティ（Order または AllOrders）
+        criteria: 検索条件の名前 → 値（Noneの条件は使わない）
+        page: ページ番号
+        per_page: 1ページあたりの件数
+
+    Returns:
+        Tuple[List, int]: (ページの注文, 総件数)
+    """
+    params = {name: value for name, value in criteria.items() if value is not None}
+    count, rows = page_statements(source, tuple(sorted(params)))
+    total = db.execute(count, params).scalar_one()
+    orders = db.execute(rows, {**params, "offset": (page - 1) * per_page, "limit": per_page}).scalars().all()
+    return orders, total
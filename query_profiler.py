@@ -0,0 +1,205 @@
+"""
+クエリプロファイラ（デバッグモード）
+
+QUERY_DEBUG を有効にした場合のみ組み込まれ、以下を行う
+- レスポンスに X-Query-Count / X-DB-Time-ms ヘッダーを付与
+- 閾値を超えたSQLを正規化したSQLとバインドパラメータ付きでログ出力
+- 遅いリクエストのクエリタイムラインをリングバッファに保持
+"""
+
+import logging
+import os
+import re
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+import metrics
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+QUERY_DEBUG = os.getenv("QUERY_DEBUG", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_REQUEST_MS = float(os.getenv("QUERY_DEBUG_SLOW_REQUEST_MS", "50"))
+MAX_QUERIES_PER_REQUEST = int(os.getenv("QUERY_DEBUG_MAX_QUERIES", "20"))
+RING_BUFFER_SIZE = int(os.getenv("QUERY_DEBUG_BUFFER_SIZE", "50"))
+
+# ログに出すパラメータの最大長
+MAX_PARAMS_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    SQLを1行に正規化
+
+    SQLAlchemyが発行するSQLはパラメータがプレースホルダになっているため、
+    空白をまとめるだけで同じ形のクエリは同じ文字列になる
+    """
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def format_params(parameters) -> str:
+    """バインドパラメータをログ用の文字列に変換"""
+    text = repr(parameters)
+    if len(text) > MAX_PARAMS_LENGTH:
+        text = text[:MAX_PARAMS_LENGTH] + "..."
+    return text
+
+
+class QueryRecord:
+    """1クエリ分の記録"""
+    __slots__ = ("offset_ms", "duration_ms", "statement", "parameters")
+
+    def __init__(self, offset_ms: float, duration_ms: float, statement: str, parameters: str):
+        self.offset_ms = offset_ms
+        self.duration_ms = duration_ms
+        self.statement = statement
+        self.parameters = parameters
+
+
+class RequestProfile:
+    """1リクエスト分のクエリタイムライン"""
+    __slots__ = ("method", "path", "route", "status_code", "started_at",
+                 "start", "duration_ms", "db_time_ms", "queries")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route = metrics.UNMATCHED_ROUTE
+        self.status_code = 500
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = 0.0
+        self.db_time_ms = 0.0
+        self.queries: List[QueryRecord] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "db_time_ms": round(self.db_time_ms, 3),
+            "query_count": len(self.queries),
+            "queries": [
+                {
+                    "offset_ms": round(q.offset_ms, 3),
+                    "duration_ms": round(q.duration_ms, 3),
+                    "statement": q.statement,
+                    "parameters": q.parameters,
+                }
+                for q in self.queries
+            ],
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("query_profile", default=None)
+
+# 遅いリクエストのリングバッファ（イベントループのスレッドからのみ更新）
+slow_requests: deque = deque(maxlen=RING_BUFFER_SIZE)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiler_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    end = time.perf_counter()
+    duration_ms = (end - context._profiler_start) * 1000
+    sql = normalize_sql(statement)
+    params = format_params(parameters)
+
+    if duration_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            "Slow query (%.1f ms) on %s: %s | params=%s",
+            duration_ms, profile.path if profile else "-", sql, params
+        )
+
+    if profile is not None:
+        profile.queries.append(
+            QueryRecord((context._profiler_start - profile.start) * 1000, duration_ms, sql, params)
+        )
+        profile.db_time_ms += duration_ms
+
+
+def instrument_engine(engine):
+    """
+    エンジンにプロファイラ用のイベントフックを登録
+
+    Args:
+        engine: SQLAlchemyエンジン
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _is_worth_keeping(profile: RequestProfile) -> bool:
+    return (profile.db_time_ms >= SLOW_REQUEST_MS
+            or profile.duration_ms >= SLOW_REQUEST_MS
+            or len(profile.queries) >= MAX_QUERIES_PER_REQUEST)
+
+
+class QueryProfilerMiddleware:
+    """リクエストごとのクエリタイムラインを記録するASGIミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _current_profile.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-query-count", str(len(profile.queries)).encode()))
+                headers.append((b"x-db-time-ms", f"{profile.db_time_ms:.3f}".encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_profile.reset(token)
+            profile.duration_ms = (time.perf_counter() - profile.start) * 1000
+            profile.route = metrics.route_template(scope)
+            if _is_worth_keeping(profile):
+                slow_requests.append(profile)
+
+
+def worst_requests(limit: int, sort: str = "db_time") -> List[dict]:
+    """
+    リングバッファ内のリクエストを悪い順に取得
+
+    Args:
+        limit: 取得件数
+        sort: 並び順 (db_time, query_count, duration)
+
+    Returns:
+        List[dict]: タイムライン付きのリクエスト情報
+    """
+    keys = {
+        "db_time": lambda p: p.db_time_ms,
+        "query_count": lambda p: len(p.queries),
+        "duration": lambda p: p.duration_ms,
+    }
+    profiles = sorted(slow_requests, key=keys[sort], reverse=True)
+    return [p.to_dict() for p in profiles[:limit]]
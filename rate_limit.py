@@ -0,0 +1,241 @@
+"""
+レート制限
+
+ルートごとにトークンバケットで単位時間あたりのリクエスト数を制限する
+バケットはトークンのユーザー名（未認証の場合はクライアントIP）ごとに持つ
+
+- 制限内のレスポンスにも RateLimit-Limit / RateLimit-Remaining / RateLimit-Reset /
+  RateLimit-Policy ヘッダーを付与
+- 超過時は 429 と Retry-After を返し、DBやパスワード検証まで到達させない
+
+バケットの更新はイベントループのスレッド（ミドルウェア）だけが行うため、
+ロックを使わずに更新できる。満タンになるまで使われなかったバケットは
+未作成と同じ状態なので、古い順に破棄してメモリをアクティブなキーの数に抑える
+"""
+
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from auth import verify_token
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+# リバースプロキシ配下で X-Forwarded-For の先頭をクライアントIPとして使う
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+# ルールごとに保持するキーの上限（超えた場合は最も古いキーから破棄）
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+def parse_limit(value: str) -> Optional[Tuple[int, float]]:
+    """
+    "回数/秒数" 形式の制限値を解析
+
+    Args:
+        value: 例 "10/60"（60秒あたり10回）。空文字または "0" は制限なし
+
+    Returns:
+        Optional[Tuple[int, float]]: (回数, 秒数)。制限なしの場合None
+    """
+    value = value.strip()
+    if not value or value == "0":
+        return None
+    count, _, period = value.partition("/")
+    return int(count), float(period or "1")
+
+
+class RateLimitRule:
+    """
+    1ルート分の制限
+
+    回数分のリクエストをまとめて受け付け（バースト）、その後は
+    秒数 / 回数 ごとに1回分ずつ回復する
+    """
+
+    def __init__(self, name: str, method: str, path_pattern: str, limit: str, key: str):
+        """
+        Args:
+            name: ルール名（ポリシー名として使用）
+            method: HTTPメソッド
+            path_pattern: 対象パスの正規表現
+            limit: "回数/秒数" 形式の制限値
+            key: バケットのキー ("user": ユーザー名、未認証はIP / "ip": クライアントIP)
+        """
+        self.name = name
+        self.method = method
+        self.path = re.compile(path_pattern)
+        parsed = parse_limit(limit)
+        self.enabled = parsed is not None
+        self.capacity, self.period = parsed or (0, 1.0)
+        self.rate = self.capacity / self.period if self.enabled else 0.0
+        self.key = key
+        # キー → [トークン数, 最終更新時刻]（最近使われた順）
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def matches(self, method: str, path: str) -> bool:
+        return self.enabled and method == self.method and self.path.fullmatch(path) is not None
+
+    def _evict(self, now: float):
+        # period 秒使われなかったバケットは満タン（未作成と同じ）なので破棄できる
+        buckets = self.buckets
+        while buckets:
+            _, updated = next(iter(buckets.values()))
+            if now - updated < self.period and len(buckets) <= RATE_LIMIT_MAX_KEYS:
+                break
+            buckets.popitem(last=False)
+
+    def consume(self, key: str, now: float) -> Tuple[bool, float]:
+        """
+        トークンを1つ消費
+
+        Args:
+            key: バケットのキー
+            now: 現在時刻（time.monotonic()）
+
+        Returns:
+            Tuple[bool, float]: (許可されたか, 消費後のトークン数)
+        """
+        self._evict(now)
+        bucket = self.buckets.pop(key, None)
+        if bucket is None:
+            tokens = float(self.capacity)
+        else:
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self.buckets[key] = [tokens, now]
+        return allowed, tokens
+
+    def headers(self, tokens: float, allowed: bool) -> List[Tuple[bytes, bytes]]:
+        """
+        RateLimit ヘッダーを作成
+
+        Args:
+            tokens: 消費後のトークン数
+            allowed: 許可されたか
+        """
+        reset = math.ceil((self.capacity - tokens) / self.rate)
+        headers = [
+            (b"ratelimit-limit", str(self.capacity).encode()),
+            (b"ratelimit-remaining", str(int(tokens)).encode()),
+            (b"ratelimit-reset", str(reset).encode()),
+            (b"ratelimit-policy", f'{self.capacity};w={self.period:g};name="{self.name}"'.encode()),
+        ]
+        if not allowed:
+            retry_after = math.ceil((1.0 - tokens) / self.rate)
+            headers.append((b"retry-after", str(retry_after).encode()))
+        return headers
+
+
+# ルート別の制限（環境変数で "回数/秒数" を指定、"0" で無効）
+RULES = [
+    RateLimitRule("login", "POST", r"/api/auth/login",
+                  os.getenv("RATE_LIMIT_LOGIN", "10/60"), key="ip"),
+    RateLimitRule("register", "POST", r"/api/auth/register",
+                  os.getenv("RATE_LIMIT_REGISTER", "5/300"), key="ip"),
+    RateLimitRule("order", "POST", r"/api/customer/orders",
+                  os.getenv("RATE_LIMIT_ORDER", "20/60"), key="user"),
+    RateLimitRule("cancel", "PUT", r"/api/customer/orders/[^/]+/cancel",
+                  os.getenv("RATE_LIMIT_CANCEL", "20/60"), key="user"),
+]
+
+
+def client_ip(scope: dict) -> str:
+    """
+    クライアントIPを取得
+
+    Args:
+        scope: ASGIスコープ
+
+    Returns:
+        str: クライアントIP（不明な場合は "unknown"）
+    """
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _bearer_username(scope: dict) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return verify_token(token)
+            return None
+    return None
+
+
+def bucket_key(rule: RateLimitRule, scope: dict) -> str:
+    """
+    リクエストのバケットキーを決定
+
+    Args:
+        rule: 一致したルール
+        scope: ASGIスコープ
+
+    Returns:
+        str: "user:ユーザー名" または "ip:アドレス"
+    """
+    if rule.key == "user":
+        username = _bearer_username(scope)
+        if username is not None:
+            return f"user:{username}"
+    return f"ip:{client_ip(scope)}"
+
+
+class RateLimitMiddleware:
+    """ルート別のレート制限を行うASGIミドルウェア"""
+
+    def __init__(self, app, rules: List[RateLimitRule] = RULES):
+        self.app = app
+        self.rules = rules
+
+    def _match(self, scope) -> Optional[RateLimitRule]:
+        for rule in self.rules:
+            if rule.matches(scope["method"], scope["path"]):
+                return rule
+        return None
+
+    async def __call__(self, scope, receive, send):
+        rule = self._match(scope) if scope["type"] == "http" else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed, tokens = rule.consume(bucket_key(rule, scope), time.monotonic())
+        headers = rule.headers(tokens, allowed)
+
+        if not allowed:
+            body = json.dumps({"detail": "Too many requests"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *headers,
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,293 @@
+"""
+おすすめメニュー
+
+注文履歴から次の索引を作り、リクエストごとに履歴を読まずにおすすめを返す
+
+- よく注文するメニュー: お客様×メニューごとの注文数を新しい注文ほど重く数えた上位
+  （重みは RECOMMEND_HALF_LIFE_DAYS 日で半減）
+- 一緒に注文されるメニュー: 同じお客様が同じ日に注文したメニューの組の回数の上位
+- 人気メニュー: 店舗ごと・全体の重み付き注文数の上位（履歴の無いお客様向け）
+
+店舗を指定した場合は、その店舗のメニューだけを返す（店舗ごとの上位を別に持つため、
+他の店舗のメニューで上位が埋まって件数が減ることはない）
+
+索引は分析スナップショット（analytics.snapshot、差分で読み込まれる）から
+RECOMMEND_REFRESH_SECONDS ごとにバックグラウンドで作り直す。
+上位 RECOMMEND_TOP_K 件だけを CSR 形式（キーの配列・開始位置・値の配列）で持ち、
+参照は二分探索と k 件のスライスで済む
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import date
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+import analytics
+from database import SessionLocal
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 設定値
+RECOMMEND_REFRESH_SECONDS = float(os.getenv("RECOMMEND_REFRESH_SECONDS", "60"))
+RECOMMEND_HALF_LIFE_DAYS = float(os.getenv("RECOMMEND_HALF_LIFE_DAYS", "30"))
+RECOMMEND_LOOKBACK_DAYS = int(os.getenv("RECOMMEND_LOOKBACK_DAYS", "365"))
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class TopK:
+    """キーごとの上位 k 件（CSR 形式）"""
+
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray, values: np.ndarray):
+        self.keys = keys        # 昇順のキー
+        self.offsets = offsets  # keys[i] の値は values[offsets[i]:offsets[i + 1]]
+        self.values = values    # スコアの降順
+
+    @classmethod
+    def empty(cls) -> "TopK":
+        return cls(np.empty(0, np.int64), np.zeros(1, np.int64), np.empty(0, np.int64))
+
+    @classmethod
+    def build(cls, keys: np.ndarray, values: np.ndarray, scores: np.ndarray, k: int) -> "TopK":
+        """
+        (キー, 値, スコア) の組からキーごとのスコア上位 k 件を作る
+
+        Args:
+            keys: キー（重複なしの組であること）
+            values: 値
+            scores: スコア
+            k: キーごとの件数
+        """
+        if keys.size == 0:
+            return cls.empty()
+        # キーの昇順・スコアの降順（同点は値の昇順）に並べ、キーごとの先頭 k 件を残す
+        order = np.lexsort((values, -scores, keys))
+        keys, values = keys[order], values[order]
+        unique_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        rank = np.arange(keys.size) - np.repeat(starts, counts)
+        kept = rank < k
+        offsets = np.zeros(unique_keys.size + 1, np.int64)
+        np.cumsum(np.minimum(counts, k), out=offsets[1:])
+        return cls(unique_keys, offsets, values[kept])
+
+    def get(self, key: int) -> np.ndarray:
+        """キーの上位の値（無い場合は空）"""
+        i = np.searchsorted(self.keys, key)
+        if i == self.keys.size or self.keys[i] != key:
+            return self.values[:0]
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+
+def store_key(user_id, store_id):
+    """お客様×店舗のキー（店舗ごとのよく注文するメニューの索引用）"""
+    return (user_id << 32) | store_id
+
+
+class Index(NamedTuple):
+    """おすすめの索引（store_ で始まるものは店舗のメニューだけの上位）"""
+    favorites: TopK          # お客様 → よく注文するメニュー
+    store_favorites: TopK    # お客様×店舗（store_key）→ よく注文するメニュー
+    together: TopK           # メニュー → 一緒に注文されるメニュー
+    store_together: TopK     # メニュー → 一緒に注文される同じ店舗のメニュー
+    popular: np.ndarray      # 人気メニュー
+    store_popular: TopK      # 店舗 → 人気メニュー
+
+    @classmethod
+    def empty(cls) -> "Index":
+        return cls(TopK.empty(), TopK.empty(), TopK.empty(), TopK.empty(), np.empty(0, np.int64), TopK.empty())
+
+
+def _basket_pairs(basket_keys: np.ndarray, menu_index: np.ndarray):
+    """
+    同じバスケットに含まれる異なるメニューの組（順序あり）を列挙
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (メニュー, 一緒に含まれるメニュー) の位置
+    """
+    # バスケット×メニューの重複を除き、バスケット順に並べる
+    basket_menu = np.unique(np.stack([basket_keys, menu_index]), axis=1)
+    _, starts, sizes = np.unique(basket_menu[0], return_index=True, return_counts=True)
+    menus = basket_menu[1]
+    # 各要素を同じバスケットの全要素（自分を含む）と組にする
+    repeats = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(menus.size), repeats)
+    first = np.repeat(np.repeat(starts, sizes), repeats)
+    right = first + np.arange(left.size) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    distinct = left != right
+    return menus[left[distinct]], menus[right[distinct]]
+
+
+def build(rows: dict, today: date, half_life_days: float = RECOMMEND_HALF_LIFE_DAYS,
+          k: int = RECOMMEND_TOP_K) -> Index:
+    """
+    注文の列から索引を作る
+
+    Args:
+        rows: analytics.OrderSnapshot.select() の結果（キャンセル除く）
+        today: 基準日（重みの計算に使う）
+        half_life_days: 重みが半分になる日数
+        k: 保持する上位件数
+
+    Returns:
+        Index: おすすめの索引
+    """
+    user_ids = rows["user_id"].astype(np.int64)
+    menu_ids = rows["menu_id"].astype(np.int64)
+    if menu_ids.size == 0:
+        return Index.empty()
+
+    age = today.toordinal() - rows["day"].astype(np.int64)
+    weights = np.exp2(-np.maximum(age, 0) / half_life_days)
+
+    # メニューIDを 0..M-1 に詰める
+    menus, menu_index = np.unique(menu_ids, return_inverse=True)
+    menu_count = menus.size
+
+    # メニューの店舗（メニューは1つの店舗に属する）
+    menu_stores = np.zeros(menu_count, np.int64)
+    menu_stores[menu_index] = rows["store_id"]
+
+    # よく注文するメニュー（お客様×メニューの重み付き件数）
+    pair_keys, pair_index = np.unique(user_ids * menu_count + menu_index, return_inverse=True)
+    pair_scores = np.bincount(pair_index, weights=weights)
+    pair_users, pair_menus = pair_keys // menu_count, pair_keys % menu_count
+    favorites = TopK.build(pair_users, menus[pair_menus], pair_scores, k)
+    store_favorites = TopK.build(store_key(pair_users, menu_stores[pair_menus]), menus[pair_menus],
+                                 pair_scores, k)
+
+    # 人気メニュー
+    menu_scores = np.bincount(menu_index, weights=weights, minlength=menu_count)
+    popular = menus[np.lexsort((menus, -menu_scores))][:k]
+    store_popular = TopK.build(menu_stores, menus, menu_scores, k)
+
+    # 一緒に注文されるメニュー（お客様×日のバスケットに含まれるメニューの組の回数）
+    # 組だけを数えるため、メモリはメニュー数ではなく組の数に比例する
+    basket_keys = (user_ids << 32) | rows["day"].astype(np.int64)
+    source, target = _basket_pairs(basket_keys, menu_index)
+    co_keys, co_counts = np.unique(source * menu_count + target, return_counts=True)
+    source, target = co_keys // menu_count, co_keys % menu_count
+    co_scores = co_counts.astype(float)
+    together = TopK.build(menus[source], menus[target], co_scores, k)
+    same_store = menu_stores[source] == menu_stores[target]
+    store_together = TopK.build(menus[source[same_store]], menus[target[same_store]], co_scores[same_store], k)
+
+    return Index(favorites, store_favorites, together, store_together, popular, store_popular)
+
+
+class RecommendationIndex:
+    """おすすめの索引（バックグラウンドで定期的に作り直す）"""
+
+    def __init__(self, refresh_seconds: float = RECOMMEND_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._index = None
+        self._task: Optional[asyncio.Task] = None
+        self.builds = 0
+
+    def rebuild(self, db: Session, only_if_missing: bool = False):
+        """
+        スナップショットを更新して索引を作り直す
+
+        Args:
+            db: データベースセッション（レプリカ可）
+            only_if_missing: 索引が既にあれば何もしない
+        """
+        with self._lock:
+            if only_if_missing and self._index is not None:
+                return
+            analytics.snapshot.refresh(db)
+            today = date.today()
+            start = date.fromordinal(today.toordinal() - RECOMMEND_LOOKBACK_DAYS)
+            self._index = build(analytics.snapshot.select(start, today), today)
+            self.builds += 1
+
+    def _rebuild_with_session(self, only_if_missing: bool = False):
+        db = SessionLocal()
+        try:
+            self.rebuild(db, only_if_missing)
+        finally:
+            db.close()
+
+    def ensure(self):
+        """
+        まだ作られていなければ作る（起動直後のリクエスト用）
+
+        プロセス全体の索引・注文分析のスナップショットになるため、リクエストのセッション
+        （レプリカの場合がある）ではなくプライマリのセッションで作る
+        """
+        if self._index is None:
+            self._rebuild_with_session(only_if_missing=True)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await run_in_threadpool(self._rebuild_with_session)
+            except Exception:
+                logger.exception("Failed to rebuild recommendation index")
+            await asyncio.sleep(self.refresh_seconds)
+
+    def recommend(self, user_id: int, limit: int, store_id: Optional[int] = None) -> dict:
+        """
+        お客様へのおすすめメニューIDを取得
+
+        Args:
+            user_id: ユーザーID
+            limit: 各一覧の件数
+            store_id: 店舗ID（指定した場合はその店舗のメニューのみ）
+
+        Returns:
+            dict: {"favorites", "together", "popular"} → メニューIDのリスト
+        """
+        index = self._index
+        if store_id is None:
+            favorites = index.favorites.get(user_id)
+            together_index, popular = index.together, index.popular
+        else:
+            favorites = index.store_favorites.get(store_key(user_id, store_id))
+            together_index, popular = index.store_together, index.store_popular.get(store_id)
+
+        favorites = [int(m) for m in favorites[:limit]]
+
+        # よく注文するメニューと一緒に注文されるメニュー（既に選んだものは除く）
+        seen = set(favorites)
+        together: List[int] = []
+        for menu_id in favorites:
+            for other in together_index.get(menu_id):
+                other = int(other)
+                if other not in seen:
+                    seen.add(other)
+                    together.append(other)
+            if len(together) >= limit:
+                break
+
+        return {
+            "favorites": favorites,
+            "together": together[:limit],
+            "popular": [int(m) for m in popular[:limit]],
+        }
+
+
+# プロセス全体で共有する索引
+index = RecommendationIndex()
@@ -0,0 +1,327 @@
+"""
+売上レポートの日別キャッシュ
+
+前日以前の売上は注文が完了・キャンセルされた後は変わらないため、店舗・日ごとの集計値
+（メニュー別の内訳を含む）を sales_report_days に保存して再利用する。
+当日（と未来の日）だけを毎回集計するので、365日分のレポートもほぼ1日分の負荷で返せる
+
+- 日は DB の date(ordered_at) で分けるため、締まった日（前日以前）もアプリの日付ではなく
+  DB の現在時刻で判定する（アプリとDBのタイムゾーンが異なっても DB の当日をキャッシュしない）。
+  日付が変わってから REPORT_CLOSE_GRACE_SECONDS 秒は、日付をまたいだトランザクションの注文のため前日も締めない
+- キャッシュは参照時に足りない日だけを1回の GROUP BY で集計して埋める
+- 前日以前の注文が後から登録・変更・削除された場合は、同じトランザクションでその日の
+  店舗・日の generation を増やしてキャッシュを無効にする（Order のマッパーイベント、
+  バルク INSERT では invalidate_orders()）
+- 集計前に読んだ generation を条件に保存するため、集計中に無効化された日の
+  古い集計値が保存されることはない（無効化は行が無い日も行を作ってから generation を増やす）
+"""
+
+import json
+import logging
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, event, func, inspect, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from archive import order_source
+from database import SessionLocal, insert_or_ignore
+from models import Order, SalesReportDay
+
+# 環境変数を読み込み
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 日付が変わってから前日を締めるまでの秒数
+REPORT_CLOSE_GRACE_SECONDS = float(os.getenv("REPORT_CLOSE_GRACE_SECONDS", "300"))
+
+# 売上レポートの集計に使う注文の列（これ以外の変更ではキャッシュを無効にしない）
+REPORT_COLUMNS = ("status", "quantity", "total_price", "menu_id", "ordered_at", "store_id")
+
+
+def _as_date(value) -> date:
+    # SQLite の date() は文字列を返す
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _first_open_day(db: Session) -> date:
+    """キャッシュしない最初の日（DBの現在時刻から猶予を引いた日。date(ordered_at) と同じ時計・タイムゾーン）"""
+    now = db.execute(select(func.now())).scalar()
+    if isinstance(now, str):
+        # SQLite の CURRENT_TIMESTAMP は文字列（UTC）
+        now = datetime.fromisoformat(now)
+    return (now - timedelta(seconds=REPORT_CLOSE_GRACE_SECONDS)).date()
+
+
+def _is_closed(ordered_at: datetime) -> bool:
+    """
+    注文日時の日がキャッシュされている可能性があるか（DB の当日より前か）
+
+    DB から読んだ ordered_at は DB のタイムゾーン（SQLite はタイムゾーン無しの UTC）なので、
+    同じタイムゾーンの現在時刻の日付と比べる
+    """
+    if ordered_at.tzinfo is not None:
+        now = datetime.now(ordered_at.tzinfo)
+    else:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return ordered_at.date() < now.date()
+
+
+def _empty() -> dict:
+    return {"total_orders": 0, "total_sales": 0, "menus": []}
+
+
+def compute(db: Session, store_id: int, start: date, end: date) -> Dict[date, dict]:
+    """
+    店舗の指定期間の日別・メニュー別の売上を集計（キャンセルを除く）
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        start: 開始日
+        end: 終了日（この日を含む）
+
+    Returns:
+        Dict[date, dict]: 日付 → {"total_orders", "total_sales", "menus": [[メニューID, 注文数, 数量, 売上], ...]}
+                          注文の無い日は含まない
+    """
+    start_dt = datetime.combine(start, time.min)
+    end_dt = datetime.combine(end + timedelta(days=1), time.min)
+    source = order_source(start_dt)
+    day = func.date(source.ordered_at)
+
+    rows = db.query(
+        day,
+        source.menu_id,
+        func.count(source.id),
+        func.sum(source.quantity),
+        func.sum(source.total_price)
+    ).filter(
+        source.store_id == store_id,
+        source.ordered_at >= start_dt,
+        source.ordered_at < end_dt,
+        source.status != "cancelled"
+    ).group_by(day, source.menu_id).all()
+
+    days: Dict[date, dict] = {}
+    for day_value, menu_id, orders, quantity, sales in rows:
+        entry = days.setdefault(_as_date(day_value), _empty())
+        entry["total_orders"] += orders
+        entry["total_sales"] += sales
+        entry["menus"].append([menu_id, orders, quantity, sales])
+    return days
+
+
+def _fill(store_id: int, days: List[date]) -> Dict[date, dict]:
+    # 保存は常にプライマリで行い、集計もプライマリで行う（レプリカの遅延分を保存しないため）
+    db = SessionLocal()
+    try:
+        for day in days:
+            insert_or_ignore(db, SalesReportDay, {"store_id": store_id, "report_date": day, "generation": 0},
+                             ["store_id", "report_date"])
+        db.commit()
+
+        # generation を集計より先に読む
+        generations = dict(db.query(SalesReportDay.report_date, SalesReportDay.generation).filter(
+            SalesReportDay.store_id == store_id,
+            SalesReportDay.report_date.in_(days)
+        ).all())
+        computed = compute(db, store_id, days[0], days[-1])
+
+        table = SalesReportDay.__table__
+        now = datetime.now(timezone.utc)
+        db.execute(
+            update(table).where(
+                table.c.store_id == store_id,
+                table.c.report_date == bindparam("_date"),
+                table.c.generation == bindparam("_generation")
+            ).values(
+                cached_generation=bindparam("_generation"),
+                total_orders=bindparam("_orders"),
+                total_sales=bindparam("_sales"),
+                menu_sales=bindparam("_menus"),
+                cached_at=now
+            ),
+            [
+                {
+                    "_date": day,
+                    "_generation": generations[day],
+                    "_orders": computed.get(day, _empty())["total_orders"],
+                    "_sales": computed.get(day, _empty())["total_sales"],
+                    "_menus": json.dumps(computed.get(day, _empty())["menus"]),
+                }
+                for day in days
+            ]
+        )
+        db.commit()
+        return {day: computed.get(day, _empty()) for day in days}
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("Failed to cache sales report of store %s for %s..%s", store_id, days[0], days[-1])
+        return {}
+    finally:
+        db.close()
+
+
+def daily_sales(db: Session, store_id: int, start: date, end: date) -> Dict[date, dict]:
+    """
+    店舗の指定期間の日別・メニュー別の売上を取得
+
+    前日以前（DBの日付）はキャッシュから読み（無い日は集計して保存）、当日以降は毎回集計する
+
+    Args:
+        db: データベースセッション（レプリカ可）
+        store_id: 店舗ID
+        start: 開始日
+        end: 終了日（この日を含む）
+
+    Returns:
+        Dict[date, dict]: 期間内の全ての日 → compute() と同じ形式の集計値
+    """
+    result: Dict[date, dict] = {}
+    if start > end:
+        return result
+    first_open = _first_open_day(db)
+
+    last_closed = min(end, first_open - timedelta(days=1))
+    if start <= last_closed:
+        cached = {
+            row.report_date: row
+            for row in db.query(SalesReportDay).filter(
+                SalesReportDay.store_id == store_id,
+                SalesReportDay.report_date >= start,
+                SalesReportDay.report_date <= last_closed
+            )
+        }
+        missing = []
+        day = start
+        while day <= last_closed:
+            row = cached.get(day)
+            if row is not None and row.cached_generation == row.generation:
+                result[day] = {
+                    "total_orders": row.total_orders,
+                    "total_sales": row.total_sales,
+                    "menus": json.loads(row.menu_sales or "[]"),
+                }
+            else:
+                missing.append(day)
+            day += timedelta(days=1)
+
+        if missing:
+            filled = _fill(store_id, missing)
+            if not filled:
+                # 保存に失敗した場合もレポートは返す
+                filled = compute(db, store_id, missing[0], missing[-1])
+            for day in missing:
+                result[day] = filled.get(day, _empty())
+
+    live_start = max(start, first_open)
+    if live_start <= end:
+        live = compute(db, store_id, live_start, end)
+        day = live_start
+        while day <= end:
+            result[day] = live.get(day, _empty())
+            day += timedelta(days=1)
+    return result
+
+
+# ===== キャッシュの無効化 =====
+
+def invalidate(connection, store_id: int, days: Iterable[date]):
+    """
+    店舗の指定日のキャッシュを無効化（呼び出し側のトランザクション内で実行）
+
+    Args:
+        connection: データベースコネクションまたはセッション
+        store_id: 店舗ID
+        days: 注文が変更された日（締まっていない日を含めてもよい）
+    """
+    closed = sorted(set(days))
+    if not closed:
+        return
+    # 行が無い日も作ってから増やす（集計中の _fill() が古い generation で保存しないように）
+    for day in closed:
+        insert_or_ignore(connection, SalesReportDay, {"store_id": store_id, "report_date": day, "generation": 0},
+                         ["store_id", "report_date"])
+    table = SalesReportDay.__table__
+    connection.execute(
+        update(table).where(
+            table.c.store_id == store_id,
+            table.c.report_date.in_(closed)
+        ).values(generation=table.c.generation + 1)
+    )
+
+
+def invalidate_orders(connection, orders: Iterable):
+    """
+    注文の日のうち、締まっている可能性のある日のキャッシュを無効化（呼び出し側のトランザクション内で実行）
+
+    日付をまたいだトランザクションで登録された注文や、注文日時を指定して登録された注文が対象
+
+    Args:
+        connection: データベースコネクションまたはセッション
+        orders: store_id と ordered_at を持つ注文（ORM オブジェクトまたは行）
+    """
+    days: Dict[int, set] = {}
+    for order in orders:
+        if order.ordered_at is not None and _is_closed(order.ordered_at):
+            days.setdefault(order.store_id, set()).add(order.ordered_at.date())
+    for store_id, store_days in days.items():
+        invalidate(connection, store_id, store_days)
+
+
+def _ordered_key(connection, target) -> Optional[Tuple[int, datetime]]:
+    # (店舗ID, 注文日時)。読み込まれていない列はDBから読む
+    store_id = target.__dict__.get("store_id")
+    ordered_at = target.__dict__.get("ordered_at")
+    if (store_id is None or ordered_at is None) and target.id is not None:
+        row = connection.execute(
+            select(Order.store_id, Order.ordered_at).where(Order.id == target.id)
+        ).first()
+        if row is not None:
+            store_id = store_id if store_id is not None else row.store_id
+            ordered_at = ordered_at if ordered_at is not None else row.ordered_at
+    if store_id is None or ordered_at is None:
+        return None
+    return store_id, ordered_at
+
+
+@event.listens_for(Order, "after_insert")
+def _invalidate_on_insert(mapper, connection, target):
+    # 新規注文はほぼ当日なので、日付をまたいだトランザクションの注文と
+    # 注文日時を指定して登録された注文（データ移行など）だけが対象
+    ordered_at = target.__dict__.get("ordered_at")
+    if ordered_at is not None and _is_closed(ordered_at):
+        invalidate(connection, target.store_id, [ordered_at.date()])
+
+
+@event.listens_for(Order, "after_delete")
+def _invalidate_on_delete(mapper, connection, target):
+    key = _ordered_key(connection, target)
+    if key is not None and _is_closed(key[1]):
+        invalidate(connection, key[0], [key[1].date()])
+
+
+@event.listens_for(Order, "after_update")
+def _invalidate_on_update(mapper, connection, target):
+    state = inspect(target)
+    histories = [state.attrs[key].history for key in REPORT_COLUMNS]
+    if not any(history.has_changes() for history in histories):
+        return
+    key = _ordered_key(connection, target)
+    if key is None:
+        return
+    store_id, ordered_at = key
+    # 注文日時・店舗が変わった場合は変更前の日・店舗も無効化
+    values = [ordered_at, *(value for value in state.attrs.ordered_at.history.deleted if value is not None)]
+    days = [value.date() for value in values if _is_closed(value)]
+    if not days:
+        return
+    for store in {store_id, *(value for value in state.attrs.store_id.history.deleted if value is not None)}:
+        invalidate(connection, store, days)
@@ -5,19 +5,27 @@
 """
 
 from datetime import timedelta
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from database import get_db
-from models import User
-from schemas import UserCreate, UserLogin, TokenResponse, UserResponse, SuccessResponse
+from dependencies import get_current_active_user, get_optional_current_user
+from models import Store, User
+from schemas import (
+    UserCreate, UserLogin, TokenResponse, UserResponse, SuccessResponse, StoreListResponse
+)
 from auth import verify_password, get_password_hash, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 
 router = APIRouter(prefix="/auth", tags=["認証"])
 
 
 @router.post("/register", response_model=UserResponse, summary="ユーザー登録")
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+def register_user(
+    user: UserCreate,
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_current_user)
+):
     """
     新しいユーザーを登録
     
@@ -26,7 +34,24 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     - **password**: パスワード（6文字以上）
     - **full_name**: 氏名
     - **role**: ロール（customer または store）
+    - **store_id**: 所属店舗（店舗スタッフの場合、省略時はログイン中のスタッフの店舗）
+    
+    店舗スタッフは、同じ店舗のスタッフがログインした状態でのみ登録できる
     """
+    # 店舗スタッフは同じ店舗のスタッフだけが作成できる（他店舗の注文・お客様情報を守る）
+    if user.role == "store":
+        if (current_user is None or current_user.role != "store" or not current_user.is_active
+                or current_user.store_id is None):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Store users can only be registered by staff of the store"
+            )
+        if user.store_id is not None and user.store_id != current_user.store_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Store users can only be registered for your own store"
+            )
+    
     # ユーザー名の重複チェック
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
@@ -43,6 +68,20 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
             detail="Email already registered"
         )
     
+    # 店舗スタッフは所属店舗を確認（お客様は店舗に属さない）
+    store_id = None
+    if user.role == "store":
+        store = db.query(Store).filter(
+            Store.id == current_user.store_id,
+            Store.is_active == True
+        ).first()
+        if not store:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="A valid store_id is required for store users"
+            )
+        store_id = store.id
+    
     # パスワードをハッシュ化
     hashed_password = get_password_hash(user.password)
     
@@ -52,7 +91,8 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         email=user.email,
         hashed_password=hashed_password,
         full_name=user.full_name,
-        role=user.role
+        role=user.role,
+        store_id=store_id
     )
     
     db.add(db_user)
@@ -103,6 +143,20 @@ def login_for_access_token(user_credentials: UserLogin, db: Session = Depends(ge
     }
 
 
+@router.get("/stores", response_model=StoreListResponse, summary="店舗一覧取得")
+def get_stores(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    営業中の店舗の一覧を取得
+    
+    お客様の店舗選択で使用（ログインが必要）
+    """
+    stores = db.query(Store).filter(Store.is_active == True).order_by(Store.id).all()
+    return {"stores": stores}
+
+
 @router.post("/logout", response_model=SuccessResponse, summary="ログアウト")
 def logout():
     """
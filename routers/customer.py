@@ -4,21 +4,40 @@
 お客様専用のAPIエンドポイント
 """
 
+from datetime import date
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import bindparam, select
 
-from database import get_db
+from database import get_db, get_read_db, mark_primary_sticky
 from dependencies import get_current_customer
-from models import User, Menu, Order
+from models import User, Menu, Order, ArchivedOrder
+from archive import order_source
+from cache import slot_availability_cache
+import active_orders
+import jobs
+import menu_cache
+import order_commit
+import order_etag
+import order_queries
+import recommendations
+import slots
+import stock
 from schemas import (
-    MenuResponse, MenuListResponse, MenuFilter,
-    OrderCreate, OrderResponse, OrderListResponse
+    MenuResponse, MenuListResponse, MenuFilter, RecommendedMenusResponse,
+    OrderCreate, OrderResponse, OrderListResponse,
+    SlotAvailabilityResponse
 )
 
 router = APIRouter(prefix="/customer", tags=["お客様"])
 
+# 注文するメニュー（リクエストごとに組み立てずに使い回す）
+_available_menu = select(Menu).where(
+    Menu.id == bindparam("menu_id"),
+    Menu.is_available == True
+).limit(1)
+
 
 @router.get("/menus", response_model=MenuListResponse, summary="メニュー一覧取得")
 def get_menus(
@@ -26,20 +45,24 @@ def get_menus(
     price_min: Optional[int] = Query(None, description="最低価格"),
     price_max: Optional[int] = Query(None, description="最高価格"),
     search: Optional[str] = Query(None, description="メニュー名で検索"),
+    store_id: Optional[int] = Query(None, description="店舗でフィルタ"),
     page: int = Query(1, ge=1, description="ページ番号"),
     per_page: int = Query(20, ge=1, le=100, description="1ページあたりの件数"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_customer)
 ):
     """
     メニュー一覧を取得
     
     - 利用可能なメニューのみ表示可能
-    - 価格範囲やキーワードでフィルタリング
+    - 価格範囲やキーワード、店舗でフィルタリング
     - ページネーション対応
     """
     query = db.query(Menu)
     
+    if store_id is not None:
+        query = query.filter(Menu.store_id == store_id)
+    
     # フィルタリング
     if is_available is not None:
         query = query.filter(Menu.is_available == is_available)
@@ -63,9 +86,43 @@ def get_menus(
     offset = (page - 1) * per_page
     menus = query.offset(offset).limit(per_page).all()
     
+    # 本日の残数・売り切れ状態を反映
+    stock.annotate(db, menus)
+    
     return {"menus": menus, "total": total}
 
 
+@router.get("/menus/recommended", response_model=RecommendedMenusResponse, summary="おすすめメニュー取得")
+def get_recommended_menus(
+    limit: int = Query(5, ge=1, le=10, description="各一覧の件数"),
+    store_id: Optional[int] = Query(None, description="店舗を指定した場合はその店舗のメニューのみ"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_customer)
+):
+    """
+    注文履歴に基づくおすすめメニューを取得
+    
+    - **favorites**: よく注文するメニュー（最近の注文ほど重視）
+    - **together**: よく注文するメニューと同じ日に注文されることが多いメニュー
+    - **popular**: 最近人気のメニュー（注文履歴が無い場合の代わり）
+    
+    バックグラウンドで作成した索引を参照するため、注文履歴は読まない
+    """
+    recommendations.index.ensure()
+    ids = recommendations.index.recommend(current_user.id, limit, store_id)
+    
+    wanted = set(ids["favorites"]) | set(ids["together"]) | set(ids["popular"])
+    menus = {
+        menu.id: menu for menu in db.query(Menu).filter(
+            Menu.id.in_(wanted),
+            Menu.is_available == True
+        ).all()
+    } if wanted else {}
+    stock.annotate(db, list(menus.values()))
+    
+    return {name: [menus[i] for i in menu_ids if i in menus] for name, menu_ids in ids.items()}
+
+
 @router.get("/menus/{menu_id}", response_model=MenuResponse, summary="メニュー詳細取得")
 def get_menu(
     menu_id: int,
@@ -86,12 +143,35 @@ def get_menu(
             detail="Menu not found"
         )
     
+    stock.annotate(db, [menu])
+    
     return menu
 
 
+@router.get("/slots", response_model=SlotAvailabilityResponse, summary="受取時間枠の空き状況")
+def get_slots(
+    store_id: int = Query(..., description="店舗ID"),
+    target_date: Optional[date] = Query(None, alias="date", description="対象日（省略時は本日）"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_customer)
+):
+    """
+    店舗の受取時間枠ごとの容量・予約数・残数を取得
+    
+    - 結果は店舗・日ごとに数秒間キャッシュして全お客様で共有
+    - 注文時の容量チェックはキャッシュではなくDB上で行う
+    """
+    target_date = target_date or date.today()
+    return slot_availability_cache.get_or_set(
+        (store_id, target_date),
+        lambda: slots.availability(db, store_id, target_date)
+    )
+
+
 @router.post("/orders", response_model=OrderResponse, summary="注文作成")
 def create_order(
     order: OrderCreate,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_customer)
 ):
@@ -102,12 +182,16 @@ def create_order(
     - **quantity**: 数量（1-10個）
     - **delivery_time**: 希望受取時間（任意）
     - **notes**: 備考（任意、500文字以内）
+    
+    ORDER_GROUP_COMMIT が有効な場合は同時に届いた注文とまとめて登録する
     """
+    if order_commit.ORDER_GROUP_COMMIT:
+        created = order_commit.committer.submit(current_user.id, order)
+        mark_primary_sticky(response)
+        return created
+    
     # メニューの存在確認
-    menu = db.query(Menu).filter(
-        Menu.id == order.menu_id,
-        Menu.is_available == True
-    ).first()
+    menu = db.execute(_available_menu, {"menu_id": order.menu_id}).scalars().first()
     
     if not menu:
         raise HTTPException(
@@ -115,22 +199,41 @@ def create_order(
             detail="Menu not found or not available"
         )
     
+    # 在庫と受取時間枠を引き当て（注文と同じトランザクション）
+    today = date.today()
+    remaining = order_commit.reserve(db, menu, order, today)
+    
     # 合計金額を計算
     total_price = menu.price * order.quantity
     
     # 注文を作成
     db_order = Order(
+        store_id=menu.store_id,
         user_id=current_user.id,
         menu_id=order.menu_id,
         quantity=order.quantity,
         total_price=total_price,
         delivery_time=order.delivery_time,
+        pickup_date=today,
         notes=order.notes
     )
     
     db.add(db_order)
+    db.flush()
+    
+    # 付随処理はコミット後にバックグラウンドで実行
+    jobs.enqueue(db, "order.created", order_id=db_order.id, user_id=current_user.id,
+                 menu_id=db_order.menu_id, quantity=db_order.quantity)
     db.commit()
     db.refresh(db_order)
+    active_orders.index.apply(db_order, current_user)
+    
+    # 売り切れになった場合はメニュー一覧に反映
+    if remaining == 0:
+        stock.invalidate(menu.store_id, today)
+    
+    # 直後の履歴取得はプライマリから読む
+    mark_primary_sticky(response)
     
     # メニュー情報も含めて返す
     db_order.menu = menu
@@ -140,10 +243,12 @@ def create_order(
 
 @router.get("/orders", response_model=OrderListResponse, summary="注文履歴取得")
 def get_my_orders(
+    request: Request,
+    response: Response,
     status_filter: Optional[str] = Query(None, description="ステータスでフィルタ"),
     page: int = Query(1, ge=1, description="ページ番号"),
     per_page: int = Query(20, ge=1, le=100, description="1ページあたりの件数"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_customer)
 ):
     """
@@ -152,26 +257,23 @@ def get_my_orders(
     - 最新の注文から順に表示
     - ステータスでフィルタリング可能
     - ページネーション対応
+    - 注文に変更がなければ If-None-Match に対して304を返す
     """
-    query = db.query(Order).filter(Order.user_id == current_user.id)
-    
-    # ステータスフィルタ
-    if status_filter:
-        query = query.filter(Order.status == status_filter)
-    
-    # 最新順でソート
-    query = query.order_by(desc(Order.ordered_at))
-    
-    # 総件数を取得
-    total = query.count()
-    
-    # ページネーション
-    offset = (page - 1) * per_page
-    orders = query.offset(offset).limit(per_page).all()
-    
-    # メニュー情報を含める
-    for order in orders:
-        order.menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+    # 注文より先にバージョンを読む（ETagがデータより新しくならないように）
+    etag = order_etag.history_etag(db, current_user.id)
+    unchanged = order_etag.not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    
+    # 完了・キャンセル済みの古い注文はアーカイブも含めて検索（最新順）
+    source = order_source(None, status_filter)
+    orders, total = order_queries.fetch_page(db, source, {
+        "user_id": current_user.id,
+        "status": status_filter or None,
+    }, page, per_page)
+    
+    # メニュー情報を含める（メニューのキャッシュから）
+    menu_cache.menus.attach(db, orders)
     
     return {"orders": orders, "total": total}
 
@@ -179,25 +281,41 @@ def get_my_orders(
 @router.get("/orders/{order_id}", response_model=OrderResponse, summary="注文詳細取得")
 def get_my_order(
     order_id: int,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_customer)
 ):
     """
     指定された注文の詳細を取得
+    
+    注文に変更がなければ If-None-Match に対して304を返す
     """
+    etag = order_etag.history_etag(db, current_user.id)
+    unchanged = order_etag.not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    
     order = db.query(Order).filter(
         Order.id == order_id,
         Order.user_id == current_user.id
     ).first()
     
+    # 見つからない場合はアーカイブを検索
+    if not order:
+        order = db.query(ArchivedOrder).filter(
+            ArchivedOrder.id == order_id,
+            ArchivedOrder.user_id == current_user.id
+        ).first()
+    
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found"
         )
     
-    # メニュー情報を含める
-    order.menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+    # メニュー情報を含める（メニューのキャッシュから）
+    menu_cache.menus.attach(db, [order])
     
     return order
 
@@ -205,6 +323,7 @@ def get_my_order(
 @router.put("/orders/{order_id}/cancel", response_model=OrderResponse, summary="注文キャンセル")
 def cancel_order(
     order_id: int,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_customer)
 ):
@@ -230,11 +349,20 @@ def cancel_order(
             detail="Only pending orders can be cancelled"
         )
     
-    order.status = "cancelled"
+    # 店舗のステータス変更と同時の場合は先に変更した方だけが在庫・受取時間枠を戻す
+    order_commit.change_status(db, order, "cancelled")
+    jobs.enqueue(db, "order.status_changed", order_id=order.id, old_status="pending",
+                 new_status="cancelled", changed_by=current_user.id)
+    order_date = order_commit.release_reservation(db, order)
     db.commit()
     db.refresh(order)
+    active_orders.index.apply(order)
+    stock.invalidate(order.store_id, order_date)
+    
+    # 直後の履歴取得はプライマリから読む
+    mark_primary_sticky(response)
     
-    # メニュー情報を含める
-    order.menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+    # メニュー情報を含める（メニューのキャッシュから）
+    menu_cache.menus.attach(db, [order])
     
     return order
\ No newline at end of file
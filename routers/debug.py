@@ -0,0 +1,106 @@
+"""
+デバッグ用ルーター
+
+性能調査用のエンドポイント（管理者のみ。ADMIN_USERNAMES で指定）
+"""
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import PlainTextResponse
+
+import query_profiler
+from sampling_profiler import profiler
+from dependencies import get_current_admin_user
+from models import User
+from schemas import QueryDebugResponse, ProfilerStartRequest, ProfilerStatusResponse
+
+router = APIRouter(prefix="/debug", tags=["デバッグ"])
+
+
+@router.get("/queries", response_model=QueryDebugResponse, summary="遅いリクエストのクエリタイムライン")
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=100, description="取得件数"),
+    sort: str = Query("db_time", pattern="^(db_time|query_count|duration)$", description="並び順"),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    直近の遅いリクエストをクエリタイムライン付きで取得
+
+    - QUERY_DEBUG が無効な場合は enabled=false で空の一覧を返す
+    - DB時間・クエリ数・処理時間のいずれかで並び替え可能
+    """
+    return {
+        "enabled": query_profiler.QUERY_DEBUG,
+        "slow_query_ms": query_profiler.SLOW_QUERY_MS,
+        "requests": query_profiler.worst_requests(limit, sort),
+    }
+
+
+# ===== サンプリングプロファイラ =====
+
+@router.get("/profiler", response_model=ProfilerStatusResponse, summary="プロファイラの状態取得")
+async def get_profiler_status(current_user: User = Depends(get_current_admin_user)):
+    """
+    サンプリングプロファイラの状態を取得
+    """
+    return profiler.status()
+
+
+@router.post("/profiler/start", response_model=ProfilerStatusResponse, summary="プロファイラ開始")
+def start_profiler(
+    request: ProfilerStartRequest,
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    サンプリングプロファイラを開始
+
+    - **duration_seconds**: 採取する秒数
+    - **interval_ms**: サンプリング間隔
+    - **request_rate**: 対象リクエストの割合（未指定の場合は期間中の全スレッドを採取）
+    - **routes**: 対象パスのプレフィックス（例: /api/store/reports）
+
+    集計結果は停止後も保持され、開始のたびに追記される
+    実行中の採取を止めてスレッドの終了を待つため、同期関数としてスレッドプールで実行する
+    """
+    profiler.start(
+        duration=request.duration_seconds,
+        interval=request.interval_ms / 1000,
+        request_rate=request.request_rate,
+        route_prefixes=request.routes,
+    )
+    return profiler.status()
+
+
+@router.post("/profiler/stop", response_model=ProfilerStatusResponse, summary="プロファイラ停止")
+def stop_profiler(current_user: User = Depends(get_current_admin_user)):
+    """
+    サンプリングプロファイラを停止
+
+    採取スレッドの終了を待つため、同期関数としてスレッドプールで実行する
+    """
+    profiler.stop()
+    return profiler.status()
+
+
+@router.get("/profiler/profile", summary="プロファイル取得")
+async def get_profile(
+    format: str = Query("collapsed", pattern="^(collapsed|speedscope)$", description="出力形式"),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """
+    集計したスタックを取得
+
+    - collapsed: flamegraph.pl / inferno 用の collapsed stack 形式
+    - speedscope: https://www.speedscope.app で開けるJSON
+    """
+    if format == "speedscope":
+        return profiler.speedscope()
+    return PlainTextResponse(profiler.collapsed())
+
+
+@router.delete("/profiler/profile", response_model=ProfilerStatusResponse, summary="プロファイル破棄")
+async def reset_profile(current_user: User = Depends(get_current_admin_user)):
+    """
+    集計したスタックを破棄
+    """
+    profiler.reset()
+    return profiler.status()
@@ -5,18 +5,33 @@
 """
 
 from typing import List, Optional
-from datetime import datetime, date, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from datetime import datetime, date, time, timedelta
+from fastapi import APIRouter, Depends, HTTPException, status, Query, File, UploadFile
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func, and_
+from sqlalchemy import func, and_
 
-from database import get_db
+from database import get_db, get_read_db
 from dependencies import get_current_store_user
-from models import User, Menu, Order
+from models import User, Menu, Order, ArchivedOrder, MenuForecast
+from archive import order_source
+from cache import production_plan_cache, slot_availability_cache
+import active_orders
+import analytics
+import forecast
+import jobs
+import media
+import menu_cache
+import order_commit
+import order_queries
+import report_cache
+import slots
+import stock
 from schemas import (
     MenuCreate, MenuUpdate, MenuResponse, MenuListResponse,
-    OrderResponse, OrderListResponse, OrderStatusUpdate, OrderSummary,
-    SalesReportResponse, DailySalesReport, MenuSalesReport
+    OrderResponse, OrderListResponse, OrderStatusUpdate, OrderSummary, ProductionPlanResponse,
+    SlotAvailabilityResponse, SlotCapacityUpdate,
+    SalesReportResponse, DailySalesReport, MenuSalesReport, HeatmapResponse, DistributionResponse,
+    ForecastResponse
 )
 
 router = APIRouter(prefix="/store", tags=["店舗"])
@@ -30,46 +45,35 @@ def get_dashboard(
     current_user: User = Depends(get_current_store_user)
 ):
     """
-    本日の注文状況サマリーを取得
+    自店舗の本日の注文状況サマリーを取得
     """
     today = date.today()
     today_start = datetime.combine(today, datetime.min.time())
     today_end = datetime.combine(today, datetime.max.time())
     
-    # 本日の注文を取得
-    today_orders = db.query(Order).filter(
+    # 本日の注文のステータス別件数・売上（店舗×注文日時のインデックスで1回の集計）
+    rows = db.query(
+        Order.status, func.count(Order.id), func.sum(Order.total_price)
+    ).filter(
         and_(
+            Order.store_id == current_user.store_id,
             Order.ordered_at >= today_start,
             Order.ordered_at <= today_end
         )
-    )
-    
-    # ステータス別の集計
-    total_orders = today_orders.count()
-    pending_orders = today_orders.filter(Order.status == "pending").count()
-    confirmed_orders = today_orders.filter(Order.status == "confirmed").count()
-    preparing_orders = today_orders.filter(Order.status == "preparing").count()
-    ready_orders = today_orders.filter(Order.status == "ready").count()
-    completed_orders = today_orders.filter(Order.status == "completed").count()
-    cancelled_orders = today_orders.filter(Order.status == "cancelled").count()
+    ).group_by(Order.status).all()
+    counts = {order_status: count for order_status, count, _ in rows}
     
     # 売上計算（キャンセル除く）
-    total_sales = db.query(func.sum(Order.total_price)).filter(
-        and_(
-            Order.ordered_at >= today_start,
-            Order.ordered_at <= today_end,
-            Order.status != "cancelled"
-        )
-    ).scalar() or 0
+    total_sales = sum(sales or 0 for order_status, _, sales in rows if order_status != "cancelled")
     
     return {
-        "total_orders": total_orders,
-        "pending_orders": pending_orders,
-        "confirmed_orders": confirmed_orders,
-        "preparing_orders": preparing_orders,
-        "ready_orders": ready_orders,
-        "completed_orders": completed_orders,
-        "cancelled_orders": cancelled_orders,
+        "total_orders": sum(counts.values()),
+        "pending_orders": counts.get("pending", 0),
+        "confirmed_orders": counts.get("confirmed", 0),
+        "preparing_orders": counts.get("preparing", 0),
+        "ready_orders": counts.get("ready", 0),
+        "completed_orders": counts.get("completed", 0),
+        "cancelled_orders": counts.get("cancelled", 0),
         "total_sales": total_sales
     }
 
@@ -81,29 +85,27 @@ def get_all_orders(
     status_filter: Optional[str] = Query(None, description="ステータスでフィルタ"),
     start_date: Optional[str] = Query(None, description="開始日 (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="終了日 (YYYY-MM-DD)"),
+    slot: Optional[time] = Query(None, description="受取時間枠の開始時刻 (HH:MM) でフィルタ"),
+    active: bool = Query(False, description="進行中（受付・確認済み・調理中・受取準備完了）の注文のみ"),
     page: int = Query(1, ge=1, description="ページ番号"),
     per_page: int = Query(20, ge=1, le=100, description="1ページあたりの件数"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_store_user)
 ):
     """
-    全ての注文一覧を取得
+    自店舗の注文一覧を取得
     
     - 最新の注文から順に表示
-    - ステータスや日付でフィルタリング可能
+    - ステータスや日付、受取時間枠でフィルタリング可能
     - ユーザー情報とメニュー情報を含む
+    - active=true の場合は進行中の注文の索引から返す（DBの注文は読まない）
     """
-    query = db.query(Order)
-    
-    # ステータスフィルタ
-    if status_filter:
-        query = query.filter(Order.status == status_filter)
-    
     # 日付フィルタ
+    start_dt = None
+    end_dt = None
     if start_date:
         try:
             start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-            query = query.filter(Order.ordered_at >= start_dt)
         except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -114,31 +116,67 @@ def get_all_orders(
         try:
             end_dt = datetime.strptime(end_date, "%Y-%m-%d")
             end_dt = end_dt.replace(hour=23, minute=59, second=59)
-            query = query.filter(Order.ordered_at <= end_dt)
         except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid end_date format. Use YYYY-MM-DD"
             )
     
-    # 最新順でソート
-    query = query.order_by(desc(Order.ordered_at))
-    
-    # 総件数を取得
-    total = query.count()
-    
-    # ページネーション
-    offset = (page - 1) * per_page
-    orders = query.offset(offset).limit(per_page).all()
-    
-    # ユーザー情報とメニュー情報を含める
+    slot_end = None
+    if slot is not None:
+        slot_end = (datetime.combine(date.min, slot) + timedelta(minutes=slots.SLOT_MINUTES)).time()
+        if slot_end <= slot:
+            slot_end = time.max
+    
+    if active:
+        return _active_orders(db, current_user.store_id, status_filter, slot, slot_end,
+                              start_dt, end_dt, page, per_page)
+    
+    # 期間・ステータスがアーカイブに及ぶ場合のみアーカイブも含めて検索（最新順）
+    source = order_source(start_dt, status_filter)
+    orders, total = order_queries.fetch_page(db, source, {
+        "store_id": current_user.store_id,
+        "status": status_filter or None,
+        "start": start_dt,
+        "end": end_dt,
+        "slot_start": slot,
+        "slot_end": slot_end,
+    }, page, per_page)
+    
+    # ユーザー情報（1回のクエリ）とメニュー情報（メニューのキャッシュから）を含める
+    users = {
+        user.id: user for user in db.query(User).filter(User.id.in_({order.user_id for order in orders}))
+    }
     for order in orders:
-        order.user = db.query(User).filter(User.id == order.user_id).first()
-        order.menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+        order.user = users.get(order.user_id)
+    menu_cache.menus.attach(db, orders)
     
     return {"orders": orders, "total": total}
 
 
+def _active_orders(db: Session, store_id: int, status_filter: Optional[str], slot_start: Optional[time],
+                   slot_end: Optional[time], start_dt: Optional[datetime], end_dt: Optional[datetime],
+                   page: int, per_page: int) -> dict:
+    """進行中の注文の索引から注文一覧を作る（お客様・メニューは索引とキャッシュから）"""
+    if status_filter is not None and status_filter not in active_orders.ACTIVE_STATUSES:
+        return {"orders": [], "total": 0}
+    
+    active_orders.index.ensure()
+    orders = active_orders.index.select(store_id, status_filter, slot_start, slot_end, start_dt, end_dt)
+    offset = (page - 1) * per_page
+    page_orders = orders[offset:offset + per_page]
+    
+    users = active_orders.index.users(db, {order.user_id for order in page_orders})
+    menus = menu_cache.menus.get_many(db, {order.menu_id for order in page_orders})
+    return {
+        "orders": [
+            {**order._asdict(), "user": users.get(order.user_id), "menu": menus.get(order.menu_id)}
+            for order in page_orders
+        ],
+        "total": len(orders)
+    }
+
+
 @router.put("/orders/{order_id}/status", response_model=OrderResponse, summary="注文ステータス更新")
 def update_order_status(
     order_id: int,
@@ -157,7 +195,10 @@ def update_order_status(
     - completed: 受取完了
     - cancelled: キャンセル
     """
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = db.query(Order).filter(
+        Order.id == order_id,
+        Order.store_id == current_user.store_id
+    ).first()
     
     if not order:
         raise HTTPException(
@@ -165,17 +206,172 @@ def update_order_status(
             detail="Order not found"
         )
     
-    order.status = status_update.status
+    # ステータスは読み込んだ時点のステータスからだけ変更する（同時の変更は409）。
+    # 変更できた場合だけ、キャンセル・キャンセル取り消しに合わせて在庫と受取時間枠の予約数を増減
+    order_date = order_commit.reserved_date(order)
+    stock_changed = False
+    if order.status != status_update.status:
+        old_status = order_commit.change_status(db, order, status_update.status)
+        if status_update.status == "cancelled":
+            order_commit.release_reservation(db, order)
+            stock_changed = True
+        elif old_status == "cancelled":
+            order_commit.restore_reservation(db, order)
+            stock_changed = True
+        jobs.enqueue(db, "order.status_changed", order_id=order.id, old_status=old_status,
+                     new_status=status_update.status, changed_by=current_user.id)
+    
     db.commit()
     db.refresh(order)
+    active_orders.index.apply(order)
+    if stock_changed:
+        stock.invalidate(order.store_id, order_date)
     
-    # ユーザー情報とメニュー情報を含める
+    # ユーザー情報とメニュー情報（メニューのキャッシュから）を含める
     order.user = db.query(User).filter(User.id == order.user_id).first()
-    order.menu = db.query(Menu).filter(Menu.id == order.menu_id).first()
+    menu_cache.menus.attach(db, [order])
     
     return order
 
 
+# ===== 製造計画 =====
+
+# 製造計画に含めるステータス（これから作る注文）
+PRODUCTION_STATUSES = ("pending", "confirmed", "preparing")
+
+
+def _build_production_plan(db: Session, store_id: int, target_date: date, slot_minutes: int) -> dict:
+    """
+    店舗の受取時間枠・メニュー・ステータス別の数量を1回の集計クエリで求める
+    """
+    day_start = datetime.combine(target_date, datetime.min.time())
+    day_end = datetime.combine(target_date, datetime.max.time())
+    
+    rows = db.query(
+        Order.delivery_time,
+        Order.menu_id,
+        Menu.name,
+        Order.status,
+        func.sum(Order.quantity).label("quantity")
+    ).join(Menu, Menu.id == Order.menu_id).filter(
+        and_(
+            Order.store_id == store_id,
+            Order.ordered_at >= day_start,
+            Order.ordered_at <= day_end,
+            Order.status.in_(PRODUCTION_STATUSES)
+        )
+    ).group_by(Order.delivery_time, Order.menu_id, Menu.name, Order.status).all()
+    
+    # 受取時間を枠の開始分に丸めて集計（受取時間未指定はNone）
+    slots = {}
+    for row in rows:
+        slot_key = None
+        if row.delivery_time is not None:
+            minute = row.delivery_time.hour * 60 + row.delivery_time.minute
+            slot_key = minute // slot_minutes * slot_minutes
+        items = slots.setdefault(slot_key, {})
+        item = items.get(row.menu_id)
+        if item is None:
+            item = items[row.menu_id] = {
+                "menu_id": row.menu_id,
+                "menu_name": row.name,
+                "pending": 0,
+                "confirmed": 0,
+                "preparing": 0,
+                "total": 0
+            }
+        item[row.status] += row.quantity
+        item["total"] += row.quantity
+    
+    slot_list = []
+    for slot_key in sorted(slots, key=lambda key: (key is None, key or 0)):
+        items = sorted(slots[slot_key].values(), key=lambda item: (-item["total"], item["menu_id"]))
+        slot_start = slot_end = None
+        if slot_key is not None:
+            end_minute = min(slot_key + slot_minutes, 24 * 60 - 1)
+            slot_start = time(slot_key // 60, slot_key % 60)
+            slot_end = time(end_minute // 60, end_minute % 60)
+        slot_list.append({
+            "slot_start": slot_start,
+            "slot_end": slot_end,
+            "items": items,
+            "total": sum(item["total"] for item in items)
+        })
+    
+    return {
+        "date": target_date.strftime("%Y-%m-%d"),
+        "slot_minutes": slot_minutes,
+        "slots": slot_list,
+        "total": sum(slot["total"] for slot in slot_list),
+        "generated_at": datetime.now()
+    }
+
+
+@router.get("/production-plan", response_model=ProductionPlanResponse, summary="製造計画取得")
+def get_production_plan(
+    slot_minutes: int = Query(15, ge=5, le=60, description="受取時間枠の分数"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗の本日の受取時間枠ごと・メニューごとの製造数量を取得
+    
+    - 受付・確認済み・調理中の注文が対象
+    - 1回の集計クエリで計算し、結果を店舗ごとに数秒間キャッシュして全画面で共有
+    """
+    today = date.today()
+    store_id = current_user.store_id
+    return production_plan_cache.get_or_set(
+        (store_id, today, slot_minutes),
+        lambda: _build_production_plan(db, store_id, today, slot_minutes)
+    )
+
+
+# ===== 受取時間枠 =====
+
+@router.get("/slots", response_model=SlotAvailabilityResponse, summary="受取時間枠の容量一覧")
+def get_slots(
+    target_date: Optional[date] = Query(None, alias="date", description="対象日（省略時は本日）"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗の受取時間枠ごとの容量・予約数・残数を取得（キャッシュを使わず最新の値）
+    """
+    return slots.availability(db, current_user.store_id, target_date or date.today())
+
+
+@router.put("/slots", response_model=SlotAvailabilityResponse, summary="受取時間枠の容量設定")
+def update_slot_capacity(
+    capacity_update: SlotCapacityUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗の指定日の受取時間枠の容量を設定
+    
+    - **slot_date**: 対象日
+    - **capacity**: 1枠あたりの受取可能数（弁当の個数）
+    - **slot_start** / **slot_end**: 対象の時間帯（省略時は受付時間全体）
+    
+    既に予約済みの数より小さくした場合、その枠は新規の予約を受け付けなくなる
+    """
+    start = capacity_update.slot_start or slots.SLOT_OPEN
+    end = capacity_update.slot_end or slots.SLOT_CLOSE
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="slot_start must be before slot_end"
+        )
+    
+    store_id = current_user.store_id
+    slots.set_capacity(db, store_id, capacity_update.slot_date, capacity_update.capacity, start, end)
+    db.commit()
+    slot_availability_cache.invalidate((store_id, capacity_update.slot_date))
+    
+    return slots.availability(db, store_id, capacity_update.slot_date)
+
+
 # ===== メニュー管理 =====
 
 @router.get("/menus", response_model=MenuListResponse, summary="メニュー管理一覧")
@@ -187,9 +383,9 @@ def get_all_menus(
     current_user: User = Depends(get_current_store_user)
 ):
     """
-    全てのメニュー一覧を取得（管理用）
+    自店舗の全てのメニュー一覧を取得（管理用）
     """
-    query = db.query(Menu)
+    query = db.query(Menu).filter(Menu.store_id == current_user.store_id)
     
     # 利用可能フラグでフィルタ
     if is_available is not None:
@@ -202,6 +398,9 @@ def get_all_menus(
     offset = (page - 1) * per_page
     menus = query.offset(offset).limit(per_page).all()
     
+    # 本日の残数・売り切れ状態を反映
+    stock.annotate(db, menus)
+    
     return {"menus": menus, "total": total}
 
 
@@ -212,14 +411,18 @@ def create_menu(
     current_user: User = Depends(get_current_store_user)
 ):
     """
-    新しいメニューを作成
+    自店舗の新しいメニューを作成
     """
-    db_menu = Menu(**menu.dict())
+    db_menu = Menu(**menu.dict(), store_id=current_user.store_id)
     
     db.add(db_menu)
     db.commit()
     db.refresh(db_menu)
     
+    if db_menu.daily_stock is not None:
+        stock.invalidate(db_menu.store_id)
+    stock.annotate(db, [db_menu])
+    
     return db_menu
 
 
@@ -233,7 +436,10 @@ def update_menu(
     """
     既存メニューを更新
     """
-    menu = db.query(Menu).filter(Menu.id == menu_id).first()
+    menu = db.query(Menu).filter(
+        Menu.id == menu_id,
+        Menu.store_id == current_user.store_id
+    ).first()
     
     if not menu:
         raise HTTPException(
@@ -246,8 +452,74 @@ def update_menu(
     for field, value in update_data.items():
         setattr(menu, field, value)
     
+    # 画像URLを直接指定した場合はアップロード画像のサムネイルを使わない
+    if "image_url" in update_data:
+        menu.image_key = None
+        menu.image_widths = None
+    
+    # 販売数の変更は本日の在庫にも反映
+    if "daily_stock" in update_data:
+        stock.set_stock(db, menu, date.today())
+    
     db.commit()
     db.refresh(menu)
+    menu_cache.menus.invalidate(menu.id)
+    
+    if "daily_stock" in update_data:
+        stock.invalidate(menu.store_id)
+    stock.annotate(db, [menu])
+    
+    return menu
+
+
+@router.post("/menus/{menu_id}/image", response_model=MenuResponse, summary="メニュー画像アップロード")
+def upload_menu_image(
+    menu_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    メニュー画像をアップロード
+    
+    - JPEG / PNG / WebP / GIF（最大 MEDIA_MAX_UPLOAD_MB MB）
+    - 幅別の WebP サムネイルを生成し、image_url と image_srcset に反映
+    """
+    menu = db.query(Menu).filter(
+        Menu.id == menu_id,
+        Menu.store_id == current_user.store_id
+    ).first()
+    
+    if not menu:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Menu not found"
+        )
+    
+    max_bytes = int(media.MEDIA_MAX_UPLOAD_MB * 1024 * 1024)
+    data = file.file.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Image is too large"
+        )
+    
+    try:
+        key, widths = media.store_image(data)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc)
+        )
+    
+    menu.image_key = key
+    menu.image_widths = ",".join(str(w) for w in widths)
+    menu.image_url = media.variant_url(key, widths[-1])
+    
+    db.commit()
+    db.refresh(menu)
+    menu_cache.menus.invalidate(menu.id)
+    stock.annotate(db, [menu])
     
     return menu
 
@@ -263,7 +535,10 @@ def delete_menu(
     
     注意: 既存の注文がある場合は論理削除（is_available = False）を推奨
     """
-    menu = db.query(Menu).filter(Menu.id == menu_id).first()
+    menu = db.query(Menu).filter(
+        Menu.id == menu_id,
+        Menu.store_id == current_user.store_id
+    ).first()
     
     if not menu:
         raise HTTPException(
@@ -271,17 +546,22 @@ def delete_menu(
             detail="Menu not found"
         )
     
-    # 既存の注文があるかチェック
-    existing_orders = db.query(Order).filter(Order.menu_id == menu_id).first()
+    # 既存の注文があるかチェック（アーカイブ済みの注文を含む）
+    existing_orders = (
+        db.query(Order.id).filter(Order.menu_id == menu_id).first()
+        or db.query(ArchivedOrder.id).filter(ArchivedOrder.menu_id == menu_id).first()
+    )
     if existing_orders:
         # 論理削除
         menu.is_available = False
         db.commit()
+        menu_cache.menus.invalidate(menu_id)
         return {"message": "Menu disabled due to existing orders"}
     else:
         # 物理削除
         db.delete(menu)
         db.commit()
+        menu_cache.menus.invalidate(menu_id)
         return {"message": "Menu deleted successfully"}
 
 
@@ -292,15 +572,16 @@ def get_sales_report(
     period: str = Query("daily", description="レポート期間 (daily, weekly, monthly)"),
     start_date: Optional[str] = Query(None, description="開始日 (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="終了日 (YYYY-MM-DD)"),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_store_user)
 ):
     """
-    売上レポートを取得
+    自店舗の売上レポートを取得
     
     - 日別、週別、月別の売上集計
     - メニュー別売上ランキング
     - 指定期間での集計
+    - 前日以前の日別集計はキャッシュを使い、当日分のみ毎回集計
     """
     # デフォルトの期間設定
     if not start_date:
@@ -324,94 +605,51 @@ def get_sales_report(
             detail="Invalid date format. Use YYYY-MM-DD"
         )
     
-    # 指定期間の注文を取得（キャンセル除く）
-    orders_query = db.query(Order).filter(
-        and_(
-            Order.ordered_at >= start_dt,
-            Order.ordered_at <= end_dt,
-            Order.status != "cancelled"
-        )
-    )
+    # 日別・メニュー別の売上（前日以前はキャッシュ、当日のみ集計）
+    days = report_cache.daily_sales(db, current_user.store_id, start_dt.date(), end_dt.date())
+    menu_names = dict(db.query(Menu.id, Menu.name).filter(Menu.store_id == current_user.store_id).all())
     
     # 日別売上集計
     daily_reports = []
-    current_date = start_dt.date()
-    end_date_obj = end_dt.date()
-    
-    while current_date <= end_date_obj:
-        day_start = datetime.combine(current_date, datetime.min.time())
-        day_end = datetime.combine(current_date, datetime.max.time())
-        
-        day_orders = orders_query.filter(
-            and_(
-                Order.ordered_at >= day_start,
-                Order.ordered_at <= day_end
-            )
-        )
-        
-        day_count = day_orders.count()
-        day_sales = db.query(func.sum(Order.total_price)).filter(
-            and_(
-                Order.ordered_at >= day_start,
-                Order.ordered_at <= day_end,
-                Order.status != "cancelled"
-            )
-        ).scalar() or 0
-        
-        # 人気メニューを取得
-        popular_menu = db.query(
-            Menu.name,
-            func.sum(Order.quantity).label("total_quantity")
-        ).join(Order).filter(
-            and_(
-                Order.ordered_at >= day_start,
-                Order.ordered_at <= day_end,
-                Order.status != "cancelled"
-            )
-        ).group_by(Menu.name).order_by(desc("total_quantity")).first()
+    menu_totals = {}
+    for current_date, day in sorted(days.items()):
+        # 人気メニュー（同名のメニューは合算）
+        quantity_by_name = {}
+        for menu_id, orders, quantity, sales in day["menus"]:
+            if menu_id not in menu_names:
+                continue
+            name = menu_names[menu_id]
+            quantity_by_name[name] = quantity_by_name.get(name, 0) + quantity
+            totals = menu_totals.setdefault(menu_id, [0, 0])
+            totals[0] += quantity
+            totals[1] += sales
+        popular_menu = max(quantity_by_name, key=quantity_by_name.get) if quantity_by_name else None
         
         daily_reports.append({
             "date": current_date.strftime("%Y-%m-%d"),
-            "total_orders": day_count,
-            "total_sales": day_sales,
-            "popular_menu": popular_menu[0] if popular_menu else None
+            "total_orders": day["total_orders"],
+            "total_sales": day["total_sales"],
+            "popular_menu": popular_menu
         })
-        
-        current_date += timedelta(days=1)
     
     # メニュー別売上集計
-    menu_reports = db.query(
-        Menu.id,
-        Menu.name,
-        func.sum(Order.quantity).label("total_quantity"),
-        func.sum(Order.total_price).label("total_sales")
-    ).join(Order).filter(
-        and_(
-            Order.ordered_at >= start_dt,
-            Order.ordered_at <= end_dt,
-            Order.status != "cancelled"
-        )
-    ).group_by(Menu.id, Menu.name).order_by(desc("total_sales")).all()
-    
-    menu_report_list = [
-        {
-            "menu_id": report.id,
-            "menu_name": report.name,
-            "total_quantity": report.total_quantity,
-            "total_sales": report.total_sales
-        }
-        for report in menu_reports
-    ]
+    menu_report_list = sorted(
+        (
+            {
+                "menu_id": menu_id,
+                "menu_name": menu_names[menu_id],
+                "total_quantity": quantity,
+                "total_sales": sales
+            }
+            for menu_id, (quantity, sales) in menu_totals.items()
+        ),
+        key=lambda report: report["total_sales"],
+        reverse=True
+    )
     
     # 合計集計
-    total_orders = orders_query.count()
-    total_sales = db.query(func.sum(Order.total_price)).filter(
-        and_(
-            Order.ordered_at >= start_dt,
-            Order.ordered_at <= end_dt,
-            Order.status != "cancelled"
-        )
-    ).scalar() or 0
+    total_orders = sum(day["total_orders"] for day in days.values())
+    total_sales = sum(day["total_sales"] for day in days.values())
     
     return {
         "period": period,
@@ -421,4 +659,101 @@ def get_sales_report(
         "menu_reports": menu_report_list,
         "total_sales": total_sales,
         "total_orders": total_orders
-    }
\ No newline at end of file
+    }
+
+
+def _analytics_range(start_date: Optional[date], end_date: Optional[date]):
+    # 既定は直近28日（曜日ごとに4週分）
+    end = end_date or date.today()
+    start = start_date or end - timedelta(days=27)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_date must be on or before end_date"
+        )
+    return start, end
+
+
+@router.get("/reports/heatmap", response_model=HeatmapResponse, summary="曜日×時間帯ヒートマップ")
+def get_heatmap_report(
+    start_date: Optional[date] = Query(None, description="開始日（既定: 終了日の27日前）"),
+    end_date: Optional[date] = Query(None, description="終了日（既定: 本日）"),
+    metric: str = Query("orders", pattern="^(orders|quantity|sales)$", description="集計値 (orders, quantity, sales)"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗の注文時刻の曜日×時間帯ごとの注文数・個数・売上を取得（キャンセル除く）
+    
+    メモリ上の注文スナップショットから集計する
+    """
+    start, end = _analytics_range(start_date, end_date)
+    analytics.snapshot.refresh(db)
+    values = analytics.heatmap(analytics.snapshot.select(start, end, current_user.store_id), metric)
+    return {
+        "start_date": start,
+        "end_date": end,
+        "metric": metric,
+        "weekdays": analytics.WEEKDAYS,
+        "hours": list(range(24)),
+        "values": values.tolist(),
+        "total": int(values.sum())
+    }
+
+
+@router.get("/reports/distribution", response_model=DistributionResponse, summary="客単価・受取時間の分布")
+def get_distribution_report(
+    start_date: Optional[date] = Query(None, description="開始日（既定: 終了日の27日前）"),
+    end_date: Optional[date] = Query(None, description="終了日（既定: 本日）"),
+    bucket_minutes: int = Query(15, ge=5, le=60, description="受取時間の集計単位（分）"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗の客単価（注文・お客様×日のバスケット単位）と受取時間の分布を取得（キャンセル除く）
+    
+    メモリ上の注文スナップショットから集計する
+    """
+    start, end = _analytics_range(start_date, end_date)
+    analytics.snapshot.refresh(db)
+    result = analytics.distribution(analytics.snapshot.select(start, end, current_user.store_id), bucket_minutes)
+    return {"start_date": start, "end_date": end, **result}
+
+
+# ===== 需要予測 =====
+
+@router.get("/forecast", response_model=ForecastResponse, summary="メニューの需要予測")
+def get_forecast(
+    days: int = Query(7, ge=1, le=forecast.FORECAST_HORIZON_DAYS, description="本日から何日分を取得するか"),
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_store_user)
+):
+    """
+    自店舗のメニューごとの日別予測個数を取得（仕込み計画用）
+    
+    夜間の予測ジョブが保存した予測を読むだけで、予測の計算は行わない
+    """
+    start = date.today()
+    end = start + timedelta(days=days - 1)
+    rows = db.query(MenuForecast, Menu.name).join(Menu, Menu.id == MenuForecast.menu_id).filter(
+        Menu.store_id == current_user.store_id,
+        MenuForecast.forecast_date >= start,
+        MenuForecast.forecast_date <= end
+    ).order_by(MenuForecast.menu_id, MenuForecast.forecast_date).all()
+
+    menus = {}
+    for row, menu_name in rows:
+        entry = menus.setdefault(row.menu_id, {
+            "menu_id": row.menu_id, "menu_name": menu_name, "days": [], "total_quantity": 0.0
+        })
+        entry["days"].append({"date": row.forecast_date, "quantity": row.quantity, "upper": row.upper})
+        entry["total_quantity"] += row.quantity
+
+    for entry in menus.values():
+        entry["total_quantity"] = round(entry["total_quantity"], 1)
+    return {
+        "start_date": start,
+        "end_date": end,
+        "generated_at": max((row.generated_at for row, _ in rows), default=None),
+        "menus": sorted(menus.values(), key=lambda entry: entry["total_quantity"], reverse=True)
+    }
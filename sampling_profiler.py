@@ -0,0 +1,277 @@
+"""
+サンプリングプロファイラ
+
+実行中のスレッドのスタックを一定間隔で採取して集計し、
+collapsed stack 形式（flamegraph.pl 等）または speedscope 形式で出力する
+
+動作モード:
+- window: 指定秒数の間、処理中の全スレッドを採取
+- requests: 指定秒数の間、対象ルートのリクエストを指定割合で選び、
+  選ばれたリクエストの処理中だけ採取
+
+requestsモードでは、ミドルウェアが選ばれたリクエストのコンテキストに印を付け、
+採取時にそのリクエストを処理しているスレッドのスタックだけを集計する
+（同時に処理中の他のリクエストのスタックは含めない）
+
+- イベントループのスレッドは、選ばれたリクエストのミドルウェアのフレームがスタックにある間
+- スレッドプールのスレッドは、実行中の関数のコンテキスト（リクエストのコンテキストのコピー）に印がある間
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import Context, ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# 待機中とみなすスタック末端（ファイル名, 関数名）
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+# 保持するスタックの最大深さ
+MAX_STACK_DEPTH = 128
+
+# 採取対象のリクエストの処理中か（スレッドプールで実行する関数にもコンテキストごと引き継がれる）
+_sampled_request: ContextVar[bool] = ContextVar("sampled_request", default=False)
+
+
+async def _run_sampled(app, scope, receive, send):
+    # このフレームがスタックにあるイベントループのスレッドは採取対象のリクエストを処理中
+    await app(scope, receive, send)
+
+
+def _is_sampled_frame(frame) -> bool:
+    """採取対象のリクエストを処理中であることを示すフレームか"""
+    code = frame.f_code
+    if code is _run_sampled.__code__:
+        return True
+    # スレッドプールのワーカーは context.run(func) で関数を実行する
+    if "context" in code.co_varnames:
+        context = frame.f_locals.get("context")
+        return isinstance(context, Context) and context.get(_sampled_request, False)
+    return False
+
+
+class SamplingProfiler:
+    """スタックサンプリングによるプロファイラ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._labels: Dict[object, str] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.mode: Optional[str] = None
+        self.interval = 0.005
+        self.request_rate = 0.0
+        self.route_prefixes: Tuple[str, ...] = ()
+        self.started_at: Optional[float] = None
+        self.deadline: Optional[float] = None
+        self.sampled_requests = 0
+        # 採取対象として処理中のリクエスト数（イベントループのスレッドのみが更新）
+        self.sampled_in_flight = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, interval: float = 0.005,
+              request_rate: Optional[float] = None, route_prefixes: List[str] = ()):
+        """
+        プロファイリングを開始
+
+        Args:
+            duration: 採取する秒数
+            interval: サンプリング間隔（秒）
+            request_rate: 対象リクエストの割合（Noneの場合はwindowモード）
+            route_prefixes: 対象とするパスのプレフィックス（空の場合は全ルート）
+        """
+        self.stop()
+        self.mode = "window" if request_rate is None else "requests"
+        self.interval = interval
+        self.request_rate = request_rate or 0.0
+        self.route_prefixes = tuple(route_prefixes)
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + duration
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """プロファイリングを停止（集計結果は保持）"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        """集計結果を破棄"""
+        with self._lock:
+            self.stacks = Counter()
+            self.samples = 0
+            self.sampled_requests = 0
+
+    def should_sample(self, path: str) -> bool:
+        """
+        リクエストを採取対象にするか判定
+
+        Args:
+            path: リクエストパス
+
+        Returns:
+            bool: 採取対象の場合True
+        """
+        if self.mode != "requests" or not self.running:
+            return False
+        if self.route_prefixes and not path.startswith(self.route_prefixes):
+            return False
+        return random.random() < self.request_rate
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                break
+            if self.mode == "requests" and self.sampled_in_flight == 0:
+                continue
+            self._take_sample(own_ident, requests_only=self.mode == "requests")
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = os.path.basename(code.co_filename)
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _take_sample(self, own_ident: int, requests_only: bool = False):
+        collected = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                continue
+            stack = []
+            sampled = not requests_only
+            while frame is not None:
+                if len(stack) < MAX_STACK_DEPTH:
+                    stack.append(self._label(frame.f_code))
+                elif sampled:
+                    break
+                if not sampled:
+                    sampled = _is_sampled_frame(frame)
+                frame = frame.f_back
+            if not sampled:
+                continue
+            stack.reverse()
+            collected.append(tuple(stack))
+
+        with self._lock:
+            for stack in collected:
+                self.stacks[stack] += 1
+            self.samples += 1
+
+    def status(self) -> dict:
+        """現在の状態を取得"""
+        remaining = None
+        if self.running:
+            remaining = max(0.0, self.deadline - time.monotonic())
+        return {
+            "running": self.running,
+            "mode": self.mode,
+            "interval_ms": self.interval * 1000,
+            "request_rate": self.request_rate,
+            "route_prefixes": list(self.route_prefixes),
+            "started_at": self.started_at,
+            "remaining_seconds": remaining,
+            "samples": self.samples,
+            "sampled_requests": self.sampled_requests,
+            "unique_stacks": len(self.stacks),
+        }
+
+    def _snapshot(self) -> List[Tuple[Tuple[str, ...], int]]:
+        with self._lock:
+            return self.stacks.most_common()
+
+    def collapsed(self) -> str:
+        """
+        collapsed stack 形式で出力
+
+        Returns:
+            str: "frame1;frame2;... count" の行
+        """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self._snapshot())
+
+    def speedscope(self) -> dict:
+        """
+        speedscope 形式で出力
+
+        Returns:
+            dict: speedscope のファイル形式
+        """
+        frame_index: Dict[str, int] = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self._snapshot():
+            indexes = []
+            for label in stack:
+                index = frame_index.get(label)
+                if index is None:
+                    index = frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(index)
+            samples.append(indexes)
+            weights.append(count * self.interval)
+
+        total = sum(weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "bento-order-system",
+            "name": "Bento Order System",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.mode or 'window'} profile",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+# プロセス全体で共有するプロファイラ
+profiler = SamplingProfiler()
+
+
+class SamplingProfilerMiddleware:
+    """requestsモードで採取対象のリクエストを選ぶASGIミドルウェア"""
+
+    def __init__(self, app, profiler: SamplingProfiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_sample(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        self.profiler.sampled_requests += 1
+        self.profiler.sampled_in_flight += 1
+        token = _sampled_request.set(True)
+        try:
+            await _run_sampled(self.app, scope, receive, send)
+        finally:
+            _sampled_request.reset(token)
+            self.profiler.sampled_in_flight -= 1
@@ -11,7 +11,7 @@ API契約定義 - Single Source of Truth
 4. 変更後は必ずTypeScript型定義を再生成する
 """
 
-from datetime import datetime, time
+from datetime import date, datetime, time
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr, Field
 
@@ -40,6 +40,7 @@ class UserCreate(BaseModel):
     password: str = Field(..., min_length=6)
     full_name: str = Field(..., min_length=1, max_length=100)
     role: str = Field(..., pattern="^(customer|store)$")
+    store_id: Optional[int] = None  # 所属店舗（店舗スタッフの場合は必須）
 
 
 class UserLogin(BaseModel):
@@ -55,6 +56,7 @@ class UserResponse(BaseModel):
     email: str
     full_name: str
     role: str
+    store_id: Optional[int] = None
     is_active: bool
     created_at: datetime
 
@@ -69,6 +71,22 @@ class TokenResponse(BaseModel):
     user: UserResponse
 
 
+# ===== 店舗関連 =====
+
+class StoreResponse(BaseModel):
+    """店舗情報のレスポンス"""
+    id: int
+    name: str
+
+    class Config:
+        from_attributes = True
+
+
+class StoreListResponse(BaseModel):
+    """店舗一覧のレスポンス"""
+    stores: List[StoreResponse]
+
+
 # ===== メニュー関連 =====
 
 class MenuBase(BaseModel):
@@ -78,6 +96,7 @@ class MenuBase(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
     is_available: bool = True
+    daily_stock: Optional[int] = Field(None, ge=0)  # 1日の販売数（Noneは無制限）
 
 
 class MenuCreate(MenuBase):
@@ -92,13 +111,18 @@ class MenuUpdate(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
     is_available: Optional[bool] = None
+    daily_stock: Optional[int] = Field(None, ge=0)  # nullを指定すると無制限
 
 
 class MenuResponse(MenuBase):
     """メニュー情報のレスポンス"""
     id: int
+    store_id: int
     created_at: datetime
     updated_at: datetime
+    stock_remaining: Optional[int] = None  # 本日の残数（在庫管理しないメニューはNone）
+    is_sold_out: bool = False
+    image_srcset: Optional[str] = None  # アップロード画像の幅別サムネイル（img の srcset 属性値）
 
     class Config:
         from_attributes = True
@@ -110,6 +134,13 @@ class MenuListResponse(BaseModel):
     total: int
 
 
+class RecommendedMenusResponse(BaseModel):
+    """おすすめメニューのレスポンス"""
+    favorites: List[MenuResponse]  # よく注文するメニュー
+    together: List[MenuResponse]  # よく注文するメニューと一緒に注文されることが多いメニュー
+    popular: List[MenuResponse]  # 最近人気のメニュー
+
+
 # ===== 注文関連 =====
 
 class OrderBase(BaseModel):
@@ -133,6 +164,7 @@ class OrderStatusUpdate(BaseModel):
 class OrderResponse(BaseModel):
     """注文情報のレスポンス"""
     id: int
+    store_id: int
     user_id: int
     menu_id: int
     quantity: int
@@ -171,6 +203,59 @@ class OrderSummary(BaseModel):
     total_sales: int
 
 
+class ProductionPlanItem(BaseModel):
+    """製造計画のメニュー別数量"""
+    menu_id: int
+    menu_name: str
+    pending: int
+    confirmed: int
+    preparing: int
+    total: int
+
+
+class ProductionPlanSlot(BaseModel):
+    """製造計画の受取時間枠"""
+    slot_start: Optional[time] = None  # 受取時間未指定の注文はNone
+    slot_end: Optional[time] = None
+    items: List[ProductionPlanItem]
+    total: int
+
+
+class ProductionPlanResponse(BaseModel):
+    """製造計画（厨房向け）のレスポンス"""
+    date: str  # YYYY-MM-DD format
+    slot_minutes: int
+    slots: List[ProductionPlanSlot]
+    total: int
+    generated_at: datetime
+
+
+
+class PickupSlotAvailability(BaseModel):
+    """受取時間枠の空き状況"""
+    slot_start: time
+    slot_end: time
+    capacity: int
+    reserved: int
+    remaining: int
+    available: bool
+
+
+class SlotAvailabilityResponse(BaseModel):
+    """受取時間枠一覧のレスポンス"""
+    date: str  # YYYY-MM-DD format
+    slot_minutes: int
+    slots: List[PickupSlotAvailability]
+
+
+class SlotCapacityUpdate(BaseModel):
+    """受取時間枠の容量設定時のリクエスト"""
+    slot_date: date
+    capacity: int = Field(..., ge=0, le=10000)
+    slot_start: Optional[time] = None  # 省略時は受付開始時刻から
+    slot_end: Optional[time] = None  # 省略時は受付終了時刻まで
+
+
 # ===== レポート関連 =====
 
 class DailySalesReport(BaseModel):
@@ -200,6 +285,114 @@ class SalesReportResponse(BaseModel):
     total_orders: int
 
 
+class HeatmapResponse(BaseModel):
+    """曜日×時間帯ヒートマップのレスポンス"""
+    start_date: date
+    end_date: date
+    metric: str  # "orders", "quantity", "sales"
+    weekdays: List[str]  # 行（月曜始まり）
+    hours: List[int]  # 列（0〜23時、注文時刻）
+    values: List[List[int]]
+    total: int
+
+
+class DeliveryTimeBucket(BaseModel):
+    """受取時間帯ごとの注文数"""
+    time: str  # HH:MM（時間帯の開始）
+    orders: int
+    quantity: int
+
+
+class DistributionResponse(BaseModel):
+    """客単価・受取時間の分布のレスポンス"""
+    start_date: date
+    end_date: date
+    order_count: int
+    basket_count: int  # お客様×日の買い物の数
+    average_order_value: float
+    average_basket_value: float
+    average_basket_quantity: float
+    bucket_minutes: int
+    delivery_times: List[DeliveryTimeBucket]
+    lead_time_p50_minutes: Optional[float] = None  # 注文から受取までの時間
+    lead_time_p90_minutes: Optional[float] = None
+
+
+class ForecastDay(BaseModel):
+    """日別の予測個数"""
+    date: date
+    quantity: float  # 予測個数（期待値）
+    upper: int  # この数を用意すれば約9割の日で足りる個数
+
+
+class MenuForecastResponse(BaseModel):
+    """メニューごとの需要予測"""
+    menu_id: int
+    menu_name: str
+    days: List[ForecastDay]
+    total_quantity: float
+
+
+class ForecastResponse(BaseModel):
+    """需要予測のレスポンス"""
+    start_date: date
+    end_date: date
+    generated_at: Optional[datetime] = None  # 予測の作成日時（未作成の場合はNone）
+    menus: List[MenuForecastResponse]
+
+
+# ===== デバッグ関連 =====
+
+class QueryTimelineEntry(BaseModel):
+    """クエリタイムラインの1件"""
+    offset_ms: float  # リクエスト開始からの経過時間
+    duration_ms: float
+    statement: str
+    parameters: str
+
+
+class ProfiledRequest(BaseModel):
+    """プロファイル済みリクエスト"""
+    method: str
+    path: str
+    route: str
+    status_code: int
+    started_at: float  # UNIXタイムスタンプ
+    duration_ms: float
+    db_time_ms: float
+    query_count: int
+    queries: List[QueryTimelineEntry]
+
+
+class QueryDebugResponse(BaseModel):
+    """クエリデバッグ情報のレスポンス"""
+    enabled: bool
+    slow_query_ms: float
+    requests: List[ProfiledRequest]
+
+
+class ProfilerStartRequest(BaseModel):
+    """サンプリングプロファイラ開始時のリクエスト"""
+    duration_seconds: int = Field(30, ge=1, le=600)
+    interval_ms: float = Field(5.0, ge=1.0, le=100.0)
+    request_rate: Optional[float] = Field(None, ge=0.0, le=1.0)  # 未指定の場合は全スレッドを採取
+    routes: List[str] = []  # 対象パスのプレフィックス（requestsモードのみ）
+
+
+class ProfilerStatusResponse(BaseModel):
+    """サンプリングプロファイラの状態"""
+    running: bool
+    mode: Optional[str] = None  # "window" or "requests"
+    interval_ms: float
+    request_rate: float
+    route_prefixes: List[str]
+    started_at: Optional[float] = None
+    remaining_seconds: Optional[float] = None
+    samples: int
+    sampled_requests: int
+    unique_stacks: int
+
+
 # ===== 検索・フィルタ関連 =====
 
 class OrderFilter(BaseModel):
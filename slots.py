@@ -0,0 +1,219 @@
+"""
+受取時間枠の容量管理
+
+店舗・時間枠ごとの予約数をカウンタテーブル（pickup_slots）で管理する
+予約は「used + 数量 <= capacity」を条件にした1回の UPDATE で行うため、
+注文テーブルを数えたりロックしたりせずに容量を超える受付を防げる
+"""
+
+import os
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import insert_or_ignore
+from models import PickupSlot
+
+# 環境変数を読み込み
+load_dotenv()
+
+# 時間枠の長さ（分）
+SLOT_MINUTES = int(os.getenv("SLOT_MINUTES", "15"))
+
+# 時間枠あたりの既定の受取可能数（弁当の個数）
+DEFAULT_SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", "40"))
+
+# 受取時間枠の提供時間帯
+SLOT_OPEN = time.fromisoformat(os.getenv("SLOT_OPEN", "10:00"))
+SLOT_CLOSE = time.fromisoformat(os.getenv("SLOT_CLOSE", "14:00"))
+
+
+def slot_start(value: time) -> time:
+    """
+    時刻を含む時間枠の開始時刻
+
+    Args:
+        value: 受取希望時刻
+
+    Returns:
+        time: 時間枠の開始時刻
+    """
+    minute = (value.hour * 60 + value.minute) // SLOT_MINUTES * SLOT_MINUTES
+    return time(minute // 60, minute % 60)
+
+
+def slot_times(start: time = SLOT_OPEN, end: time = SLOT_CLOSE) -> List[time]:
+    """
+    指定範囲の時間枠の開始時刻一覧
+
+    Args:
+        start: 範囲の開始時刻
+        end: 範囲の終了時刻（この時刻から始まる枠は含まない）
+
+    Returns:
+        List[time]: 時間枠の開始時刻
+    """
+    times = []
+    current = datetime.combine(date.min, slot_start(start))
+    last = datetime.combine(date.min, end)
+    while current < last:
+        times.append(current.time())
+        current += timedelta(minutes=SLOT_MINUTES)
+    return times
+
+
+def ensure_slot(db: Session, store_id: int, slot_date: date, slot_time: time,
+                capacity: int = DEFAULT_SLOT_CAPACITY):
+    """
+    時間枠の行が無ければ既定の容量で作成（既にあれば何もしない）
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        slot_date: 日付
+        slot_time: 時間枠の開始時刻
+        capacity: 作成時の容量
+    """
+    insert_or_ignore(
+        db, PickupSlot,
+        {"store_id": store_id, "slot_date": slot_date, "slot_time": slot_time, "capacity": capacity, "used": 0},
+        ["store_id", "slot_date", "slot_time"]
+    )
+
+
+def _increment(db: Session, store_id: int, slot_date: date, slot_time: time, quantity: int,
+               check_capacity: bool) -> bool:
+    stmt = update(PickupSlot).where(
+        PickupSlot.store_id == store_id,
+        PickupSlot.slot_date == slot_date,
+        PickupSlot.slot_time == slot_time
+    )
+    if check_capacity:
+        stmt = stmt.where(PickupSlot.used + quantity <= PickupSlot.capacity)
+    result = db.execute(
+        stmt.values(used=PickupSlot.used + quantity).execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def reserve(db: Session, store_id: int, slot_date: date, delivery_time: time, quantity: int,
+            check_capacity: bool = True) -> bool:
+    """
+    時間枠の容量を予約（呼び出し側のトランザクション内で実行）
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        slot_date: 受取日
+        delivery_time: 受取希望時刻
+        quantity: 数量
+        check_capacity: Falseの場合は容量を超えても予約する（キャンセル取り消し用）
+
+    Returns:
+        bool: 予約できた場合True、満枠の場合False
+    """
+    start = slot_start(delivery_time)
+    if _increment(db, store_id, slot_date, start, quantity, check_capacity):
+        return True
+    # その日の枠がまだ作られていない場合は作成して再試行
+    ensure_slot(db, store_id, slot_date, start)
+    return _increment(db, store_id, slot_date, start, quantity, check_capacity)
+
+
+def release(db: Session, store_id: int, slot_date: date, delivery_time: time, quantity: int):
+    """
+    予約済みの容量を解放（呼び出し側のトランザクション内で実行）
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        slot_date: 受取日
+        delivery_time: 受取希望時刻
+        quantity: 数量
+    """
+    db.execute(
+        update(PickupSlot).where(
+            PickupSlot.store_id == store_id,
+            PickupSlot.slot_date == slot_date,
+            PickupSlot.slot_time == slot_start(delivery_time),
+            PickupSlot.used >= quantity
+        ).values(used=PickupSlot.used - quantity).execution_options(synchronize_session=False)
+    )
+
+
+def set_capacity(db: Session, store_id: int, slot_date: date, capacity: int,
+                 start: time = SLOT_OPEN, end: time = SLOT_CLOSE) -> int:
+    """
+    店舗の指定日の時間枠の容量を設定
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        slot_date: 日付
+        capacity: 容量
+        start: 対象範囲の開始時刻
+        end: 対象範囲の終了時刻
+
+    Returns:
+        int: 更新した時間枠の数
+    """
+    times = slot_times(start, end)
+    for slot_time in times:
+        ensure_slot(db, store_id, slot_date, slot_time, capacity)
+    db.execute(
+        update(PickupSlot).where(
+            PickupSlot.store_id == store_id,
+            PickupSlot.slot_date == slot_date,
+            PickupSlot.slot_time.in_(times)
+        ).values(capacity=capacity).execution_options(synchronize_session=False)
+    )
+    return len(times)
+
+
+def availability(db: Session, store_id: int, slot_date: date, now: Optional[datetime] = None) -> dict:
+    """
+    店舗の指定日の時間枠ごとの空き状況
+
+    行が作られていない枠は既定の容量・予約0として扱う
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        slot_date: 日付
+        now: 現在日時（過ぎた枠の判定用）
+
+    Returns:
+        dict: SlotAvailabilityResponse 形式の辞書
+    """
+    now = now or datetime.now()
+    rows = {
+        row.slot_time: row
+        for row in db.query(PickupSlot).filter(
+            PickupSlot.store_id == store_id,
+            PickupSlot.slot_date == slot_date
+        ).all()
+    }
+    times = sorted(set(slot_times()) | set(rows))
+    slots = []
+    for slot_time in times:
+        row = rows.get(slot_time)
+        capacity = row.capacity if row else DEFAULT_SLOT_CAPACITY
+        used = row.used if row else 0
+        remaining = max(capacity - used, 0)
+        slot_end = datetime.combine(slot_date, slot_time) + timedelta(minutes=SLOT_MINUTES)
+        slots.append({
+            "slot_start": slot_time,
+            "slot_end": slot_end.time(),
+            "capacity": capacity,
+            "reserved": used,
+            "remaining": remaining,
+            "available": remaining > 0 and slot_end > now
+        })
+    return {
+        "date": slot_date.strftime("%Y-%m-%d"),
+        "slot_minutes": SLOT_MINUTES,
+        "slots": slots
+    }
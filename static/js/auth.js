@@ -87,6 +87,13 @@ class AuthForm {
             try {
                 const response = await ApiClient.post('/auth/register', userData);
                 
+                // 店舗スタッフが同じ店舗のスタッフを作成した場合はログインし直さない
+                if (isStoreStaff()) {
+                    UI.showAlert(`${response.full_name}さんのアカウントを作成しました`, 'success');
+                    registerForm.reset();
+                    return;
+                }
+                
                 UI.showAlert('アカウントが作成されました。ログインしてください。', 'success');
                 
                 // ログインページにリダイレクト
@@ -213,6 +220,12 @@ class AuthForm {
             isValid = false;
         }
         
+        // 店舗スタッフは同じ店舗のスタッフのみ作成できる
+        if (userData.role === 'store' && !isStoreStaff()) {
+            this.showFieldError('role', '店舗スタッフのアカウントは店舗スタッフのログイン中のみ作成できます');
+            isValid = false;
+        }
+        
         return isValid;
     }
 
@@ -245,7 +258,10 @@ class AuthForm {
     }
 
     checkExistingAuth() {
-        // 既にログイン済みの場合はリダイレクト
+        // 既にログイン済みの場合はリダイレクト（店舗スタッフはスタッフ作成のため新規登録画面を使える）
+        if (isStoreStaff() && document.getElementById('registerForm')) {
+            return;
+        }
         if (Auth.isLoggedIn() && currentUser) {
             this.redirectAfterLogin(currentUser.role);
         }
@@ -358,6 +374,11 @@ function validateField(field) {
     }
 }
 
+// 店舗スタッフとしてログイン中か
+function isStoreStaff() {
+    return Auth.isLoggedIn() && currentUser.role === 'store';
+}
+
 // DOM読み込み完了時の初期化
 document.addEventListener('DOMContentLoaded', function() {
     new AuthForm();
@@ -377,6 +398,12 @@ document.addEventListener('DOMContentLoaded', function() {
             if (this.checked) {
                 this.parentNode.classList.add('selected');
             }
+            
+            // 店舗スタッフの作成方法を表示
+            const storeGroup = document.getElementById('storeGroup');
+            if (storeGroup) {
+                storeGroup.style.display = this.value === 'store' && this.checked ? '' : 'none';
+            }
         });
     });
     
@@ -5,16 +5,161 @@ const API_BASE_URL = '/api';
 let authToken = localStorage.getItem('authToken');
 let currentUser = JSON.parse(localStorage.getItem('currentUser') || 'null');
 
+// 開発環境（localhost）のみAPIの通信内容をログ出力する
+const API_DEBUG = window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
+const apiLog = API_DEBUG ? console.log.bind(console) : () => {};
+
+// GETレスポンスのキャッシュ（メモリ＋IndexedDB、URLごと）
+// - ETag があれば次回のリクエストで If-None-Match を送り、304 ならキャッシュを使う
+// - ユーザーごとに分けて保存し、ログイン・ログアウト時に全て破棄する
+class ApiCache {
+    static DB_NAME = 'bento-api-cache';
+    static STORE_NAME = 'responses';
+    // これより古いキャッシュは表示に使わない
+    static MAX_AGE_MS = 24 * 60 * 60 * 1000;
+
+    static memory = new Map();
+    static dbPromise = null;
+
+    static key(url) {
+        return `${currentUser ? currentUser.id : 'anonymous'}:${url}`;
+    }
+
+    static openDb() {
+        if (!this.dbPromise) {
+            this.dbPromise = new Promise((resolve) => {
+                // IndexedDB が使えない環境（プライベートモードなど）ではメモリのみ
+                if (!window.indexedDB) {
+                    resolve(null);
+                    return;
+                }
+                const request = indexedDB.open(this.DB_NAME, 1);
+                request.onupgradeneeded = () => request.result.createObjectStore(this.STORE_NAME);
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => resolve(null);
+            });
+        }
+        return this.dbPromise;
+    }
+
+    static async transaction(mode, action) {
+        const db = await this.openDb();
+        if (!db) return undefined;
+        return new Promise((resolve) => {
+            try {
+                const tx = db.transaction(this.STORE_NAME, mode);
+                const request = action(tx.objectStore(this.STORE_NAME));
+                tx.oncomplete = () => resolve(request ? request.result : undefined);
+                tx.onerror = () => resolve(undefined);
+                tx.onabort = () => resolve(undefined);
+            } catch (error) {
+                resolve(undefined);
+            }
+        });
+    }
+
+    static async get(url) {
+        const key = this.key(url);
+        let entry = this.memory.get(key);
+        if (!entry) {
+            entry = await this.transaction('readonly', store => store.get(key));
+            if (entry) {
+                this.memory.set(key, entry);
+            }
+        }
+        if (!entry || Date.now() - entry.storedAt > this.MAX_AGE_MS) {
+            return null;
+        }
+        return entry;
+    }
+
+    static set(url, data, etag) {
+        const key = this.key(url);
+        const entry = { data, etag, storedAt: Date.now() };
+        this.memory.set(key, entry);
+        this.transaction('readwrite', store => store.put(entry, key));
+    }
+
+    // 指定したパスで始まるURLのキャッシュを破棄（更新系のリクエストの後に呼ぶ）
+    static invalidate(pathPrefix) {
+        const prefix = this.key(pathPrefix);
+        for (const key of this.memory.keys()) {
+            if (key.startsWith(prefix)) {
+                this.memory.delete(key);
+            }
+        }
+        this.transaction('readwrite', store => store.delete(IDBKeyRange.bound(prefix, prefix + '\uffff')));
+    }
+
+    static clear() {
+        this.memory.clear();
+        this.transaction('readwrite', store => store.clear());
+    }
+}
+
 // API呼び出し用のヘルパー関数
 class ApiClient {
+    // レート制限中のエンドポイント（"METHOD endpoint" → 再送可能になる時刻）
+    static rateLimitedUntil = new Map();
+    // 実行中のGETリクエスト（同じURLの同時リクエストは1回にまとめる）
+    static inflight = new Map();
+
+    static rateLimitError(retryAfterSeconds) {
+        const error = new Error(`リクエストが多すぎます。${retryAfterSeconds}秒後に再度お試しください。`);
+        error.status = 429;
+        error.retryAfter = retryAfterSeconds;
+        return error;
+    }
+
     static async request(endpoint, options = {}) {
+        const method = options.method || 'GET';
+        if (method !== 'GET') {
+            const responseData = await this.send(endpoint, options);
+            // 更新したリソースのキャッシュを破棄（例: /customer/orders/1/cancel → /customer/orders）
+            ApiCache.invalidate(endpoint.split('?')[0].split('/').slice(0, 3).join('/'));
+            return responseData;
+        }
+
+        const key = ApiCache.key(endpoint);
+        let pending = this.inflight.get(key);
+        if (!pending) {
+            pending = this.fetchWithEtag(endpoint, options).finally(() => this.inflight.delete(key));
+            this.inflight.set(key, pending);
+        }
+        return pending;
+    }
+
+    // キャッシュの ETag を付けてGETし、304 ならキャッシュの値を返す
+    static async fetchWithEtag(endpoint, options) {
+        const cached = await ApiCache.get(endpoint);
+        const headers = { ...options.headers };
+        if (cached && cached.etag) {
+            headers['If-None-Match'] = cached.etag;
+        }
+        const result = await this.send(endpoint, { ...options, headers }, true);
+        if (result.notModified) {
+            apiLog('API Response: 304', endpoint);
+            return cached.data;
+        }
+        ApiCache.set(endpoint, result.data, result.etag);
+        return result.data;
+    }
+
+    static async send(endpoint, options = {}, conditional = false) {
         const url = `${API_BASE_URL}${endpoint}`;
+        const limitKey = `${options.method || 'GET'} ${endpoint}`;
+
+        // 429を受けたエンドポイントには Retry-After が過ぎるまで送信しない
+        const blockedUntil = this.rateLimitedUntil.get(limitKey);
+        if (blockedUntil && Date.now() < blockedUntil) {
+            throw this.rateLimitError(Math.ceil((blockedUntil - Date.now()) / 1000));
+        }
         const config = {
+            ...options,
             headers: {
                 'Content-Type': 'application/json',
                 ...options.headers
-            },
-            ...options
+            }
         };
 
         // 認証トークンがある場合は追加
@@ -23,9 +168,19 @@ class ApiClient {
         }
 
         try {
-            console.log('API Request:', config.method || 'GET', url, config.body ? JSON.parse(config.body) : null);
+            apiLog('API Request:', config.method || 'GET', url, config.body || null);
             const response = await fetch(url, config);
             
+            if (response.status === 429) {
+                const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+                this.rateLimitedUntil.set(limitKey, Date.now() + retryAfter * 1000);
+                throw this.rateLimitError(retryAfter);
+            }
+
+            if (conditional && response.status === 304) {
+                return { notModified: true };
+            }
+
             if (!response.ok) {
                 const errorData = await response.json().catch(() => ({}));
                 console.error('API Error Response:', response.status, errorData);
@@ -33,7 +188,10 @@ class ApiClient {
             }
 
             const responseData = await response.json();
-            console.log('API Response:', responseData);
+            apiLog('API Response:', url);
+            if (conditional) {
+                return { data: responseData, etag: response.headers.get('ETag') };
+            }
             return responseData;
         } catch (error) {
             console.error('API request failed:', error);
@@ -41,10 +199,34 @@ class ApiClient {
         }
     }
 
-    static async get(endpoint, params = {}) {
+    static buildUrl(endpoint, params = {}) {
         const queryString = new URLSearchParams(params).toString();
-        const url = queryString ? `${endpoint}?${queryString}` : endpoint;
-        return this.request(url);
+        return queryString ? `${endpoint}?${queryString}` : endpoint;
+    }
+
+    static async get(endpoint, params = {}) {
+        return this.request(this.buildUrl(endpoint, params));
+    }
+
+    // キャッシュがあればすぐに返し、裏で再検証する（stale-while-revalidate）
+    // 再検証で内容が変わっていれば onUpdate を新しい値で呼ぶ
+    // キャッシュが無い場合は通常のGETと同じ
+    static async getCached(endpoint, params = {}, onUpdate = null) {
+        const url = this.buildUrl(endpoint, params);
+        const cached = await ApiCache.get(url);
+        if (!cached) {
+            return this.request(url);
+        }
+
+        this.request(url).then((data) => {
+            if (data !== cached.data && onUpdate) {
+                onUpdate(data);
+            }
+        }).catch((error) => {
+            // 表示中のキャッシュはそのまま使う
+            apiLog('Revalidation failed:', url, error);
+        });
+        return cached.data;
     }
 
     static async post(endpoint, data) {
@@ -71,6 +253,7 @@ class ApiClient {
 // 認証関連のヘルパー関数
 class Auth {
     static login(token, user) {
+        ApiCache.clear();
         authToken = token;
         currentUser = user;
         localStorage.setItem('authToken', token);
@@ -78,6 +261,7 @@ class Auth {
     }
 
     static logout() {
+        ApiCache.clear();
         authToken = null;
         currentUser = null;
         localStorage.removeItem('authToken');
@@ -372,7 +556,7 @@ window.handleApiError = function(error) {
 };
 
 // デバッグ用
-if (window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1') {
+if (API_DEBUG) {
     window.debugAuth = () => {
         console.log('Current user:', currentUser);
         console.log('Auth token:', authToken);
@@ -21,6 +21,9 @@ class CustomerMenuPage {
         // イベントリスナーの設定
         this.setupEventListeners();
         
+        // 店舗の選択肢の読み込み
+        await this.loadStores();
+        
         // メニューデータの読み込み
         await this.loadMenus();
         
@@ -42,6 +45,15 @@ class CustomerMenuPage {
         const priceMaxInput = document.getElementById('priceMax');
         const filterBtn = document.getElementById('filterBtn');
         const clearFilterBtn = document.getElementById('clearFilterBtn');
+        const storeSelect = document.getElementById('storeSelect');
+
+        if (storeSelect) {
+            // 店舗を変えたらその店舗のメニューを読み直す
+            storeSelect.addEventListener('change', async () => {
+                await this.loadMenus();
+                this.applyFilters();
+            });
+        }
 
         if (searchInput) {
             searchInput.addEventListener('input', debounce(() => this.applyFilters(), 300));
@@ -67,26 +79,39 @@ class CustomerMenuPage {
         });
     }
 
+    async loadStores() {
+        const storeSelect = document.getElementById('storeSelect');
+        if (!storeSelect) return;
+        try {
+            const response = await ApiClient.get('/auth/stores');
+            response.stores.forEach(store => {
+                const option = document.createElement('option');
+                option.value = store.id;
+                option.textContent = store.name;
+                storeSelect.appendChild(option);
+            });
+        } catch (error) {
+            console.error('Failed to load stores:', error);
+        }
+    }
+
     async loadMenus() {
         try {
             this.showLoading();
             
-            const response = await ApiClient.get('/customer/menus', {
+            const params = {
                 per_page: 100 // 全メニューを取得
-            });
-            
-            if (!response || !response.menus) {
-                throw new Error('メニューデータの形式が正しくありません');
-            }
-            
-            this.menus = response.menus;
-            this.filteredMenus = [...this.menus];
-            
-            if (this.menus.length === 0) {
-                this.showEmptyMessage();
-            } else {
-                this.renderMenus();
+            };
+            const storeId = document.getElementById('storeSelect')?.value;
+            if (storeId) {
+                params.store_id = storeId;
             }
+            // 前回のメニューをすぐに表示し、最新のメニュー（売り切れ状態など）が届いたら描き直す
+            const response = await ApiClient.getCached('/customer/menus', params, (latest) => {
+                this.showMenus(latest);
+                this.applyFilters();
+            });
+            this.showMenus(response);
             
         } catch (error) {
             console.error('Failed to load menus:', error);
@@ -107,6 +132,21 @@ class CustomerMenuPage {
         }
     }
 
+    showMenus(response) {
+        if (!response || !response.menus) {
+            throw new Error('メニューデータの形式が正しくありません');
+        }
+        
+        this.menus = response.menus;
+        this.filteredMenus = [...this.menus];
+        
+        if (this.menus.length === 0) {
+            this.showEmptyMessage();
+        } else {
+            this.renderMenus();
+        }
+    }
+
     applyFilters() {
         const searchTerm = document.getElementById('searchInput')?.value.toLowerCase() || '';
         const priceMin = parseInt(document.getElementById('priceMin')?.value) || 0;
@@ -160,16 +200,27 @@ class CustomerMenuPage {
         this.setupPagination();
     }
 
+    srcsetAttributes(menu, sizes) {
+        // アップロード画像は表示幅に合ったサムネイルをブラウザに選ばせる
+        return menu.image_srcset ? `srcset="${menu.image_srcset}" sizes="${sizes}"` : '';
+    }
+
     createMenuCard(menu) {
         const quantity = this.orderItems.get(menu.id) || 0;
         const totalPrice = menu.price * quantity;
+        const soldOut = menu.is_sold_out;
+        const maxQuantity = this.maxQuantity(menu);
 
         return `
             <div class="menu-card" data-menu-id="${menu.id}">
                 <div style="position: relative;">
                     <img src="${menu.image_url}" alt="${menu.name}" class="menu-image" 
+                         ${this.srcsetAttributes(menu, '(max-width: 768px) 100vw, 300px')}
+                         loading="lazy" decoding="async"
                          onerror="this.src='https://via.placeholder.com/300x200?text=No+Image'">
-                    <span class="availability-badge badge-available">利用可能</span>
+                    ${soldOut
+                        ? '<span class="availability-badge badge-unavailable">売り切れ</span>'
+                        : `<span class="availability-badge badge-available">${menu.stock_remaining == null ? '利用可能' : `残り${menu.stock_remaining}個`}</span>`}
                 </div>
                 <div class="menu-content">
                     <h3 class="menu-name">${this.escapeHtml(menu.name)}</h3>
@@ -182,7 +233,7 @@ class CustomerMenuPage {
                                 -
                             </button>
                             <input type="number" class="quantity-input" value="${quantity}" min="0" max="10" readonly>
-                            <button type="button" class="quantity-btn" data-action="increase" ${quantity >= 10 ? 'disabled' : ''}>
+                            <button type="button" class="quantity-btn" data-action="increase" ${quantity >= maxQuantity ? 'disabled' : ''}>
                                 +
                             </button>
                         </div>
@@ -196,8 +247,8 @@ class CustomerMenuPage {
                     
                     <div class="menu-actions">
                         <button type="button" class="btn btn-primary btn-sm order-now-btn" 
-                                ${quantity <= 0 ? 'disabled' : ''}>
-                            今すぐ注文
+                                ${quantity <= 0 || soldOut ? 'disabled' : ''}>
+                            ${soldOut ? '売り切れ' : '今すぐ注文'}
                         </button>
                         <button type="button" class="btn btn-secondary btn-sm view-detail-btn">
                             詳細を見る
@@ -244,11 +295,18 @@ class CustomerMenuPage {
         });
     }
 
+    // 1回の注文で選べる最大数（在庫管理しているメニューは残数まで）
+    maxQuantity(menu) {
+        if (menu.is_sold_out) return 0;
+        return menu.stock_remaining == null ? 10 : Math.min(10, menu.stock_remaining);
+    }
+
     updateQuantity(menuId, action) {
         const currentQuantity = this.orderItems.get(menuId) || 0;
+        const menu = this.menus.find(m => m.id === menuId);
         let newQuantity = currentQuantity;
 
-        if (action === 'increase' && currentQuantity < 10) {
+        if (action === 'increase' && currentQuantity < this.maxQuantity(menu)) {
             newQuantity = currentQuantity + 1;
         } else if (action === 'decrease' && currentQuantity > 0) {
             newQuantity = currentQuantity - 1;
@@ -282,8 +340,8 @@ class CustomerMenuPage {
         const orderBtn = menuCard.querySelector('.order-now-btn');
 
         decreaseBtn.disabled = quantity <= 0;
-        increaseBtn.disabled = quantity >= 10;
-        orderBtn.disabled = quantity <= 0;
+        increaseBtn.disabled = quantity >= this.maxQuantity(menu);
+        orderBtn.disabled = quantity <= 0 || menu.is_sold_out;
 
         // 小計表示を更新
         const orderSummary = menuCard.querySelector('.order-summary');
@@ -350,9 +408,16 @@ class CustomerMenuPage {
             
             // 具体的なエラーメッセージを表示
             let errorMessage = '注文に失敗しました';
-            if (error.message.includes('401')) {
+            if (error.status === 429) {
+                errorMessage = error.message;
+            } else if (error.message.includes('401')) {
                 errorMessage = '認証が切れました。再度ログインしてください。';
                 setTimeout(() => Auth.logout(), 2000);
+            } else if (error.message.includes('sold out')) {
+                errorMessage = '申し訳ありません。このメニューは本日売り切れました。';
+                this.loadMenus();
+            } else if (error.message.includes('slot is full')) {
+                errorMessage = 'ご希望の受取時間は満枠です。別の時間をお選びください。';
             } else if (error.message.includes('404')) {
                 errorMessage = '選択されたメニューは現在利用できません。';
             } else if (error.message.includes('400')) {
@@ -386,7 +451,8 @@ class CustomerMenuPage {
                         <button type="button" class="modal-close">&times;</button>
                     </div>
                     <div class="modal-body">
-                        <img src="${menu.image_url}" alt="${menu.name}" style="width: 100%; max-height: 300px; object-fit: cover; border-radius: 8px; margin-bottom: 1rem;"
+                        <img src="${menu.image_url}" alt="${menu.name}" ${this.srcsetAttributes(menu, '(max-width: 768px) 100vw, 600px')}
+                             style="width: 100%; max-height: 300px; object-fit: cover; border-radius: 8px; margin-bottom: 1rem;"
                              onerror="this.src='https://via.placeholder.com/400x300?text=No+Image'">
                         <p style="color: #6c757d; line-height: 1.6; margin-bottom: 1rem;">
                             ${this.escapeHtml(menu.description || 'メニューの説明はありません。')}
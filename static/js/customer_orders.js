@@ -43,22 +43,11 @@ class CustomerOrdersPage {
         try {
             this.showLoading();
             
-            const response = await ApiClient.get('/customer/orders', {
+            // 前回の注文履歴をすぐに表示し、ステータスが変わっていれば描き直す（変わっていなければ304）
+            const response = await ApiClient.getCached('/customer/orders', {
                 per_page: 100 // 全注文を取得
-            });
-            
-            if (!response || !response.orders) {
-                throw new Error('注文データの形式が正しくありません');
-            }
-            
-            this.orders = response.orders;
-            this.filteredOrders = [...this.orders];
-            
-            if (this.orders.length === 0) {
-                this.showEmptyMessage();
-            } else {
-                this.renderOrders();
-            }
+            }, (latest) => this.showOrders(latest));
+            this.showOrders(response);
             
         } catch (error) {
             console.error('Failed to load orders:', error);
@@ -74,6 +63,20 @@ class CustomerOrdersPage {
         }
     }
 
+    showOrders(response) {
+        if (!response || !response.orders) {
+            throw new Error('注文データの形式が正しくありません');
+        }
+        
+        this.orders = response.orders;
+        
+        if (this.orders.length === 0) {
+            this.showEmptyMessage();
+        } else {
+            this.applyFilters();
+        }
+    }
+
     applyFilters() {
         const statusFilter = document.getElementById('statusFilter')?.value || '';
         
@@ -124,6 +127,8 @@ class CustomerOrdersPage {
                 <div class="order-content">
                     <div class="order-menu">
                         <img src="${order.menu.image_url}" alt="${order.menu.name}" class="order-menu-image"
+                             ${order.menu.image_srcset ? `srcset="${order.menu.image_srcset}" sizes="80px"` : ''}
+                             loading="lazy" decoding="async"
                              onerror="this.src='https://via.placeholder.com/80x60?text=No+Image'">
                         <div class="order-menu-details">
                             <div class="menu-name">${this.escapeHtml(order.menu.name)}</div>
@@ -162,7 +167,7 @@ class CustomerOrdersPage {
             await this.loadOrders();
         } catch (error) {
             console.error('Cancel order failed:', error);
-            UI.showAlert('注文のキャンセルに失敗しました', 'danger');
+            UI.showAlert(error.status === 429 ? error.message : '注文のキャンセルに失敗しました', 'danger');
         }
     }
 
@@ -0,0 +1,160 @@
+"""
+メニューの日別在庫
+
+daily_stock が設定されたメニューは、日ごとの販売済み数をカウンタテーブル
+（menu_daily_stock）で管理する。販売は「sold + 数量 <= stock」を条件にした
+1回の UPDATE で行うため、行ロックを取らずに売り越しを防げる
+
+売り切れ状態はメニュー一覧用に店舗・日ごとにキャッシュし、売り切れ・キャンセル・
+在庫変更のコミット後にその店舗のキャッシュだけを破棄する
+"""
+
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from cache import menu_stock_cache
+from database import insert_or_ignore
+from models import Menu, MenuDailyStock
+
+
+def _increment(db: Session, menu_id: int, stock_date: date, quantity: int,
+               check_stock: bool) -> Optional[int]:
+    stmt = update(MenuDailyStock).where(
+        MenuDailyStock.menu_id == menu_id,
+        MenuDailyStock.stock_date == stock_date
+    )
+    if check_stock:
+        stmt = stmt.where(MenuDailyStock.sold + quantity <= MenuDailyStock.stock)
+    result = db.execute(
+        stmt.values(sold=MenuDailyStock.sold + quantity)
+        .returning(MenuDailyStock.stock - MenuDailyStock.sold)
+        .execution_options(synchronize_session=False)
+    )
+    return result.scalar()
+
+
+def reserve(db: Session, menu: Menu, stock_date: date, quantity: int,
+            check_stock: bool = True) -> Optional[int]:
+    """
+    在庫を引き当て（呼び出し側のトランザクション内で実行）
+
+    daily_stock が設定されたメニューに対してのみ呼ぶ
+
+    Args:
+        db: データベースセッション
+        menu: 在庫管理しているメニュー
+        stock_date: 販売日
+        quantity: 数量
+        check_stock: Falseの場合は在庫を超えても引き当てる（キャンセル取り消し用）
+
+    Returns:
+        Optional[int]: 引き当て後の残数。在庫不足の場合None
+    """
+    remaining = _increment(db, menu.id, stock_date, quantity, check_stock)
+    if remaining is not None:
+        return remaining
+    # その日の在庫行がまだ作られていない場合は作成して再試行
+    insert_or_ignore(
+        db, MenuDailyStock,
+        {"menu_id": menu.id, "stock_date": stock_date, "stock": menu.daily_stock, "sold": 0},
+        ["menu_id", "stock_date"]
+    )
+    return _increment(db, menu.id, stock_date, quantity, check_stock)
+
+
+def release(db: Session, menu_id: int, stock_date: date, quantity: int):
+    """
+    引き当て済みの在庫を戻す（呼び出し側のトランザクション内で実行）
+
+    在庫行が無いメニュー（在庫管理なし）では何もしない
+
+    Args:
+        db: データベースセッション
+        menu_id: メニューID
+        stock_date: 販売日
+        quantity: 数量
+    """
+    db.execute(
+        update(MenuDailyStock).where(
+            MenuDailyStock.menu_id == menu_id,
+            MenuDailyStock.stock_date == stock_date,
+            MenuDailyStock.sold >= quantity
+        ).values(sold=MenuDailyStock.sold - quantity).execution_options(synchronize_session=False)
+    )
+
+
+def set_stock(db: Session, menu: Menu, stock_date: date):
+    """
+    メニューの daily_stock を指定日の在庫行に反映
+
+    既に販売済みの数は保持する（在庫を販売済み数より減らすと以降は売り切れになる）
+
+    Args:
+        db: データベースセッション
+        menu: daily_stock を更新したメニュー
+        stock_date: 対象日
+    """
+    if menu.daily_stock is None:
+        return
+    db.execute(
+        update(MenuDailyStock).where(
+            MenuDailyStock.menu_id == menu.id,
+            MenuDailyStock.stock_date == stock_date
+        ).values(stock=menu.daily_stock).execution_options(synchronize_session=False)
+    )
+
+
+def remaining_by_menu(db: Session, store_id: int, stock_date: date) -> Dict[int, int]:
+    """
+    店舗の在庫管理しているメニューの残数
+
+    在庫行が無いメニューは daily_stock をそのまま残数とする
+
+    Args:
+        db: データベースセッション
+        store_id: 店舗ID
+        stock_date: 対象日
+
+    Returns:
+        Dict[int, int]: メニューID → 残数
+    """
+    rows = db.query(Menu.id, Menu.daily_stock, MenuDailyStock.stock, MenuDailyStock.sold).outerjoin(
+        MenuDailyStock,
+        (MenuDailyStock.menu_id == Menu.id) & (MenuDailyStock.stock_date == stock_date)
+    ).filter(Menu.store_id == store_id, Menu.daily_stock.isnot(None)).all()
+    return {
+        row.id: max((row.stock if row.stock is not None else row.daily_stock) - (row.sold or 0), 0)
+        for row in rows
+    }
+
+
+def annotate(db: Session, menus: Iterable[Menu], stock_date: Optional[date] = None):
+    """
+    メニューに残数・売り切れ状態を設定（MenuResponse の stock_remaining / is_sold_out）
+
+    残数はキャッシュから取得するため数秒遅れることがあるが、
+    売り切れになった時点でキャッシュは破棄される
+
+    Args:
+        db: データベースセッション
+        menus: メニュー（複数の店舗のメニューを含んでもよい）
+        stock_date: 対象日（省略時は本日）
+    """
+    stock_date = stock_date or date.today()
+    remaining_by_store: Dict[int, Dict[int, int]] = {}
+    for menu in menus:
+        remaining = remaining_by_store.get(menu.store_id)
+        if remaining is None:
+            remaining = remaining_by_store[menu.store_id] = menu_stock_cache.get_or_set(
+                (menu.store_id, stock_date), lambda: remaining_by_menu(db, menu.store_id, stock_date)
+            )
+        menu.stock_remaining = remaining.get(menu.id)
+        menu.is_sold_out = menu.stock_remaining == 0
+
+
+def invalidate(store_id: int, stock_date: Optional[date] = None):
+    """店舗の売り切れ状態のキャッシュを破棄（在庫に関わる変更のコミット後に呼ぶ）"""
+    menu_stock_cache.invalidate((store_id, stock_date or date.today()))
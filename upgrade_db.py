@@ -0,0 +1,184 @@
+"""
+既存データベースのアップグレードスクリプト
+
+create_all は既存のテーブルに列・インデックスを追加しないため、
+以前のバージョンで作成したDBに不足している列・インデックスを追加する（何度実行してもよい）
+
+- 無いテーブルを作成
+- 無い列を追加（店舗の列は既定の店舗（最初の店舗、無ければ「本店」を作成）で埋める。
+  注文はメニューの店舗、アーカイブ済み注文もメニューの店舗）
+- PostgreSQLでは NOT NULL の列に NOT NULL 制約を付ける（SQLiteは列の制約を変更できないため付けない）
+- 店舗ごとになった受取時間枠の一意制約・売上レポートのキャッシュの主キーを作り直す
+  （売上レポートのキャッシュは作り直した後の参照時に再集計される）
+- 無いインデックスを作成
+
+使い方:
+    python upgrade_db.py
+    python upgrade_db.py --dry-run   # 実行するSQLを表示するだけ
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from database import engine
+from models import Base, PickupSlot, SalesReportDay
+
+# 既定の店舗の名前（店舗が1つも無い場合に作成）
+DEFAULT_STORE_NAME = "本店"
+
+# 追加した店舗の列を埋めるSQL（:store_id は既定の店舗）
+STORE_BACKFILL = {
+    "users": "UPDATE users SET store_id = :store_id WHERE role = 'store' AND store_id IS NULL",
+    "menus": "UPDATE menus SET store_id = :store_id WHERE store_id IS NULL",
+    "orders": (
+        "UPDATE orders SET store_id = (SELECT menus.store_id FROM menus WHERE menus.id = orders.menu_id) "
+        "WHERE store_id IS NULL"
+    ),
+    "orders_archive": (
+        "UPDATE orders_archive SET store_id = (SELECT menus.store_id FROM menus WHERE menus.id = orders_archive.menu_id) "
+        "WHERE store_id IS NULL"
+    ),
+    "pickup_slots": "UPDATE pickup_slots SET store_id = :store_id WHERE store_id IS NULL",
+}
+
+# 店舗ごとになる前の受取時間枠の一意制約
+LEGACY_SLOT_CONSTRAINT = "uq_pickup_slots_date_time"
+
+
+def _column_ddl(conn, column) -> str:
+    """ADD COLUMN の列定義（NOT NULL は既定値がある場合だけ付ける。追加する列の既定値は文字列・数値のみ）"""
+    preparer = conn.dialect.identifier_preparer
+    ddl = f"{preparer.format_column(column)} {column.type.compile(dialect=conn.dialect)}"
+    default = column.server_default
+    if default is not None and isinstance(default.arg, str):
+        ddl += f" DEFAULT '{default.arg}'"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    for fk in column.foreign_keys:
+        ddl += f" REFERENCES {preparer.quote(fk.column.table.name)} ({preparer.quote(fk.column.name)})"
+    return ddl
+
+
+def _default_store_id(conn, run) -> int:
+    store_id = conn.execute(text("SELECT MIN(id) FROM stores")).scalar()
+    if store_id is None:
+        run(text("INSERT INTO stores (name, is_active) VALUES (:name, :active)"),
+            {"name": DEFAULT_STORE_NAME, "active": True})
+        store_id = conn.execute(text("SELECT MIN(id) FROM stores")).scalar() or 1
+    return store_id
+
+
+def _rebuild_sqlite_slots(conn, run, store_id: int):
+    """SQLiteでは一意制約を削除できないため、受取時間枠のテーブルを作り直して行を移す"""
+    table = PickupSlot.__table__
+    for index in table.indexes:
+        run(text(f"DROP INDEX IF EXISTS {index.name}"))
+    run(text("ALTER TABLE pickup_slots RENAME TO pickup_slots_legacy"))
+    run(CreateTable(table))
+    run(text(
+        "INSERT INTO pickup_slots (id, store_id, slot_date, slot_time, capacity, used) "
+        "SELECT id, :store_id, slot_date, slot_time, capacity, used FROM pickup_slots_legacy"
+    ), {"store_id": store_id})
+    run(text("DROP TABLE pickup_slots_legacy"))
+
+
+def upgrade(dry_run: bool = False) -> int:
+    """
+    不足している列・インデックスを追加
+
+    Args:
+        dry_run: Trueの場合は実行せずSQLを表示する
+
+    Returns:
+        int: 実行した（または実行する）SQLの数
+    """
+    executed = []
+
+    with engine.begin() as conn:
+        def run(statement, params=None):
+            executed.append(statement)
+            print(f"  {str(statement).strip()}")
+            if not dry_run:
+                conn.execute(statement, params or {})
+
+        existing = set(inspect(conn).get_table_names())
+
+        # 売上レポートのキャッシュは主キーが変わったため作り直す（次の参照時に再集計される）
+        reports = SalesReportDay.__table__
+        if reports.name in existing and "store_id" not in {c["name"] for c in inspect(conn).get_columns(reports.name)}:
+            run(text(f"DROP TABLE {reports.name}"))
+            existing.discard(reports.name)
+
+        print("Creating missing tables...")
+        if not dry_run:
+            Base.metadata.create_all(bind=conn)
+        created = [t.name for t in Base.metadata.sorted_tables if t.name not in existing]
+        for name in created:
+            print(f"  CREATE TABLE {name}")
+
+        # 既定の店舗は店舗の列を埋める場合だけ用意する（空のDBでは初期データ投入に任せる）
+        store_id = None
+
+        def default_store_id():
+            nonlocal store_id
+            if store_id is None and (not dry_run or "stores" in existing):
+                store_id = _default_store_id(conn, run)
+            return store_id
+
+        print("Adding missing columns...")
+        legacy_slots = False
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                if table.name == "pickup_slots" and column.name == "store_id" and conn.dialect.name == "sqlite":
+                    legacy_slots = True
+                    continue
+                run(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(conn, column)}"))
+                if column.name == "store_id" and table.name in STORE_BACKFILL:
+                    run(text(STORE_BACKFILL[table.name]), {"store_id": default_store_id()})
+                    if table.name == "pickup_slots":
+                        legacy_slots = True
+                if not column.nullable and conn.dialect.name == "postgresql":
+                    run(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET NOT NULL"))
+
+        # 受取時間枠の一意制約を店舗ごとに作り直す
+        if legacy_slots:
+            if conn.dialect.name == "sqlite":
+                _rebuild_sqlite_slots(conn, run, default_store_id())
+            else:
+                run(text(f"ALTER TABLE pickup_slots DROP CONSTRAINT IF EXISTS {LEGACY_SLOT_CONSTRAINT}"))
+                run(text(
+                    "ALTER TABLE pickup_slots ADD CONSTRAINT uq_pickup_slots_store_date_time "
+                    "UNIQUE (store_id, slot_date, slot_time)"
+                ))
+
+        print("Creating missing indexes...")
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            indexes = {i["name"] for i in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    print(f"  CREATE INDEX {index.name}")
+                    executed.append(index)
+                    if not dry_run:
+                        index.create(bind=conn)
+
+    return len(executed) + len(created)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="既存データベースのアップグレード")
+    parser.add_argument("--dry-run", action="store_true", help="実行するSQLを表示するだけ")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    count = upgrade(args.dry_run)
+    print(f"\n{count} change(s) {'pending' if args.dry_run else 'applied'}.")